@@ -166,8 +166,28 @@ export default function MyPage() {
                 setUploadStatus('success');
                 const supplierName = result.receipt?.supplier_name || '店舗名不明';
                 const totalAmount = result.receipt?.total_amount || '金額不明';
-                const pointsEarned = result.points_earned || 0;
-                const badgesAwarded = result.badges_awarded || [];
+                let pointsEarned = result.points_earned || 0;
+                let badgesAwarded = result.badges_awarded || [];
+
+                // ポイント・バッジはバックグラウンドで付与されるため、完了までポーリングする
+                if (result.rewards_status === 'pending' && result.rewards_url) {
+                    for (let attempt = 0; attempt < 10; attempt++) {
+                        await new Promise((resolve) => setTimeout(resolve, 500));
+                        const rewardsResponse = await fetch(`${apiBaseUrl}${result.rewards_url}`, {
+                            headers: {
+                                'Authorization': `Bearer ${token}`,
+                            },
+                        });
+                        if (!rewardsResponse.ok) break;
+                        const rewards = await rewardsResponse.json();
+                        if (rewards.status === 'completed') {
+                            pointsEarned = rewards.points_earned || 0;
+                            badgesAwarded = rewards.badges_awarded || [];
+                            break;
+                        }
+                        if (rewards.status === 'failed') break;
+                    }
+                }
                 
                 let successMessage = `アップロード成功！ ${supplierName} で ${totalAmount} 円分の貢献を記録しました！`;
                 if (pointsEarned > 0) {
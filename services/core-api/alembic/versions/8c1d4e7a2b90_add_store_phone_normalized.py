@@ -0,0 +1,55 @@
+"""add_store_phone_normalized
+
+Revision ID: 8c1d4e7a2b90
+Revises: 5f3c2a9d8e41
+Create Date: 2026-10-18 14:41:07.503218
+
+"""
+import re
+import unicodedata
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '8c1d4e7a2b90'
+down_revision: Union[str, Sequence[str], None] = '5f3c2a9d8e41'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+# app.normalization.normalize_phone_number と同じ規則（マイグレーション時点の規則を固定するため複製）
+_NON_DIGIT_PATTERN = re.compile(r"\D")
+
+def _normalize_phone_number(phone):
+    if not phone:
+        return None
+    return _NON_DIGIT_PATTERN.sub("", unicodedata.normalize("NFKC", phone)) or None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.add_column('stores', sa.Column('phone_normalized', sa.String(), nullable=True))
+    op.create_index(op.f('ix_stores_phone_normalized'), 'stores', ['phone_normalized'], unique=False)
+
+    # 既存店舗の正規化済み電話番号をバックフィル
+    connection = op.get_bind()
+    stores = connection.execute(
+        sa.text("SELECT id, phone FROM stores WHERE phone IS NOT NULL")
+    ).fetchall()
+    updates = [
+        {"id": store_id, "phone_normalized": _normalize_phone_number(phone)}
+        for store_id, phone in stores
+    ]
+    if updates:
+        connection.execute(
+            sa.text("UPDATE stores SET phone_normalized = :phone_normalized WHERE id = :id"),
+            updates
+        )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index(op.f('ix_stores_phone_normalized'), table_name='stores')
+    op.drop_column('stores', 'phone_normalized')
@@ -0,0 +1,37 @@
+"""add_receipt_dedup_fingerprint
+
+Revision ID: a3d6f08b5c19
+Revises: f1a8c3e62d47
+Create Date: 2026-10-18 19:07:12.558230
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'a3d6f08b5c19'
+down_revision: Union[str, Sequence[str], None] = 'f1a8c3e62d47'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # dedup_fingerprint はユーザー・正規化店名・金額・時間枠（既定30分）のハッシュ
+    # アプリは前後の時間枠のフィンガープリントも照合するため、実効的な重複判定の範囲は
+    # 時間差1枠未満なら必ず重複、2枠未満（既定60分未満）なら時間枠の境界次第で重複となる
+    op.add_column('receipts', sa.Column('dedup_fingerprint', sa.String(length=40), nullable=True))
+    # 既存のレシートはNULLのまま（重複判定はデプロイ後の登録分から有効）
+    op.create_index(
+        'uq_receipts_dedup_fingerprint', 'receipts', ['dedup_fingerprint'], unique=True,
+        postgresql_where=sa.text('dedup_fingerprint IS NOT NULL')
+    )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index('uq_receipts_dedup_fingerprint', table_name='receipts')
+    op.drop_column('receipts', 'dedup_fingerprint')
@@ -0,0 +1,90 @@
+"""add_user_activity_summary
+
+Revision ID: c4e9a1f37b52
+Revises: 8c1d4e7a2b90
+Create Date: 2026-10-18 16:12:44.081392
+
+"""
+from datetime import date, timedelta
+from itertools import groupby
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'c4e9a1f37b52'
+down_revision: Union[str, Sequence[str], None] = '8c1d4e7a2b90'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+def _as_date(value):
+    # SQLiteではDATE()の結果が文字列で返る
+    return value if isinstance(value, date) else date.fromisoformat(str(value))
+
+def _current_streak(upload_dates):
+    """投稿日（降順）から最後に投稿した日までの連続日数を数える"""
+    streak = 1
+    for previous, current in zip(upload_dates, upload_dates[1:]):
+        if previous - current != timedelta(days=1):
+            break
+        streak += 1
+    return streak
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table('user_activity_summary',
+    sa.Column('user_id', sa.Integer(), nullable=False),
+    sa.Column('receipt_count', sa.Integer(), nullable=False),
+    sa.Column('lifetime_amount', sa.Integer(), nullable=False),
+    sa.Column('max_single_amount', sa.Integer(), nullable=False),
+    sa.Column('current_streak', sa.Integer(), nullable=False),
+    sa.Column('last_upload_date', sa.Date(), nullable=True),
+    sa.Column('updated_at', sa.DateTime(timezone=True), server_default=sa.text('now()'), nullable=True),
+    sa.ForeignKeyConstraint(['user_id'], ['users.id'], ),
+    sa.PrimaryKeyConstraint('user_id')
+    )
+
+    # 既存レシートから集計をバックフィル
+    connection = op.get_bind()
+    totals = connection.execute(sa.text(
+        "SELECT user_id, COUNT(*), COALESCE(SUM(total_amount), 0), COALESCE(MAX(total_amount), 0) "
+        "FROM receipts GROUP BY user_id"
+    )).fetchall()
+    upload_dates = connection.execute(sa.text(
+        "SELECT DISTINCT user_id, DATE(created_at) AS upload_date FROM receipts "
+        "WHERE created_at IS NOT NULL ORDER BY user_id, upload_date DESC"
+    )).fetchall()
+
+    streaks = {}
+    for user_id, rows in groupby(upload_dates, key=lambda row: row[0]):
+        dates = [_as_date(row[1]) for row in rows]
+        streaks[user_id] = (_current_streak(dates), dates[0])
+
+    summaries = [
+        {
+            "user_id": user_id,
+            "receipt_count": receipt_count,
+            "lifetime_amount": lifetime_amount,
+            "max_single_amount": max_single_amount,
+            "current_streak": streaks.get(user_id, (0, None))[0],
+            "last_upload_date": streaks.get(user_id, (0, None))[1],
+        }
+        for user_id, receipt_count, lifetime_amount, max_single_amount in totals
+    ]
+    if summaries:
+        connection.execute(
+            sa.text(
+                "INSERT INTO user_activity_summary "
+                "(user_id, receipt_count, lifetime_amount, max_single_amount, current_streak, last_upload_date) "
+                "VALUES (:user_id, :receipt_count, :lifetime_amount, :max_single_amount, :current_streak, :last_upload_date)"
+            ),
+            summaries
+        )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_table('user_activity_summary')
@@ -0,0 +1,34 @@
+"""add_user_badges_unique_constraint
+
+Revision ID: e7b2d5c19a36
+Revises: c4e9a1f37b52
+Create Date: 2026-10-18 17:03:29.640115
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'e7b2d5c19a36'
+down_revision: Union[str, Sequence[str], None] = 'c4e9a1f37b52'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # 重複して授与されたバッジは最初の1件を残して削除
+    op.execute(
+        "DELETE FROM user_badges WHERE id NOT IN ("
+        "SELECT MIN(id) FROM user_badges GROUP BY profile_id, badge_id"
+        ")"
+    )
+    op.create_unique_constraint('uq_user_badges_profile_badge', 'user_badges', ['profile_id', 'badge_id'])
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_constraint('uq_user_badges_profile_badge', 'user_badges', type_='unique')
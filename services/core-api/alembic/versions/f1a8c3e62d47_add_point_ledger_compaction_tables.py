@@ -0,0 +1,75 @@
+"""add_point_ledger_compaction_tables
+
+Revision ID: f1a8c3e62d47
+Revises: e7b2d5c19a36
+Create Date: 2026-10-18 18:20:51.337904
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'f1a8c3e62d47'
+down_revision: Union[str, Sequence[str], None] = 'e7b2d5c19a36'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_index(op.f('ix_point_transactions_profile_id'), 'point_transactions', ['profile_id'], unique=False)
+    op.create_index(op.f('ix_point_transactions_created_at'), 'point_transactions', ['created_at'], unique=False)
+
+    op.create_table('point_transactions_archive',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('profile_id', sa.Integer(), nullable=False),
+    sa.Column('transaction_type', sa.String(), nullable=False),
+    sa.Column('points', sa.Integer(), nullable=False),
+    sa.Column('description', sa.String(), nullable=True),
+    sa.Column('transaction_metadata', sa.JSON(), nullable=True),
+    sa.Column('created_at', sa.DateTime(timezone=True), nullable=True),
+    sa.Column('archived_at', sa.DateTime(timezone=True), server_default=sa.text('now()'), nullable=True),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index(op.f('ix_point_transactions_archive_profile_id'), 'point_transactions_archive', ['profile_id'], unique=False)
+
+    op.create_table('point_transaction_monthly_summaries',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('profile_id', sa.Integer(), nullable=False),
+    sa.Column('month', sa.Date(), nullable=False),
+    sa.Column('transaction_type', sa.String(), nullable=False),
+    sa.Column('points', sa.Integer(), nullable=False),
+    sa.Column('transaction_count', sa.Integer(), nullable=False),
+    sa.ForeignKeyConstraint(['profile_id'], ['gamification_profiles.id'], ),
+    sa.PrimaryKeyConstraint('id'),
+    sa.UniqueConstraint('profile_id', 'month', 'transaction_type', name='uq_point_monthly_summary')
+    )
+    op.create_index(op.f('ix_point_transaction_monthly_summaries_id'), 'point_transaction_monthly_summaries', ['id'], unique=False)
+
+    op.create_table('point_balance_snapshots',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('profile_id', sa.Integer(), nullable=False),
+    sa.Column('balance', sa.Integer(), nullable=False),
+    sa.Column('last_transaction_id', sa.Integer(), nullable=False),
+    sa.Column('created_at', sa.DateTime(timezone=True), server_default=sa.text('now()'), nullable=True),
+    sa.ForeignKeyConstraint(['profile_id'], ['gamification_profiles.id'], ),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index(op.f('ix_point_balance_snapshots_id'), 'point_balance_snapshots', ['id'], unique=False)
+    op.create_index(op.f('ix_point_balance_snapshots_profile_id'), 'point_balance_snapshots', ['profile_id'], unique=False)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index(op.f('ix_point_balance_snapshots_profile_id'), table_name='point_balance_snapshots')
+    op.drop_index(op.f('ix_point_balance_snapshots_id'), table_name='point_balance_snapshots')
+    op.drop_table('point_balance_snapshots')
+    op.drop_index(op.f('ix_point_transaction_monthly_summaries_id'), table_name='point_transaction_monthly_summaries')
+    op.drop_table('point_transaction_monthly_summaries')
+    op.drop_index(op.f('ix_point_transactions_archive_profile_id'), table_name='point_transactions_archive')
+    op.drop_table('point_transactions_archive')
+    op.drop_index(op.f('ix_point_transactions_created_at'), table_name='point_transactions')
+    op.drop_index(op.f('ix_point_transactions_profile_id'), table_name='point_transactions')
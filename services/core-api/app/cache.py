@@ -0,0 +1,21 @@
+import os
+import redis
+
+# Redis設定
+REDIS_URL = os.getenv("REDIS_URL", "redis://localhost:6379")
+
+def _connect_redis():
+    """
+    Redisに接続する
+    接続できない場合はNoneを返し、呼び出し側でメモリベースにフォールバックする
+    """
+    try:
+        client = redis.from_url(REDIS_URL, decode_responses=True)
+        # Redis接続テスト
+        client.ping()
+        return client
+    except (redis.ConnectionError, redis.TimeoutError) as e:
+        print(f"Redis connection failed: {e}")
+        return None
+
+redis_client = _connect_redis()
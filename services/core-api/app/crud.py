@@ -1,7 +1,13 @@
+from sqlalchemy import and_, func, insert, inspect, or_, update
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy.orm import Session
-from typing import Optional
+from sqlalchemy.orm.attributes import set_committed_value
+from typing import List, Optional
+from datetime import date, datetime, timedelta
 from . import models, schemas
 from .security import get_password_hash
+from .normalization import normalize_phone_number
+from .store_matcher import store_name_matcher
 
 # User CRUD
 def get_user(db: Session, user_id: int):
@@ -24,38 +30,199 @@ def create_user(db: Session, user: schemas.UserCreate):
         area=user.area,
         is_owner=user.is_owner
     )
+
+    # 新規ユーザーのゲーミフィケーションプロファイルを作成（ユーザーと同じトランザクションで登録）
+    if not user.is_owner:
+        db_user.gamification_profile = models.GamificationProfile()
+
     db.add(db_user)
     db.commit()
     db.refresh(db_user)
     
-    # 新規ユーザーのゲーミフィケーションプロファイルを作成
-    if not user.is_owner:
-        gamification_profile = models.GamificationProfile(user_id=db_user.id)
-        db.add(gamification_profile)
-        db.commit()
-    
     return db_user
 
 # Receipt CRUD
-def create_receipt(db: Session, receipt: schemas.ReceiptCreate, user_id: int):
-    db_receipt = models.Receipt(
-        **receipt.dict(exclude={"items"}), user_id=user_id
-    )
-    db.add(db_receipt)
-    db.commit()
-    db.refresh(db_receipt)
-    
-    for item_data in receipt.items:
-        db_item = models.ReceiptItem(**item_data.dict(), receipt_id=db_receipt.id)
-        db.add(db_item)
-    
+def create_receipt(db: Session, receipt: schemas.ReceiptCreate, user_id: int, commit: bool = True):
+    """
+    レシートと明細を1トランザクションで作成する
+    commit=Falseの場合はコミットを呼び出し側に任せる（アウトボックスやバッチ登録と同じトランザクションにするため）
+    """
+    return create_receipts_bulk(db, [receipt], user_id, commit=commit)[0]
+
+def create_receipts_bulk(db: Session, receipts: List[schemas.ReceiptCreate], user_id: int, commit: bool = True):
+    """
+    複数のレシートと明細をまとめて作成する
+    レシートは INSERT ... RETURNING、明細は複数行INSERTで登録するため、
+    レシート件数・明細件数によらずINSERTは2文（+コミット）で済む
+    """
+    if not receipts:
+        return []
+
+    db_receipts = db.scalars(
+        insert(models.Receipt).returning(models.Receipt, sort_by_parameter_order=True),
+        [{**receipt.dict(exclude={"items"}), "user_id": user_id} for receipt in receipts]
+    ).all()
+
+    item_rows = [
+        {**item_data.dict(), "receipt_id": db_receipt.id}
+        for db_receipt, receipt in zip(db_receipts, receipts)
+        for item_data in receipt.items
+    ]
+    db_items = db.scalars(
+        insert(models.ReceiptItem).returning(models.ReceiptItem),
+        item_rows
+    ).all() if item_rows else []
+
+    # 明細をリレーションシップに設定（遅延読み込みのSELECTを発生させない）
+    items_by_receipt = {db_receipt.id: [] for db_receipt in db_receipts}
+    for db_item in db_items:
+        items_by_receipt[db_item.receipt_id].append(db_item)
+    for db_receipt in db_receipts:
+        set_committed_value(db_receipt, "items", items_by_receipt[db_receipt.id])
+
+    # 投稿実績の集計をレシートと同じトランザクションで更新
+    record_receipt_activity(db, user_id, db_receipts)
+
+    if commit:
+        commit_receipts(db, db_receipts)
+
+    return db_receipts
+
+def _loaded_values(obj) -> dict:
+    """読み込み済みの属性の値（コミット後に set_committed_value で戻すため）"""
+    state = inspect(obj)
+    return {attr.key: state.dict[attr.key] for attr in state.mapper.attrs if attr.key in state.dict}
+
+def commit_receipts(db: Session, db_receipts: list):
+    """
+    create_receipt(commit=False)で作成したレシートをコミットする（コミット後の再読み込みなし）
+    レシートと明細はセッションに残したまま、コミット前に読み込み済みだった属性だけをコミット後に戻すため、
+    RETURNINGで取得した値のままレスポンスに使え、店舗などの未読み込みの属性は通常どおり遅延読み込みできる
+    """
+    loaded = []
+    for db_receipt in db_receipts:
+        loaded.append((db_receipt, _loaded_values(db_receipt)))
+        loaded.extend((db_item, _loaded_values(db_item)) for db_item in db_receipt.items)
     db.commit()
-    db.refresh(db_receipt)
-    return db_receipt
+    for obj, values in loaded:
+        for key, value in values.items():
+            set_committed_value(obj, key, value)
 
 def get_receipts(db: Session, skip: int = 0, limit: int = 100):
     return db.query(models.Receipt).offset(skip).limit(limit).all()
 
+# ========== User Activity Summary CRUD ==========
+
+def get_user_activity_summary(db: Session, user_id: int) -> Optional[models.UserActivitySummary]:
+    """ユーザーの投稿実績の集計を取得（レシート未投稿ならNone）"""
+    return db.get(models.UserActivitySummary, user_id)
+
+def _lock_user_activity_summary(db: Session, user_id: int) -> models.UserActivitySummary:
+    """集計行を行ロック付きで取得し、なければ作成する"""
+    query = db.query(models.UserActivitySummary).filter(
+        models.UserActivitySummary.user_id == user_id
+    ).with_for_update()
+
+    summary = query.first()
+    if summary:
+        return summary
+
+    try:
+        with db.begin_nested():
+            summary = models.UserActivitySummary(
+                user_id=user_id,
+                receipt_count=0,
+                lifetime_amount=0,
+                max_single_amount=0,
+                current_streak=0
+            )
+            db.add(summary)
+        return summary
+    except IntegrityError:
+        # 同じユーザーの別リクエストが先に作成した場合はその行を使う
+        return query.first()
+
+def record_receipt_activity(db: Session, user_id: int, db_receipts: list):
+    """
+    登録したレシートを投稿実績の集計に反映する（コミットは呼び出し側）
+    集計行1行の差分更新のみで、ユーザーの投稿履歴の長さに依存しない
+    """
+    if not db_receipts:
+        return
+
+    summary = _lock_user_activity_summary(db, user_id)
+
+    def upload_date(receipt):
+        return receipt.created_at.date() if receipt.created_at else date.today()
+
+    for receipt in sorted(db_receipts, key=upload_date):
+        amount = receipt.total_amount or 0
+        summary.receipt_count += 1
+        summary.lifetime_amount += amount
+        summary.max_single_amount = max(summary.max_single_amount, amount)
+
+        # 連続投稿日数（最後に投稿した日までの連続日数）
+        uploaded_on = upload_date(receipt)
+        last = summary.last_upload_date
+        if last is None or uploaded_on > last + timedelta(days=1):
+            summary.current_streak = 1
+        elif uploaded_on == last + timedelta(days=1):
+            summary.current_streak += 1
+        if last is None or uploaded_on > last:
+            summary.last_upload_date = uploaded_on
+
+# ========== Outbox CRUD ==========
+
+def create_outbox_event(db: Session, event_type: str, aggregate_id: int, user_id: int, payload: dict = None, commit: bool = True):
+    """
+    アウトボックスにイベントを記録する
+    commit=Falseの場合は業務データと同じトランザクションでコミットするよう呼び出し側に任せる
+    """
+    db_event = models.OutboxEvent(
+        event_type=event_type,
+        aggregate_id=aggregate_id,
+        user_id=user_id,
+        payload=payload,
+        status="pending",
+        attempts=0
+    )
+    db.add(db_event)
+    if commit:
+        db.commit()
+        db.refresh(db_event)
+    else:
+        db.flush()
+    return db_event
+
+def get_outbox_event(db: Session, event_type: str, aggregate_id: int):
+    return db.query(models.OutboxEvent).filter(
+        models.OutboxEvent.event_type == event_type,
+        models.OutboxEvent.aggregate_id == aggregate_id
+    ).order_by(models.OutboxEvent.id.desc()).first()
+
+def claim_outbox_events(db: Session, event_type: str, limit: int, lease_seconds: int):
+    """
+    未処理のイベントを取得して処理中にする
+    FOR UPDATE SKIP LOCKEDで複数Podのコンシューマーが同じイベントを取らないようにする
+    処理中のまま期限（lease_seconds）を過ぎたイベントも再取得する（コンシューマー停止時の救済）
+    """
+    now = datetime.now()
+    lease_expired = now - timedelta(seconds=lease_seconds)
+    events = db.query(models.OutboxEvent).filter(
+        models.OutboxEvent.event_type == event_type,
+        or_(
+            models.OutboxEvent.status == "pending",
+            and_(models.OutboxEvent.status == "processing", models.OutboxEvent.claimed_at < lease_expired)
+        )
+    ).order_by(models.OutboxEvent.id).limit(limit).with_for_update(skip_locked=True).all()
+
+    for event in events:
+        event.status = "processing"
+        event.attempts += 1
+        event.claimed_at = now
+    db.commit()
+    return events
+
 # ========== ゲーミフィケーション関連CRUD ==========
 
 def get_gamification_profile(db: Session, user_id: int):
@@ -68,41 +235,78 @@ def create_gamification_profile(db: Session, user_id: int):
     db.refresh(db_profile)
     return db_profile
 
-def update_user_points(db: Session, user_id: int, points: int, transaction_type: str, description: str = None, metadata: dict = None):
+def update_user_points(db: Session, user_id: int, points: int, transaction_type: str, description: str = None, metadata: dict = None, commit: bool = True):
     """
     ユーザーのポイントを更新し、トランザクション履歴を記録
+
+    残高はDB上で UPDATE ... SET contribution_points = contribution_points + :delta RETURNING で更新するため、
+    同じユーザーへの同時更新でも加算・減算が失われない
+    redeemは残高が足りる場合のみ更新し（WHERE contribution_points >= :points）、不足時はValueErrorを送出する
+    earn・redeem以外の種類は履歴の記録のみで残高を変えない（point_ledger.BALANCE_TRANSACTION_TYPES と対応）
+    earnはコミット時に週間・月間ランキングにも加算する
+    commit=Falseの場合はコミットを呼び出し側に任せる（プロフィールの作成も含めてコミットしない）
+
+    Returns:
+        更新後の残高（id, contribution_points, total_earned_points）
     """
-    profile = get_gamification_profile(db, user_id)
-    if not profile:
-        profile = create_gamification_profile(db, user_id)
-    
-    # ポイント更新
+    profile_table = models.GamificationProfile
+    values = {}
     if transaction_type == "earn":
-        profile.contribution_points += points
-        profile.total_earned_points += points
+        values["contribution_points"] = profile_table.contribution_points + points
+        values["total_earned_points"] = profile_table.total_earned_points + points
     elif transaction_type == "redeem":
-        profile.contribution_points -= points
-    
-    # トランザクション記録
-    transaction = models.PointTransaction(
-        profile_id=profile.id,
+        values["contribution_points"] = profile_table.contribution_points - points
+    else:
+        values["updated_at"] = func.now()
+
+    stmt = update(profile_table).where(profile_table.user_id == user_id)
+    if transaction_type == "redeem":
+        stmt = stmt.where(profile_table.contribution_points >= points)
+    stmt = stmt.values(**values).returning(
+        profile_table.id, profile_table.contribution_points, profile_table.total_earned_points
+    ).execution_options(synchronize_session=False)
+
+    balance = db.execute(stmt).first()
+    if balance is None:
+        if get_gamification_profile(db, user_id) is not None or transaction_type == "redeem":
+            raise ValueError("ポイントが不足しています")
+        # プロフィール未作成のユーザーは同じトランザクション内で作成してから更新（コミットは呼び出し側の指定どおり）
+        try:
+            with db.begin_nested():
+                db.add(models.GamificationProfile(user_id=user_id, contribution_points=0, total_earned_points=0))
+        except IntegrityError:
+            # 同じユーザーの別リクエストが先に作成した場合はその行を更新する
+            pass
+        balance = db.execute(stmt).first()
+
+    # トランザクション記録（残高更新と同じトランザクション）
+    transaction_id = db.execute(insert(models.PointTransaction).values(
+        profile_id=balance.id,
         transaction_type=transaction_type,
         points=points if transaction_type == "earn" else -points,
         description=description,
         transaction_metadata=metadata
-    )
-    
-    db.add(transaction)
-    db.commit()
-    db.refresh(profile)
-    
-    return profile
+    ).returning(models.PointTransaction.id)).scalar()
+
+    if transaction_type == "earn":
+        # ランキングへの反映はコミット後（ロールバックされた場合は反映しない）
+        from .gamification.leaderboard import leaderboard
+        leaderboard.stage(db, user_id, points, transaction_id)
+
+    if commit:
+        db.commit()
+
+    return balance
 
 def create_badge(db: Session, badge: schemas.BadgeCreate):
+    from .gamification.badge_catalog import badge_catalog
+
     db_badge = models.Badge(**badge.dict())
     db.add(db_badge)
     db.commit()
     db.refresh(db_badge)
+    # バッジ判定用のカタログを次回参照時に再読み込みさせる
+    badge_catalog.invalidate()
     return db_badge
 
 def award_badge(db: Session, user_id: int, badge_id: int):
@@ -270,52 +474,76 @@ def generate_coupon_code(reward_id: int, user_id: int) -> str:
 def redeem_reward(db: Session, user_id: int, reward_id: int):
     """
     特典を交換する
+
+    ポイント消費・交換記録・在庫の減算を1トランザクションで行う
+    在庫は UPDATE ... WHERE available_stock > 0 で減らすため、同時に交換されても在庫数を超えて交換されない
+    数量限定の特典は先にRedisの在庫ゲートで仮押さえし、在庫切れのリクエストはDBに到達させない
+    （在庫の行ロックを保持する時間を短くするため、在庫の減算はコミット直前に行う）
     """
+    from .gamification.reward_stock import reward_stock_gate
+
     # 特典の存在と有効性を確認
     reward = get_reward(db, reward_id)
     if not reward or not reward.is_active:
         raise ValueError("特典が見つからないか、無効です")
-    
-    # 在庫確認
-    if reward.stock_quantity is not None and (reward.available_stock or 0) <= 0:
+
+    limited = reward.stock_quantity is not None
+    if limited and not reward_stock_gate.reserve(db, reward_id):
         raise ValueError("特典の在庫が不足しています")
-    
-    # ユーザーのポイント残高確認
-    profile = get_gamification_profile(db, user_id)
-    if not profile or profile.contribution_points < reward.required_points:
-        raise ValueError("ポイントが不足しています")
-    
+    reserved = limited
+
     # クーポンコード生成
     coupon_code = generate_coupon_code(reward_id, user_id)
     
     # 有効期限計算
     expires_at = datetime.now() + timedelta(days=reward.valid_days)
     
-    # ユーザー特典交換記録作成
-    user_reward = models.UserReward(
-        user_id=user_id,
-        reward_id=reward_id,
-        coupon_code=coupon_code,
-        redeemed_points=reward.required_points,
-        expires_at=expires_at
-    )
-    db.add(user_reward)
-    
-    # ポイント消費
-    update_user_points(
-        db,
-        user_id,
-        reward.required_points,
-        "redeem",
-        f"特典交換: {reward.title}",
-        {"reward_id": reward_id, "coupon_code": coupon_code}
-    )
-    
-    # 在庫更新
-    if reward.stock_quantity is not None:
-        reward.available_stock = (reward.available_stock or 0) - 1
+    try:
+        # ポイント消費（残高が足りない場合はValueError）
+        update_user_points(
+            db,
+            user_id,
+            reward.required_points,
+            "redeem",
+            f"特典交換: {reward.title}",
+            {"reward_id": reward_id, "coupon_code": coupon_code},
+            commit=False
+        )
+        
+        # ユーザー特典交換記録作成
+        user_reward = models.UserReward(
+            user_id=user_id,
+            reward_id=reward_id,
+            coupon_code=coupon_code,
+            redeemed_points=reward.required_points,
+            expires_at=expires_at
+        )
+        db.add(user_reward)
+        db.flush()
+
+        # 在庫更新（在庫が残っている場合のみ）
+        if limited:
+            stock = db.execute(
+                update(models.Reward)
+                .where(models.Reward.id == reward_id, models.Reward.available_stock > 0)
+                .values(available_stock=models.Reward.available_stock - 1)
+                .returning(models.Reward.available_stock)
+                .execution_options(synchronize_session=False)
+            ).first()
+            if stock is None:
+                # 在庫切れのため仮押さえは戻さず、ゲートを0にする
+                reward_stock_gate.mark_sold_out(reward_id)
+                reserved = False
+                raise ValueError("特典の在庫が不足しています")
+
+        # ポイント消費・交換記録・在庫を1トランザクションでコミット
+        db.commit()
+    except Exception:
+        db.rollback()
+        if reserved:
+            reward_stock_gate.release(reward_id)
+        raise
     
-    db.commit()
     db.refresh(user_reward)
     
     return user_reward
@@ -753,21 +981,11 @@ def get_seasonal_products(db: Session, store_id: int, limit: int = 10):
 
 # ========== 店舗マッチングロジック ==========
 
-def normalize_phone_number(phone: str) -> str:
-    """
-    電話番号を正規化（ハイフン、スペース、括弧を削除）
-    例: 092-123-4567 -> 0921234567
-    """
-    if not phone:
-        return ""
-    import re
-    return re.sub(r'[\s\-\(\)]', '', phone)
-
 def find_or_create_store(db: Session, supplier_name: str, supplier_phone: str = None):
     """
     OCRで抽出した店名と電話番号から店舗を検索またはマッチング
     1. 電話番号が一致する店舗を優先検索
-    2. 店名の部分一致で検索
+    2. 店名の完全一致・部分一致・あいまい一致で検索（店名索引を使用）
     3. 見つからなければ新規店舗を自動作成
 
     Args:
@@ -781,28 +999,27 @@ def find_or_create_store(db: Session, supplier_name: str, supplier_phone: str =
     if supplier_phone:
         normalized_phone = normalize_phone_number(supplier_phone)
         if normalized_phone:
-            # 電話番号の正規化一致検索
-            stores = db.query(models.Store).filter(
-                models.Store.phone.isnot(None)
-            ).all()
+            # 正規化済み電話番号のインデックスで一致検索
+            store = db.query(models.Store).filter(
+                models.Store.phone_normalized == normalized_phone
+            ).order_by(models.Store.id).first()
 
-            for store in stores:
-                if normalize_phone_number(store.phone) == normalized_phone:
-                    return store
+            if store:
+                return store
 
-    # 2. 店名での部分一致検索
+    # 2. 店名での照合（プロセス内の店名索引で完全一致・部分一致・あいまい一致）
     if supplier_name:
-        store = db.query(models.Store).filter(
-            models.Store.name.ilike(f"%{supplier_name}%")
-        ).first()
-
-        if store:
-            return store
+        store_id = store_name_matcher.match(db, supplier_name)
+        if store_id is not None:
+            store = db.get(models.Store, store_id)
+            if store:
+                return store
 
-        # 逆パターン: DBの店名がOCR店名に含まれるか
-        stores = db.query(models.Store).all()
-        for store in stores:
-            if store.name and store.name in supplier_name:
+        # 索引に未反映の店舗（他Podで作成された店舗など）も同じ基準で照合してから作成する
+        store_id = store_name_matcher.match_unindexed(db, supplier_name)
+        if store_id is not None:
+            store = db.get(models.Store, store_id)
+            if store:
                 return store
 
     # 3. 見つからない場合は新規店舗を自動作成
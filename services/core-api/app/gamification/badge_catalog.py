@@ -0,0 +1,155 @@
+"""
+バッジカタログ
+標準バッジ（BADGE_MILESTONES）を獲得条件の種類としきい値で引けるようにプロセス内に保持し、
+レシート投稿ごとのバッジ判定をDBに問い合わせずメモリ上で行えるようにする
+
+自動判定の対象は標準バッジのみで、バッジは名前で引き、しきい値は BADGE_MILESTONES の値を使う
+（管理者が作成したバッジは criteria の内容によらず自動判定せず、管理者による授与のみとする）
+
+バッジの作成・変更時（crud.create_badge など）に invalidate() で破棄し、次回参照時に再読み込みする
+（他Podでの変更は BADGE_CATALOG_REFRESH_SECONDS ごとの再読み込みで反映する）
+"""
+
+import os
+import time
+import logging
+import threading
+from typing import Dict, List, Optional, Tuple
+
+from sqlalchemy.orm import Session
+
+from .. import models
+
+logger = logging.getLogger(__name__)
+
+# カタログを再読み込みする間隔（秒）
+BADGE_CATALOG_REFRESH_SECONDS = int(os.getenv("BADGE_CATALOG_REFRESH_SECONDS", "300"))
+
+# 自動判定の対象とする獲得条件の種類（判定順）
+BADGE_CRITERIA_TYPES = ["receipt_count", "consecutive_days", "total_amount", "single_purchase"]
+
+# 標準バッジ（獲得条件の種類, しきい値, 名前, 説明）。カタログ読み込み時に未作成なら作成する
+BADGE_MILESTONES: List[Tuple[str, int, str, str]] = [
+    # アクティビティバッジ
+    ("receipt_count", 1, "はじめの一歩", "初回レシートアップロード"),
+    ("receipt_count", 10, "レシート10枚達成", "10枚のレシートをアップロードしました"),
+    ("receipt_count", 50, "レシート50枚達成", "50枚のレシートをアップロードしました"),
+    ("receipt_count", 100, "レシート100枚達成", "100枚のレシートをアップロードしました"),
+    ("receipt_count", 500, "レシートマスター", "500枚のレシートをアップロードしました"),
+    # 連続利用バッジ
+    ("consecutive_days", 3, "3日坊主卒業", "3日連続でレシートをアップロードしました"),
+    ("consecutive_days", 7, "一週間チャレンジャー", "7日連続でレシートをアップロードしました"),
+    ("consecutive_days", 30, "継続は力なり", "30日連続でレシートをアップロードしました"),
+    # 金額バッジ
+    ("total_amount", 10000, "1万円突破", "累計1万円分のお買い物をしました"),
+    ("total_amount", 50000, "5万円突破", "累計5万円分のお買い物をしました"),
+    ("total_amount", 100000, "10万円突破", "累計10万円分のお買い物をしました"),
+    # 高額単発購入バッジ
+    ("single_purchase", 5000, "高額お買い物", "一度に5000円以上のお買い物をしました"),
+    ("single_purchase", 10000, "大人買い", "一度に1万円以上のお買い物をしました"),
+]
+
+# バッジタイプごとのデフォルトアイコン
+BADGE_ICON_URLS = {
+    "receipt_count": "https://cdn-icons-png.flaticon.com/512/1828/1828506.png",
+    "consecutive_days": "https://cdn-icons-png.flaticon.com/512/1827/1827369.png",
+    "total_amount": "https://cdn-icons-png.flaticon.com/512/1827/1827422.png",
+    "single_purchase": "https://cdn-icons-png.flaticon.com/512/1828/1828884.png"
+}
+DEFAULT_BADGE_ICON_URL = "https://cdn-icons-png.flaticon.com/512/1827/1827380.png"
+
+class BadgeCatalog:
+    """
+    プロセス全体で共有するバッジカタログ
+    獲得条件の種類ごとに (しきい値, バッジID, バッジ名) をしきい値の昇順で保持する
+    """
+
+    def __init__(self, refresh_seconds: int = BADGE_CATALOG_REFRESH_SECONDS):
+        self.refresh_seconds = refresh_seconds
+        self._by_type: Optional[Dict[str, List[Tuple[int, int, str]]]] = None
+        self._loaded_at = 0.0
+        self._dirty = True
+        self._lock = threading.Lock()
+
+    def invalidate(self) -> None:
+        """次回参照時にカタログを再読み込みする"""
+        self._dirty = True
+
+    def load(self, db: Session, create_missing: bool = True) -> Dict[str, List[Tuple[int, int, str]]]:
+        """
+        標準バッジを作成したうえでDBからカタログを読み込む
+        create_missing=Falseの場合は標準バッジを作成せず（DBに書き込まず）、既存のバッジのみを読み込む
+        """
+        with self._lock:
+            if create_missing:
+                self._ensure_milestone_badges(db)
+
+            milestones = {name: (criteria_type, value) for criteria_type, value, name, _ in BADGE_MILESTONES}
+            by_type: Dict[str, List[Tuple[int, int, str]]] = {criteria_type: [] for criteria_type in BADGE_CRITERIA_TYPES}
+            badges = db.query(models.Badge.id, models.Badge.name).filter(
+                models.Badge.name.in_(list(milestones))
+            ).order_by(models.Badge.id).all()
+            loaded = set()
+            for badge_id, name in badges:
+                # 同名のバッジが複数ある場合は最も古いもの
+                if name in loaded:
+                    continue
+                loaded.add(name)
+                criteria_type, value = milestones[name]
+                by_type[criteria_type].append((value, badge_id, name))
+            for entries in by_type.values():
+                entries.sort()
+
+            self._by_type = by_type
+            self._loaded_at = time.monotonic()
+            # 標準バッジを作成していない場合は、次回の判定時に作成・再読み込みする
+            self._dirty = not create_missing
+            logger.info(f"バッジカタログを読み込み: {sum(len(entries) for entries in by_type.values())}件")
+            return by_type
+
+    def eligible_badges(self, db: Session, metrics: Dict[str, int]) -> List[Tuple[int, str]]:
+        """
+        活動実績（獲得条件の種類 → 値）で獲得条件を満たすバッジの (バッジID, バッジ名) を返す
+        DBへの問い合わせはカタログの再読み込みが必要な場合のみ
+        """
+        by_type = self._by_type
+        if by_type is None or self._dirty or time.monotonic() - self._loaded_at > self.refresh_seconds:
+            by_type = self.load(db)
+
+        eligible = []
+        for criteria_type in BADGE_CRITERIA_TYPES:
+            value = metrics.get(criteria_type, 0)
+            for threshold, badge_id, name in by_type[criteria_type]:
+                if value < threshold:
+                    break
+                eligible.append((badge_id, name))
+        return eligible
+
+    def _ensure_milestone_badges(self, db: Session) -> None:
+        """未作成の標準バッジを作成する"""
+        names = [name for _, _, name, _ in BADGE_MILESTONES]
+        existing = {
+            name for (name,) in db.query(models.Badge.name).filter(models.Badge.name.in_(names)).all()
+        }
+        missing = [milestone for milestone in BADGE_MILESTONES if milestone[2] not in existing]
+        if not missing:
+            return
+
+        try:
+            for criteria_type, value, name, description in missing:
+                db.add(models.Badge(
+                    name=name,
+                    description=description,
+                    criteria={"type": criteria_type, "condition": ">=", "value": value},
+                    icon_url=BADGE_ICON_URLS.get(criteria_type, DEFAULT_BADGE_ICON_URL),
+                    is_active=True
+                ))
+            db.commit()
+            logger.info(f"標準バッジを作成: {', '.join(milestone[2] for milestone in missing)}")
+        except Exception as e:
+            # 他のプロセスが同時に作成した場合など。作成済みのバッジで読み込みを続ける
+            logger.error(f"標準バッジ作成エラー: {e}")
+            db.rollback()
+
+# グローバルインスタンス
+badge_catalog = BadgeCatalog()
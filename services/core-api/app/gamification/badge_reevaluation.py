@@ -0,0 +1,128 @@
+"""
+バッジ一括再判定
+全ユーザーの活動実績をSQLの集計で求め、バッジごとに1回の INSERT ... SELECT で未獲得のバッジを授与する
+（バッジの追加・しきい値変更時に、過去の実績に対して遡って授与するためのバッチ処理）
+"""
+
+import time
+import logging
+from typing import Any, Dict, List, Optional
+
+from sqlalchemy import text
+from sqlalchemy.orm import Session
+
+from .badge_catalog import badge_catalog, BADGE_CRITERIA_TYPES
+
+logger = logging.getLogger(__name__)
+
+# ユーザーごとの活動実績（列名は獲得条件の種類）。連続日数は集計テーブルの値を使う
+_CREATE_METRICS_SQL = """
+CREATE TEMPORARY TABLE badge_metrics AS
+SELECT
+    r.user_id AS user_id,
+    COUNT(*) AS receipt_count,
+    COALESCE(SUM(r.total_amount), 0) AS total_amount,
+    COALESCE(MAX(r.total_amount), 0) AS single_purchase,
+    COALESCE(MAX(s.current_streak), 0) AS consecutive_days
+FROM receipts r
+LEFT JOIN user_activity_summary s ON s.user_id = r.user_id
+GROUP BY r.user_id
+"""
+
+_CREATE_MISSING_PROFILES_SQL = """
+INSERT INTO gamification_profiles (user_id, contribution_points, total_earned_points, level)
+SELECT m.user_id, 0, 0, 1
+FROM badge_metrics m
+WHERE NOT EXISTS (SELECT 1 FROM gamification_profiles p WHERE p.user_id = m.user_id)
+"""
+
+_AWARD_SQL = """
+INSERT INTO user_badges (profile_id, badge_id, earned_at)
+SELECT p.id, :badge_id, CURRENT_TIMESTAMP
+FROM badge_metrics m
+JOIN gamification_profiles p ON p.user_id = m.user_id
+WHERE m.{column} >= :threshold
+ON CONFLICT (profile_id, badge_id) DO NOTHING
+"""
+
+_COUNT_MISSING_SQL = """
+SELECT COUNT(*)
+FROM badge_metrics m
+LEFT JOIN gamification_profiles p ON p.user_id = m.user_id
+WHERE m.{column} >= :threshold
+AND NOT EXISTS (
+    SELECT 1 FROM user_badges ub WHERE ub.profile_id = p.id AND ub.badge_id = :badge_id
+)
+"""
+
+def reevaluate_all_badges(
+    db: Session,
+    badge_ids: Optional[List[int]] = None,
+    dry_run: bool = False
+) -> Dict[str, Any]:
+    """
+    全ユーザーのバッジを一括で再判定し、獲得条件を満たす未獲得バッジを授与する
+
+    Args:
+        badge_ids: 対象のバッジID（省略時はカタログ上の全バッジ）
+        dry_run: Trueの場合は授与せず、授与対象の件数のみを数える（未作成の標準バッジは対象外）
+
+    Returns:
+        Dict: users（実績のあるユーザー数）, profiles_created, badges（バッジごとの授与件数）,
+              total_awarded, duration_seconds
+    """
+    started_at = time.perf_counter()
+    # ドライランでは未作成の標準バッジを作成しない（DBに書き込まない）
+    catalog = badge_catalog.load(db, create_missing=not dry_run)
+
+    try:
+        db.execute(text("DROP TABLE IF EXISTS badge_metrics"))
+        db.execute(text(_CREATE_METRICS_SQL))
+        users = db.execute(text("SELECT COUNT(*) FROM badge_metrics")).scalar()
+
+        profiles_created = 0
+        if not dry_run:
+            profiles_created = db.execute(text(_CREATE_MISSING_PROFILES_SQL)).rowcount
+
+        results = []
+        for criteria_type in BADGE_CRITERIA_TYPES:
+            for threshold, badge_id, name in catalog[criteria_type]:
+                if badge_ids and badge_id not in badge_ids:
+                    continue
+
+                params = {"badge_id": badge_id, "threshold": threshold}
+                if dry_run:
+                    awarded = db.execute(text(_COUNT_MISSING_SQL.format(column=criteria_type)), params).scalar()
+                else:
+                    awarded = db.execute(text(_AWARD_SQL.format(column=criteria_type)), params).rowcount
+
+                results.append({
+                    "badge_id": badge_id,
+                    "badge_name": name,
+                    "criteria_type": criteria_type,
+                    "threshold": threshold,
+                    "awarded": awarded
+                })
+
+        db.execute(text("DROP TABLE IF EXISTS badge_metrics"))
+        if dry_run:
+            db.rollback()
+        else:
+            db.commit()
+    except Exception:
+        db.rollback()
+        raise
+
+    report = {
+        "dry_run": dry_run,
+        "users": users,
+        "profiles_created": profiles_created,
+        "badges": results,
+        "total_awarded": sum(result["awarded"] for result in results),
+        "duration_seconds": round(time.perf_counter() - started_at, 3)
+    }
+    logger.info(
+        f"バッジ一括再判定: ユーザー{users}人, 授与{report['total_awarded']}件, "
+        f"{report['duration_seconds']}秒{'（ドライラン）' if dry_run else ''}"
+    )
+    return report
@@ -0,0 +1,361 @@
+"""
+貢献ポイントのランキング
+週間・月間の獲得ポイントを、全体・居住エリア別・年代別の Redis Sorted Set に保持する
+（キー: leaderboard:{weekly|monthly}:{期間}:{global|area:エリア|age_group:年代}）
+
+update_user_points で獲得したポイントはセッションに積んでおき、コミット後に ZINCRBY で反映する
+（ロールバックされたポイントはランキングに入らない）
+上位N件・自分の順位は ZREVRANGE / ZREVRANK で取得し、Redisが利用できない場合はポイント履歴を集計する
+
+再構築中は、加算したポイント履歴のIDを期間ごとの記録（journal）にも残す
+再構築はポイント履歴のスナップショットから作ったランキングに、スナップショットに含まれない記録分を加えてから置き換えるため、
+稼働中に再構築しても加算が失われない
+"""
+
+import os
+import logging
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional, Tuple
+
+from sqlalchemy import event, func, select, union_all
+from sqlalchemy.orm import Session
+
+from .. import models
+from ..cache import redis_client
+from ..weather_context import JST
+
+logger = logging.getLogger(__name__)
+
+LEADERBOARD_WINDOWS = ("weekly", "monthly")
+LEADERBOARD_SCOPES = ("global", "area", "age_group")
+# 終了した期間のランキングを保持する期間数（先週・先月の順位を参照できるように）
+LEADERBOARD_RETENTION_PERIODS = int(os.getenv("LEADERBOARD_RETENTION_PERIODS", "4"))
+# 再構築時に1回のZADDで登録する件数
+LEADERBOARD_REBUILD_CHUNK_SIZE = 1000
+# 再構築中の加算の記録を保持する秒数（再構築が異常終了した場合に残らないように）
+LEADERBOARD_REBUILD_JOURNAL_TTL_SECONDS = int(os.getenv("LEADERBOARD_REBUILD_JOURNAL_TTL_SECONDS", "3600"))
+
+# セッションに積んだ未反映のポイント（session.info のキー）
+_PENDING_KEY = "leaderboard_pending"
+
+# 各ランキングに加算し、再構築中であればポイント履歴のIDを記録する
+# KEYS[1]: 再構築中の目印, KEYS[2]: 記録, KEYS[3..]: ランキング / ARGV: user_id, ポイント, TTL, ポイント履歴のID
+_PUBLISH_SCRIPT = """
+for i = 3, #KEYS do
+    redis.call('ZINCRBY', KEYS[i], ARGV[2], ARGV[1])
+    redis.call('EXPIRE', KEYS[i], ARGV[3])
+end
+if redis.call('EXISTS', KEYS[1]) == 1 then
+    redis.call('RPUSH', KEYS[2], ARGV[4])
+    redis.call('EXPIRE', KEYS[2], redis.call('TTL', KEYS[1]))
+end
+"""
+
+# 未反映の記録がなければ、一時キーでランキングを置き換えて再構築を終える（記録が増えていれば0）
+# KEYS[1]: 再構築中の目印, KEYS[2]: 記録, KEYS[3..]: (一時キー, ランキング) の組、続いて削除するランキング
+# ARGV: 反映済みの記録の件数, 置き換えるランキングの数, TTL
+_SWAP_SCRIPT = """
+if redis.call('LLEN', KEYS[2]) > tonumber(ARGV[1]) then
+    return 0
+end
+local boards = tonumber(ARGV[2])
+for i = 0, boards - 1 do
+    redis.call('RENAME', KEYS[3 + i * 2], KEYS[4 + i * 2])
+    redis.call('EXPIRE', KEYS[4 + i * 2], ARGV[3])
+end
+for i = 3 + boards * 2, #KEYS do
+    redis.call('DEL', KEYS[i])
+end
+redis.call('DEL', KEYS[1], KEYS[2])
+return 1
+"""
+
+def period_bounds(window: str, at: Optional[datetime] = None) -> Tuple[str, datetime, datetime]:
+    """
+    atを含む期間（日本時間の月曜始まりの週・暦月）を返す
+
+    Returns:
+        Tuple: (期間のキー 例: 2026-W42 / 2026-10, 開始日時, 終了日時)
+    """
+    local = (at or datetime.now(JST)).astimezone(JST)
+    day = local.replace(hour=0, minute=0, second=0, microsecond=0)
+    if window == "weekly":
+        start = day - timedelta(days=day.weekday())
+        iso_year, iso_week, _ = start.isocalendar()
+        return f"{iso_year}-W{iso_week:02d}", start, start + timedelta(days=7)
+    if window == "monthly":
+        start = day.replace(day=1)
+        end = (start + timedelta(days=32)).replace(day=1)
+        return start.strftime("%Y-%m"), start, end
+    raise ValueError(f"不明な集計期間です: {window}")
+
+def _scopes(area: Optional[str], age_group: Optional[str]) -> List[Tuple[str, Optional[str]]]:
+    scopes = [("global", None)]
+    if area:
+        scopes.append(("area", area))
+    if age_group:
+        scopes.append(("age_group", age_group))
+    return scopes
+
+def _earned_points(start: datetime, end: datetime, *columns):
+    """
+    期間内のユーザーごとの獲得ポイント（user_id, *columns, points）
+    コンパクションで退避済み（point_transactions_archive）の履歴も含める
+    """
+    ledger = union_all(*(
+        select(table.profile_id, table.points).where(
+            table.transaction_type == "earn",
+            table.created_at >= start,
+            table.created_at < end
+        )
+        for table in (models.PointTransaction, models.PointTransactionArchive)
+    )).subquery()
+    return (
+        select(models.User.id.label("user_id"), *columns, func.sum(ledger.c.points).label("points"))
+        .select_from(ledger)
+        .join(models.GamificationProfile, models.GamificationProfile.id == ledger.c.profile_id)
+        .join(models.User, models.User.id == models.GamificationProfile.user_id)
+        .group_by(models.User.id, *columns)
+    )
+
+def _scope_scores(start: datetime, end: datetime, scope: str, scope_value: Optional[str]):
+    """ランキング1つ分の獲得ポイント（Redisが利用できない場合の集計）"""
+    query = _earned_points(start, end)
+    if scope == "area":
+        query = query.where(models.User.area == scope_value)
+    elif scope == "age_group":
+        query = query.where(models.User.age_group == scope_value)
+    return query.subquery()
+
+def leaderboard_key(window: str, period: str, scope: str, scope_value: Optional[str] = None) -> str:
+    return f"leaderboard:{window}:{period}:{scope}" + (f":{scope_value}" if scope_value else "")
+
+def _rebuild_keys(window: str, period: str) -> Tuple[str, str]:
+    """再構築中の目印と、再構築中の加算の記録のキー"""
+    return f"leaderboard_rebuild:{window}:{period}", f"leaderboard_rebuild:{window}:{period}:journal"
+
+def _ttl_seconds(start: datetime, end: datetime, at: datetime) -> int:
+    return max(int((end - at).total_seconds() + (end - start).total_seconds() * LEADERBOARD_RETENTION_PERIODS), 1)
+
+class Leaderboard:
+    """
+    ランキングの更新と参照
+    Redisが利用できない場合、更新は行わず、参照はポイント履歴（point_transactions）を集計する
+    """
+
+    def __init__(self):
+        self._publish = redis_client.register_script(_PUBLISH_SCRIPT) if redis_client is not None else None
+        self._swap = redis_client.register_script(_SWAP_SCRIPT) if redis_client is not None else None
+
+    def stage(self, db: Session, user_id: int, points: int, transaction_id: int) -> None:
+        """獲得ポイント（ポイント履歴のID）をセッションに積む（コミット後に反映）"""
+        user = db.get(models.User, user_id)
+        db.info.setdefault(_PENDING_KEY, []).append(
+            (user_id, points, user.area if user else None, user.age_group if user else None, datetime.now(JST), transaction_id)
+        )
+
+    def publish(self, updates: List[Tuple[int, int, Optional[str], Optional[str], datetime, int]]) -> None:
+        """コミット済みの獲得ポイントを各ランキングに加算する"""
+        if self._publish is None:
+            return
+        try:
+            pipe = redis_client.pipeline(transaction=False)
+            for user_id, points, area, age_group, at, transaction_id in updates:
+                for window in LEADERBOARD_WINDOWS:
+                    period, start, end = period_bounds(window, at)
+                    keys = [leaderboard_key(window, period, scope, scope_value) for scope, scope_value in _scopes(area, age_group)]
+                    self._publish(
+                        keys=[*_rebuild_keys(window, period), *keys],
+                        args=[user_id, points, _ttl_seconds(start, end, at), transaction_id],
+                        client=pipe
+                    )
+            pipe.execute()
+        except Exception as e:
+            logger.error(f"ランキング更新エラー(Redis): {e}")
+
+    def top(
+        self,
+        db: Session,
+        window: str,
+        scope: str = "global",
+        scope_value: Optional[str] = None,
+        limit: int = 10,
+        at: Optional[datetime] = None
+    ) -> List[Tuple[int, int]]:
+        """上位limit件の (user_id, ポイント)"""
+        period, start, end = period_bounds(window, at)
+        if redis_client is not None:
+            try:
+                entries = redis_client.zrevrange(
+                    leaderboard_key(window, period, scope, scope_value), 0, limit - 1, withscores=True
+                )
+                return [(int(user_id), int(score)) for user_id, score in entries]
+            except Exception as e:
+                logger.error(f"ランキング取得エラー(Redis): {e}")
+
+        scores = _scope_scores(start, end, scope, scope_value)
+        return [
+            (user_id, int(points))
+            for user_id, points in db.execute(
+                select(scores.c.user_id, scores.c.points).order_by(scores.c.points.desc(), scores.c.user_id).limit(limit)
+            )
+        ]
+
+    def rank(
+        self,
+        db: Session,
+        window: str,
+        user_id: int,
+        scope: str = "global",
+        scope_value: Optional[str] = None,
+        at: Optional[datetime] = None
+    ) -> Optional[Tuple[int, int]]:
+        """ユーザーの (順位, ポイント)。期間内の獲得がない場合はNone"""
+        period, start, end = period_bounds(window, at)
+        if redis_client is not None:
+            try:
+                key = leaderboard_key(window, period, scope, scope_value)
+                pipe = redis_client.pipeline(transaction=False)
+                pipe.zrevrank(key, user_id)
+                pipe.zscore(key, user_id)
+                position, score = pipe.execute()
+                return (position + 1, int(score)) if position is not None else None
+            except Exception as e:
+                logger.error(f"ランキング取得エラー(Redis): {e}")
+
+        scores = _scope_scores(start, end, scope, scope_value)
+        mine = db.execute(select(scores.c.points).where(scores.c.user_id == user_id)).scalar()
+        if mine is None:
+            return None
+        higher = db.execute(select(func.count()).select_from(scores).where(scores.c.points > mine)).scalar()
+        return higher + 1, int(mine)
+
+    def rebuild(self, db: Session, windows=LEADERBOARD_WINDOWS, periods: int = 1, dry_run: bool = False) -> Dict[str, Any]:
+        """
+        ポイント履歴から現在（と過去periods-1期間）のランキングを作り直す
+        期間ごとに一時キーへ登録してから置き換えるため、再構築中も参照でき、再構築中の加算も失われない
+
+        Returns:
+            Dict: 期間ごとの boards（ランキング数）と entries（登録件数）
+        """
+        if redis_client is None and not dry_run:
+            raise RuntimeError("Redisに接続できないためランキングを再構築できません")
+
+        report = {}
+        now = datetime.now(JST)
+        for window in windows:
+            at = now
+            for _ in range(periods):
+                period, start, end = period_bounds(window, at)
+                if dry_run:
+                    boards = self._snapshot_boards(db, window, period, start, end)
+                    db.rollback()
+                else:
+                    boards = self._rebuild_period(db, window, period, start, end)
+                report[f"{window}:{period}"] = {
+                    "boards": len(boards),
+                    "entries": sum(len(entries) for entries in boards.values())
+                }
+                at = start - timedelta(seconds=1)
+        return report
+
+    def _snapshot_boards(self, db: Session, window: str, period: str, start: datetime, end: datetime) -> Dict[str, Dict[int, int]]:
+        """ポイント履歴の集計から作ったランキング（キー -> {user_id: ポイント}）"""
+        boards: Dict[str, Dict[int, int]] = {}
+        rows = db.execute(_earned_points(start, end, models.User.area, models.User.age_group))
+        for user_id, area, age_group, points in rows:
+            for scope, scope_value in _scopes(area, age_group):
+                boards.setdefault(leaderboard_key(window, period, scope, scope_value), {})[user_id] = int(points)
+        return boards
+
+    def _rebuild_period(self, db: Session, window: str, period: str, start: datetime, end: datetime) -> Dict[str, Dict[int, int]]:
+        """
+        1期間分のランキングを作り直す
+
+        1. 再構築中の目印を立てる（以降の加算はポイント履歴のIDが記録される）
+        2. ポイント履歴のスナップショットを集計して一時キーに登録する
+        3. 記録のうちスナップショットに含まれないポイント履歴を一時キーに加算する
+        4. 未反映の記録がなければ一時キーで置き換える（あれば3に戻る）
+        """
+        marker, journal = _rebuild_keys(window, period)
+        # 異常終了した前回の再構築の一時キーを残さない
+        leftovers = list(redis_client.scan_iter(match=leaderboard_key(window, period, "*") + ":rebuild"))
+        redis_client.delete(journal, *leftovers)
+        redis_client.set(marker, 1, ex=LEADERBOARD_REBUILD_JOURNAL_TTL_SECONDS)
+        try:
+            db.rollback()
+            if db.get_bind().dialect.name == "postgresql":
+                # 記録との突き合わせまで同じスナップショットを参照する
+                db.connection(execution_options={"isolation_level": "REPEATABLE READ"})
+            boards = self._snapshot_boards(db, window, period, start, end)
+
+            for key, entries in boards.items():
+                items = list(entries.items())
+                pipe = redis_client.pipeline()
+                for offset in range(0, len(items), LEADERBOARD_REBUILD_CHUNK_SIZE):
+                    pipe.zadd(f"{key}:rebuild", dict(items[offset:offset + LEADERBOARD_REBUILD_CHUNK_SIZE]))
+                pipe.execute()
+
+            ttl = _ttl_seconds(start, end, datetime.now(JST))
+            applied = 0
+            while True:
+                transaction_ids = [int(value) for value in redis_client.lrange(journal, applied, -1)]
+                applied += len(transaction_ids)
+                self._apply_journal(db, window, period, transaction_ids, boards)
+
+                stale = {
+                    key for key in redis_client.scan_iter(match=leaderboard_key(window, period, "*"))
+                    if not key.endswith(":rebuild")
+                } - set(boards)
+                swap_keys = [key for board in boards for key in (f"{board}:rebuild", board)]
+                if self._swap(keys=[marker, journal, *swap_keys, *stale], args=[applied, len(boards), ttl]):
+                    return boards
+        finally:
+            db.rollback()
+            redis_client.delete(marker, journal)
+
+    def _apply_journal(
+        self, db: Session, window: str, period: str, transaction_ids: List[int], boards: Dict[str, Dict[int, int]]
+    ) -> None:
+        """再構築中に加算されたポイント履歴のうち、スナップショットに含まれないものを一時キーに加算する"""
+        if not transaction_ids:
+            return
+        in_snapshot = set(db.scalars(
+            select(models.PointTransaction.id).where(models.PointTransaction.id.in_(transaction_ids))
+        ))
+        missing = [transaction_id for transaction_id in transaction_ids if transaction_id not in in_snapshot]
+        if not missing:
+            return
+
+        # スナップショット後にコミットされた履歴は別の接続で読む
+        with db.get_bind().connect() as connection:
+            rows = connection.execute(
+                select(models.User.id, models.User.area, models.User.age_group, models.PointTransaction.points)
+                .join(models.GamificationProfile, models.GamificationProfile.id == models.PointTransaction.profile_id)
+                .join(models.User, models.User.id == models.GamificationProfile.user_id)
+                .where(models.PointTransaction.id.in_(missing))
+            ).all()
+
+        pipe = redis_client.pipeline()
+        for user_id, area, age_group, points in rows:
+            for scope, scope_value in _scopes(area, age_group):
+                key = leaderboard_key(window, period, scope, scope_value)
+                entries = boards.setdefault(key, {})
+                entries[user_id] = entries.get(user_id, 0) + points
+                pipe.zincrby(f"{key}:rebuild", points, user_id)
+        pipe.execute()
+
+@event.listens_for(Session, "after_commit")
+def _publish_after_commit(session: Session) -> None:
+    updates = session.info.pop(_PENDING_KEY, None)
+    if updates:
+        leaderboard.publish(updates)
+
+@event.listens_for(Session, "after_soft_rollback")
+def _discard_after_rollback(session: Session, previous_transaction) -> None:
+    # セーブポイントのロールバックでは外側のトランザクションのポイントを残す
+    if not previous_transaction.nested:
+        session.info.pop(_PENDING_KEY, None)
+
+# グローバルインスタンス
+leaderboard = Leaderboard()
@@ -0,0 +1,178 @@
+"""
+ポイント履歴のコンパクション
+保持期間を過ぎた point_transactions を月次集計（point_transaction_monthly_summaries）にまとめ、
+元の行はコールドテーブル（point_transactions_archive）へ移す
+退避した分の合計はプロフィールごとの残高スナップショット（point_balance_snapshots）に積み上げ、
+「最新スナップショット + point_transactions の合計 = contribution_points」が常に成り立つようにする
+（合計するのは残高を増減する種類の履歴のみ。記録のみの種類は退避するがスナップショットには含めない）
+"""
+
+import os
+import time
+import logging
+from datetime import datetime
+from typing import Any, Dict, Optional
+
+from sqlalchemy import text
+from sqlalchemy.orm import Session
+
+logger = logging.getLogger(__name__)
+
+# point_transactions に残す期間（月）。これより前の月の履歴を退避する
+POINT_LEDGER_RETENTION_MONTHS = int(os.getenv("POINT_LEDGER_RETENTION_MONTHS", "6"))
+# 1トランザクションで退避する履歴のID範囲
+POINT_LEDGER_COMPACTION_BATCH_SIZE = int(os.getenv("POINT_LEDGER_COMPACTION_BATCH_SIZE", "10000"))
+# 検証で返す不一致プロフィールの最大件数
+POINT_LEDGER_VERIFY_SAMPLE_SIZE = 100
+# 残高（contribution_points）を points の符号どおりに増減する履歴の種類
+# update_user_points の earn / redeem と、ポイント再計算の adjustment（それ以外の種類は記録のみで残高を変えない）
+BALANCE_TRANSACTION_TYPES = ("earn", "redeem", "adjustment")
+
+def _balance_delta(alias: str = "") -> str:
+    """履歴1件による残高の増減（SQL式）"""
+    prefix = f"{alias}." if alias else ""
+    types = ", ".join(f"'{transaction_type}'" for transaction_type in BALANCE_TRANSACTION_TYPES)
+    return f"CASE WHEN {prefix}transaction_type IN ({types}) THEN {prefix}points ELSE 0 END"
+
+# 退避対象の範囲（IDの範囲で分割し、保持期間より前の行のみ）
+_WINDOW = "id > :low AND id <= :high AND created_at < :cutoff"
+
+_UPSERT_MONTHLY_SUMMARIES_SQL = f"""
+INSERT INTO point_transaction_monthly_summaries (profile_id, month, transaction_type, points, transaction_count)
+SELECT profile_id, CAST(date_trunc('month', created_at) AS DATE), transaction_type, SUM(points), COUNT(*)
+FROM point_transactions
+WHERE {_WINDOW}
+GROUP BY profile_id, CAST(date_trunc('month', created_at) AS DATE), transaction_type
+ON CONFLICT (profile_id, month, transaction_type) DO UPDATE SET
+    points = point_transaction_monthly_summaries.points + excluded.points,
+    transaction_count = point_transaction_monthly_summaries.transaction_count + excluded.transaction_count
+"""
+
+_INSERT_SNAPSHOTS_SQL = f"""
+INSERT INTO point_balance_snapshots (profile_id, balance, last_transaction_id)
+SELECT
+    t.profile_id,
+    COALESCE((
+        SELECT s.balance FROM point_balance_snapshots s
+        WHERE s.profile_id = t.profile_id
+        ORDER BY s.id DESC LIMIT 1
+    ), 0) + SUM({_balance_delta("t")}),
+    MAX(t.id)
+FROM point_transactions t
+WHERE {_WINDOW}
+GROUP BY t.profile_id
+"""
+
+_ARCHIVE_SQL = f"""
+INSERT INTO point_transactions_archive (id, profile_id, transaction_type, points, description, transaction_metadata, created_at)
+SELECT id, profile_id, transaction_type, points, description, transaction_metadata, created_at
+FROM point_transactions
+WHERE {_WINDOW}
+"""
+
+_DELETE_SQL = f"DELETE FROM point_transactions WHERE {_WINDOW}"
+
+_VERIFY_SQL = f"""
+SELECT p.id, p.user_id, COALESCE(p.contribution_points, 0), COALESCE(snap.balance, 0) + COALESCE(tail.points, 0)
+FROM gamification_profiles p
+LEFT JOIN (
+    SELECT profile_id, SUM({_balance_delta()}) AS points FROM point_transactions GROUP BY profile_id
+) tail ON tail.profile_id = p.id
+LEFT JOIN point_balance_snapshots snap ON snap.id = (
+    SELECT MAX(s.id) FROM point_balance_snapshots s WHERE s.profile_id = p.id
+)
+WHERE COALESCE(p.contribution_points, 0) <> COALESCE(snap.balance, 0) + COALESCE(tail.points, 0)
+"""
+
+def ledger_cutoff(retention_months: int = POINT_LEDGER_RETENTION_MONTHS, now: Optional[datetime] = None) -> datetime:
+    """退避の境界（保持期間の開始月の月初）を返す"""
+    now = now or datetime.now()
+    month_index = now.year * 12 + now.month - 1 - retention_months
+    return datetime(month_index // 12, month_index % 12 + 1, 1)
+
+def verify_point_balances(db: Session) -> Dict[str, Any]:
+    """
+    プロフィールごとに「最新スナップショット + point_transactions の合計 = contribution_points」を検証する
+    合計するのは残高を増減する種類（BALANCE_TRANSACTION_TYPES）の履歴のみ
+
+    Returns:
+        Dict: profiles_checked, mismatches（件数）, samples（不一致の例）
+    """
+    profiles_checked = db.execute(text("SELECT COUNT(*) FROM gamification_profiles")).scalar()
+    rows = db.execute(text(_VERIFY_SQL)).fetchall()
+    return {
+        "profiles_checked": profiles_checked,
+        "mismatches": len(rows),
+        "samples": [
+            {
+                "profile_id": profile_id,
+                "user_id": user_id,
+                "contribution_points": contribution_points,
+                "ledger_balance": ledger_balance
+            }
+            for profile_id, user_id, contribution_points, ledger_balance in rows[:POINT_LEDGER_VERIFY_SAMPLE_SIZE]
+        ]
+    }
+
+def compact_point_ledger(
+    db: Session,
+    cutoff: Optional[datetime] = None,
+    batch_size: int = POINT_LEDGER_COMPACTION_BATCH_SIZE,
+    dry_run: bool = False
+) -> Dict[str, Any]:
+    """
+    cutoffより前のポイント履歴を月次集計・スナップショットにまとめ、コールドテーブルへ移す
+    ID範囲ごとに1トランザクションで処理するため、途中で停止しても残高の整合性は保たれる
+
+    Args:
+        cutoff: 退避の境界（省略時は保持期間から算出）
+        batch_size: 1トランザクションで処理するIDの範囲
+        dry_run: Trueの場合は退避せず、対象件数と検証結果のみを返す
+
+    Returns:
+        Dict: cutoff, archived, snapshots_created, summaries_upserted, batches, duration_seconds, verification
+    """
+    started_at = time.perf_counter()
+    cutoff = cutoff or ledger_cutoff()
+
+    min_id, max_id, target = db.execute(
+        text("SELECT MIN(id), MAX(id), COUNT(*) FROM point_transactions WHERE created_at < :cutoff"),
+        {"cutoff": cutoff}
+    ).first()
+
+    archived = snapshots_created = summaries_upserted = batches = 0
+    if not dry_run and target:
+        low = min_id - 1
+        while low < max_id:
+            params = {"low": low, "high": low + batch_size, "cutoff": cutoff}
+            try:
+                summaries_upserted += db.execute(text(_UPSERT_MONTHLY_SUMMARIES_SQL), params).rowcount
+                snapshots_created += db.execute(text(_INSERT_SNAPSHOTS_SQL), params).rowcount
+                db.execute(text(_ARCHIVE_SQL), params)
+                archived += db.execute(text(_DELETE_SQL), params).rowcount
+                db.commit()
+            except Exception:
+                db.rollback()
+                raise
+            batches += 1
+            low += batch_size
+
+    verification = verify_point_balances(db)
+    db.rollback()
+
+    report = {
+        "dry_run": dry_run,
+        "cutoff": cutoff.isoformat(),
+        "target": target,
+        "archived": archived,
+        "snapshots_created": snapshots_created,
+        "summaries_upserted": summaries_upserted,
+        "batches": batches,
+        "duration_seconds": round(time.perf_counter() - started_at, 3),
+        "verification": verification
+    }
+    logger.info(
+        f"ポイント履歴コンパクション: 対象{target}件, 退避{archived}件, "
+        f"残高不一致{verification['mismatches']}件, {report['duration_seconds']}秒{'（ドライラン）' if dry_run else ''}"
+    )
+    return report
@@ -0,0 +1,396 @@
+"""
+レシートポイントの一括再計算
+ポイントルール（point_rules.json）の変更時に、過去のレシートを現在のルールで計算し直し、
+付与済みポイントとの差分を調整履歴（transaction_type="adjustment"）として記録する
+
+レシートはユーザーIDの範囲ごとにNumPy配列（金額・投稿時刻・ユーザー）へ読み込み、
+基本・金額・時間帯・連続日数などのボーナスをユーザー単位の区切りで配列演算により求める
+差分はすべて計算してから（ドライランのレポート）、調整履歴と残高の更新をまとめて書き込む
+
+ルールを変えずに実行した場合に差分が出ないよう、判定の入力はアップロード時の計算と同じにする
+- 時間帯・曜日: 付与履歴に記録した投稿時刻（記録のない過去分は、アップロード時と同じくサーバーのローカル時刻）
+- 天気コード: 付与履歴に記録した値（記録のない過去分は、付与された天候ボーナスの天気コード）
+- 連続日数: 投稿実績の集計（record_receipt_activity）と同じく created_at の日付
+- 加盟店ボーナス: アップロード時の計算には店舗IDを渡していないため判定しない
+"""
+
+import os
+import time
+import logging
+from collections import defaultdict
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+from sqlalchemy import exists, func, insert, select, text, union_all
+from sqlalchemy.orm import Session
+
+from .. import models
+from .point_rules import CompiledPointRules, point_rules
+
+logger = logging.getLogger(__name__)
+
+# 1回に読み込むユーザーIDの範囲
+POINT_RECALC_USER_CHUNK_SIZE = int(os.getenv("POINT_RECALC_USER_CHUNK_SIZE", "2000"))
+# 1トランザクションで書き込むユーザー数
+POINT_RECALC_WRITE_BATCH_SIZE = int(os.getenv("POINT_RECALC_WRITE_BATCH_SIZE", "1000"))
+# 直近に投稿されたレシートは付与処理中の可能性があるため対象外にする（分）
+POINT_RECALC_SETTLE_MINUTES = int(os.getenv("POINT_RECALC_SETTLE_MINUTES", "10"))
+# ルール評価（CompiledPointRules.evaluate）と照合するレシートの件数（チャンクごと）
+POINT_RECALC_VERIFY_SAMPLE_SIZE = 200
+
+ADJUSTMENT_TRANSACTION_TYPE = "adjustment"
+
+_ADJUST_BALANCE_SQL = """
+UPDATE gamification_profiles
+SET contribution_points = contribution_points + :delta,
+    total_earned_points = total_earned_points + :delta,
+    updated_at = CURRENT_TIMESTAMP
+WHERE id = :profile_id
+"""
+
+def _tier_points(thresholds: List[int], rules: List[Dict[str, Any]], values: np.ndarray) -> np.ndarray:
+    """閾値の段階ごとのポイント（どの段階にも届かない場合は0）"""
+    table = np.array([0] + [rule["points"] for rule in rules], dtype=np.int64)
+    return table[np.searchsorted(np.array(thresholds, dtype=np.int64), values, side="right")]
+
+def _rule_points(rule: Optional[Dict[str, Any]]) -> int:
+    return rule["points"] if rule else 0
+
+def calculate_receipt_points(rules: CompiledPointRules, receipts: Dict[str, np.ndarray]) -> Dict[str, np.ndarray]:
+    """
+    レシートのポイントを配列演算で計算する（CompiledPointRules.evaluate と同じ判定）
+
+    Args:
+        receipts: user_id・投稿時刻の昇順に並んだ配列
+            （user_ids, amounts, suppliers, members, activity_days, hours, weekdays, weather_codes）
+
+    Returns:
+        Dict: points（合計）, receipt_counts（そのレシートを含む投稿数）, streaks（連続日数）
+    """
+    user_ids = receipts["user_ids"]
+    amounts = receipts["amounts"]
+    suppliers = receipts["suppliers"]
+    days = receipts["activity_days"]
+    hours = receipts["hours"]
+    weather_codes = receipts["weather_codes"]
+    count = len(user_ids)
+    positions = np.arange(count)
+
+    # ユーザーごとの区切り（先頭からの件数と、連続投稿の起点）
+    new_user = np.ones(count, dtype=bool)
+    new_user[1:] = user_ids[1:] != user_ids[:-1]
+    receipt_counts = positions - np.maximum.accumulate(np.where(new_user, positions, 0)) + 1
+    streak_break = new_user.copy()
+    streak_break[1:] |= days[1:] - days[:-1] > 1
+    streaks = days - days[np.maximum.accumulate(np.where(streak_break, positions, 0))] + 1
+
+    points = np.where((suppliers != "") & (amounts != 0), rules.base_points, rules.incomplete_points).astype(np.int64)
+    points += _tier_points(rules.amount_thresholds, rules.amount_rules, amounts)
+    points += _tier_points(rules.streak_thresholds, rules.streak_rules, streaks)
+    points += np.where(receipt_counts == 1, _rule_points(rules.first_time_rule), 0)
+
+    weather_table = np.zeros(max([*rules.weather_rules, int(weather_codes.max(initial=0))]) + 1, dtype=np.int64)
+    for code, rule in rules.weather_rules.items():
+        weather_table[code] = rule["points"]
+    points += np.where(weather_codes > 0, weather_table[np.clip(weather_codes, 0, None)], 0)
+
+    hour_table = np.array([_rule_points(rule) for rule in rules.hour_rules], dtype=np.int64)
+    has_hour_rule = np.array([rule is not None for rule in rules.hour_rules])[hours]
+    weekend = np.isin(receipts["weekdays"], list(rules.weekend_days))
+    points += np.where(has_hour_rule, hour_table[hours], np.where(weekend, _rule_points(rules.weekend_rule), 0))
+
+    has_keyword = np.zeros(count, dtype=bool)
+    for keyword in rules.store_keywords:
+        has_keyword |= np.char.find(suppliers, keyword) >= 0
+    points += np.where(
+        receipts["members"] & (rules.member_store_rule is not None),
+        _rule_points(rules.member_store_rule),
+        np.where(has_keyword, _rule_points(rules.keyword_store_rule), 0)
+    )
+
+    return {"points": points, "receipt_counts": receipt_counts, "streaks": streaks}
+
+def _load_receipts(db: Session, low: int, high: int, until: datetime) -> Dict[str, Any]:
+    """user_idの範囲のレシートを user_id・投稿時刻の順に配列へ読み込む"""
+    # アウトボックスのイベントが未処理のレシートはポイント付与前のため調整しない
+    pending = exists().where(
+        models.OutboxEvent.event_type == "receipt_uploaded",
+        models.OutboxEvent.aggregate_id == models.Receipt.id,
+        models.OutboxEvent.status.in_(["pending", "processing"])
+    )
+    rows = db.execute(
+        select(
+            models.Receipt.id,
+            models.Receipt.user_id,
+            func.coalesce(models.Receipt.total_amount, 0),
+            func.coalesce(models.Receipt.supplier_name, ""),
+            models.Receipt.created_at,
+            pending
+        )
+        .where(models.Receipt.user_id > low, models.Receipt.user_id <= high, models.Receipt.created_at < until)
+        .order_by(models.Receipt.user_id, models.Receipt.created_at, models.Receipt.id)
+    ).fetchall()
+    return {
+        "ids": np.array([row[0] for row in rows], dtype=np.int64),
+        "user_ids": np.array([row[1] for row in rows], dtype=np.int64),
+        "amounts": np.array([row[2] for row in rows], dtype=np.int64),
+        "suppliers": np.array([row[3] for row in rows], dtype=str),
+        "timestamps": np.array([int(row[4].timestamp()) for row in rows], dtype=np.int64),
+        # 投稿実績の集計（record_receipt_activity）と同じ日付で連続日数を数える
+        "activity_days": np.array([row[4].date().toordinal() for row in rows], dtype=np.int64),
+        # アップロード時のポイント計算には店舗IDを渡していない（加盟店ボーナスは判定されない）
+        "members": np.zeros(len(rows), dtype=bool),
+        "pending": np.array([bool(row[5]) for row in rows], dtype=bool)
+    }
+
+def _weather_code_from_details(bonus_details: Optional[List[Dict[str, Any]]]) -> Optional[int]:
+    """付与された天候ボーナスの天気コード（天候ボーナスがなければNone）"""
+    for detail in bonus_details or []:
+        if detail.get("weather_code"):
+            return detail["weather_code"]
+    return None
+
+def _load_awarded_points(db: Session, low: int, high: int) -> Tuple[Dict[int, int], Dict[int, Dict[str, Any]]]:
+    """
+    付与済みポイントと、付与時のアップロード状況を読み込む
+    （通常・一括アップロード・過去の調整、退避済みの履歴を含む）
+
+    Returns:
+        Tuple: (レシートID -> 付与済みポイント, レシートID -> {upload_time, weather_code})
+    """
+    ledger = union_all(*(
+        select(table.profile_id, table.points, table.transaction_metadata).where(
+            table.transaction_type.in_(["earn", ADJUSTMENT_TRANSACTION_TYPE])
+        )
+        for table in (models.PointTransaction, models.PointTransactionArchive)
+    )).subquery()
+    rows = db.execute(
+        select(ledger.c.points, ledger.c.transaction_metadata)
+        .join(models.GamificationProfile, models.GamificationProfile.id == ledger.c.profile_id)
+        .where(models.GamificationProfile.user_id > low, models.GamificationProfile.user_id <= high)
+    )
+
+    awarded: Dict[int, int] = defaultdict(int)
+    contexts: Dict[int, Dict[str, Any]] = {}
+
+    def remember_context(receipt_id: int, entry: Dict[str, Any]) -> None:
+        if "bonus_details" not in entry:
+            # 調整履歴には付与時の状況がない
+            return
+        contexts[receipt_id] = entry.get("upload_context") or {
+            "upload_time": None,
+            "weather_code": _weather_code_from_details(entry["bonus_details"])
+        }
+
+    for points, metadata in rows:
+        metadata = metadata or {}
+        if metadata.get("receipt_id") is not None:
+            awarded[metadata["receipt_id"]] += points
+            remember_context(metadata["receipt_id"], metadata)
+        for entry in metadata.get("receipts") or []:
+            awarded[entry["receipt_id"]] += entry.get(
+                "points", (entry.get("base_points") or 0) + (entry.get("bonus_points") or 0)
+            )
+            remember_context(entry["receipt_id"], entry)
+    return awarded, contexts
+
+def _apply_upload_contexts(receipts: Dict[str, Any], contexts: Dict[int, Dict[str, Any]]) -> None:
+    """
+    時間帯・曜日・天候の判定に使う投稿時刻と天気コードを receipts に設定する
+    付与時の記録がない場合、投稿時刻は created_at をサーバーのローカル時刻にしたもの
+    （アップロード時の datetime.now() と同じ）、天気コードはなしとする
+    """
+    upload_times: List[datetime] = []
+    weather_codes = np.zeros(len(receipts["ids"]), dtype=np.int64)
+    for index, (receipt_id, timestamp) in enumerate(zip(receipts["ids"].tolist(), receipts["timestamps"].tolist())):
+        context = contexts.get(receipt_id) or {}
+        upload_time = context.get("upload_time")
+        upload_times.append(datetime.fromisoformat(upload_time) if upload_time else datetime.fromtimestamp(timestamp))
+        weather_codes[index] = context.get("weather_code") or 0
+
+    receipts["upload_times"] = upload_times
+    receipts["hours"] = np.array([upload_time.hour for upload_time in upload_times], dtype=np.int64)
+    receipts["weekdays"] = np.array([upload_time.weekday() for upload_time in upload_times], dtype=np.int64)
+    receipts["weather_codes"] = weather_codes
+
+def _verify_sample(
+    rules: CompiledPointRules,
+    receipts: Dict[str, Any],
+    calculated: Dict[str, np.ndarray],
+    sample_size: int
+) -> int:
+    """
+    配列演算の結果を CompiledPointRules.evaluate と照合し、不一致の件数を返す
+    （同じ入力に対する計算の一致を確認するもの。入力がアップロード時と同じかは、
+    ルールを変えずにドライランして差分が0件であることで確認する）
+    """
+    mismatches = 0
+    for index in np.linspace(0, len(receipts["ids"]) - 1, min(sample_size, len(receipts["ids"])), dtype=np.int64):
+        expected = rules.evaluate(
+            {"supplier_name": str(receipts["suppliers"][index]), "total_amount": int(receipts["amounts"][index])},
+            receipt_count=int(calculated["receipt_counts"][index]),
+            current_streak=int(calculated["streaks"][index]),
+            upload_context={
+                "upload_time": receipts["upload_times"][index],
+                "weather_code": int(receipts["weather_codes"][index]) or None
+            }
+        ).total_points
+        if expected != calculated["points"][index]:
+            mismatches += 1
+            logger.error(f"ポイント再計算の照合不一致: receipt={receipts['ids'][index]} 期待値{expected} 計算値{calculated['points'][index]}")
+    return mismatches
+
+def _apply_adjustments(db: Session, adjustments: List[Dict[str, Any]], label: str, batch_size: int) -> int:
+    """ユーザーごとの調整履歴を一括登録し、残高に差分を反映する"""
+    written = 0
+    for offset in range(0, len(adjustments), batch_size):
+        batch = adjustments[offset:offset + batch_size]
+        try:
+            missing = [adjustment["user_id"] for adjustment in batch if adjustment["profile_id"] is None]
+            if missing:
+                db.execute(insert(models.GamificationProfile), [
+                    {"user_id": user_id, "contribution_points": 0, "total_earned_points": 0, "level": 1}
+                    for user_id in missing
+                ])
+                profile_ids = dict(db.query(models.GamificationProfile.user_id, models.GamificationProfile.id).filter(
+                    models.GamificationProfile.user_id.in_(missing)
+                ).all())
+                for adjustment in batch:
+                    if adjustment["profile_id"] is None:
+                        adjustment["profile_id"] = profile_ids[adjustment["user_id"]]
+
+            db.execute(insert(models.PointTransaction), [{
+                "profile_id": adjustment["profile_id"],
+                "transaction_type": ADJUSTMENT_TRANSACTION_TYPE,
+                "points": adjustment["delta"],
+                "description": "ポイントルール変更による再計算",
+                "transaction_metadata": {"recalculation": label, "receipts": adjustment["receipts"]}
+            } for adjustment in batch])
+            db.execute(text(_ADJUST_BALANCE_SQL), [
+                {"profile_id": adjustment["profile_id"], "delta": adjustment["delta"]} for adjustment in batch
+            ])
+            db.commit()
+        except Exception:
+            db.rollback()
+            raise
+        written += len(batch)
+    return written
+
+def recalculate_receipt_points(
+    db: Session,
+    since: Optional[datetime] = None,
+    dry_run: bool = False,
+    user_chunk_size: int = POINT_RECALC_USER_CHUNK_SIZE,
+    write_batch_size: int = POINT_RECALC_WRITE_BATCH_SIZE,
+    sample_size: int = POINT_RECALC_VERIFY_SAMPLE_SIZE
+) -> Dict[str, Any]:
+    """
+    過去のレシートのポイントを現在のルールで再計算し、付与済みポイントとの差分を調整履歴として記録する
+    連続日数・初回判定のためレシートは全期間を読み込み、sinceは調整の対象のみを絞り込む
+    付与処理中（アウトボックス未処理・直近POINT_RECALC_SETTLE_MINUTES分）のレシートは対象外
+
+    Args:
+        since: この日時以降に投稿されたレシートのみ調整する（省略時は全期間）
+        dry_run: Trueの場合は書き込まず、差分のレポートのみを返す
+        user_chunk_size: 1回に読み込むユーザーIDの範囲
+        write_batch_size: 1トランザクションで書き込むユーザー数
+        sample_size: ルール評価と照合するレシートの件数（チャンクごと）
+
+    Returns:
+        Dict: receipts, pending_skipped, receipts_changed, points_added, points_removed, net_points,
+              users_adjusted, profiles_created, negative_balances, sample_checked, sample_mismatches,
+              adjustments_written, duration_seconds
+    """
+    started_at = time.perf_counter()
+    rules = point_rules.rules()
+    until = datetime.now(timezone.utc) - timedelta(minutes=POINT_RECALC_SETTLE_MINUTES)
+    since_timestamp = int(since.timestamp()) if since else None
+    max_user_id = db.execute(text("SELECT COALESCE(MAX(user_id), 0) FROM receipts")).scalar()
+
+    report = {
+        "dry_run": dry_run,
+        "since": since.isoformat() if since else None,
+        "receipts": 0,
+        "pending_skipped": 0,
+        "receipts_changed": 0,
+        "points_added": 0,
+        "points_removed": 0,
+        "users_adjusted": 0,
+        "profiles_created": 0,
+        "negative_balances": 0,
+        "sample_checked": 0,
+        "sample_mismatches": 0
+    }
+    adjustments: List[Dict[str, Any]] = []
+
+    for low in range(0, max_user_id, user_chunk_size):
+        high = low + user_chunk_size
+        receipts = _load_receipts(db, low, high, until)
+        if not len(receipts["ids"]):
+            continue
+
+        awarded, contexts = _load_awarded_points(db, low, high)
+        _apply_upload_contexts(receipts, contexts)
+        calculated = calculate_receipt_points(rules, receipts)
+        deltas = calculated["points"] - np.array([awarded.get(int(receipt_id), 0) for receipt_id in receipts["ids"]], dtype=np.int64)
+
+        target = ~receipts["pending"]
+        if since_timestamp is not None:
+            target &= receipts["timestamps"] >= since_timestamp
+        changed = target & (deltas != 0)
+
+        report["receipts"] += len(receipts["ids"])
+        report["pending_skipped"] += int(receipts["pending"].sum())
+        report["receipts_changed"] += int(changed.sum())
+        report["points_added"] += int(deltas[changed & (deltas > 0)].sum())
+        report["points_removed"] += int(-deltas[changed & (deltas < 0)].sum())
+        report["sample_checked"] += min(sample_size, len(receipts["ids"]))
+        report["sample_mismatches"] += _verify_sample(rules, receipts, calculated, sample_size)
+
+        if not changed.any():
+            continue
+
+        profiles = {
+            user_id: (profile_id, contribution_points or 0)
+            for user_id, profile_id, contribution_points in db.query(
+                models.GamificationProfile.user_id, models.GamificationProfile.id, models.GamificationProfile.contribution_points
+            ).filter(models.GamificationProfile.user_id > low, models.GamificationProfile.user_id <= high)
+        }
+        # レシートはユーザー順に並んでいるため、ユーザーの先頭位置で区切って集計する
+        receipt_ids, receipt_deltas = receipts["ids"][changed], deltas[changed]
+        changed_users, starts = np.unique(receipts["user_ids"][changed], return_index=True)
+        user_deltas = np.add.reduceat(receipt_deltas, starts)
+
+        for user_id, user_delta, user_receipt_ids, user_receipt_deltas in zip(
+            changed_users.tolist(), user_deltas.tolist(), np.split(receipt_ids, starts[1:]), np.split(receipt_deltas, starts[1:])
+        ):
+            profile_id, contribution_points = profiles.get(user_id, (None, 0))
+            report["profiles_created"] += profile_id is None
+            report["negative_balances"] += contribution_points + user_delta < 0
+            adjustments.append({
+                "user_id": user_id,
+                "profile_id": profile_id,
+                "delta": user_delta,
+                "receipts": [
+                    {"receipt_id": receipt_id, "points": delta}
+                    for receipt_id, delta in zip(user_receipt_ids.tolist(), user_receipt_deltas.tolist())
+                ]
+            })
+
+    report["users_adjusted"] = len(adjustments)
+    report["net_points"] = report["points_added"] - report["points_removed"]
+
+    if dry_run or report["sample_mismatches"]:
+        # 照合に失敗した場合は書き込まない
+        report["adjustments_written"] = 0
+    else:
+        report["adjustments_written"] = _apply_adjustments(db, adjustments, datetime.now().isoformat(), write_batch_size)
+
+    report["duration_seconds"] = round(time.perf_counter() - started_at, 3)
+    logger.info(
+        f"ポイント再計算: レシート{report['receipts']}件, 差分{report['receipts_changed']}件, "
+        f"増減{report['net_points']:+d}pt, 調整{report['adjustments_written']}ユーザー, "
+        f"{report['duration_seconds']}秒{'（ドライラン）' if dry_run else ''}"
+    )
+    return report
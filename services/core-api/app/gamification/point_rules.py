@@ -0,0 +1,204 @@
+"""
+ポイントボーナスのルール定義
+金額・連続日数・天候・時間帯・店舗のボーナスを point_rules.json（POINT_RULES_PATH）で定義し、
+読み込み時に閾値の昇順配列・天気コードの辞書・24時間分の時間帯テーブルへ変換しておく
+
+レシートごとの評価はこれらを引くだけの1回の走査で、ファイルが更新されると再読み込みする
+"""
+
+import os
+import json
+import time
+import logging
+import threading
+from bisect import bisect_right
+from typing import Any, Dict, List, Optional, Tuple
+
+from .. import schemas
+
+logger = logging.getLogger(__name__)
+
+# ルール定義ファイル（ConfigMapなどで差し替える場合に指定）
+POINT_RULES_PATH = os.getenv(
+    "POINT_RULES_PATH", os.path.join(os.path.dirname(os.path.abspath(__file__)), "point_rules.json")
+)
+# ルール定義ファイルの更新を確認する間隔（秒）
+POINT_RULES_RELOAD_SECONDS = float(os.getenv("POINT_RULES_RELOAD_SECONDS", "30"))
+
+# ボーナス明細のひな形（評価時に金額・日数などを加えて明細にする）
+Rule = Dict[str, Any]
+
+def _rule(bonus_type: str, config: Dict[str, Any], **extra: Any) -> Rule:
+    return {"type": bonus_type, "name": config["name"], "points": int(config["points"]), **extra}
+
+def _tiers(bonus_type: str, tiers: List[Dict[str, Any]], key: str) -> Tuple[List[int], List[Rule]]:
+    """閾値の昇順配列と、同じ順序のルールを返す（bisectで該当する最上位の段階を引く）"""
+    ordered = sorted(tiers, key=lambda tier: tier[key])
+    return (
+        [int(tier[key]) for tier in ordered],
+        [_rule(bonus_type, tier, **({"condition": tier["condition"]} if "condition" in tier else {})) for tier in ordered]
+    )
+
+class CompiledPointRules:
+    """
+    読み込み済みのボーナスルール
+    定義が不正な場合はValueErrorを送出する
+    """
+
+    def __init__(self, config: Dict[str, Any]):
+        try:
+            self.base_points = int(config["base"]["points"])
+            self.incomplete_points = int(config["base"]["incomplete_points"])
+
+            self.amount_thresholds, self.amount_rules = _tiers("amount_bonus", config.get("amount_tiers", []), "min_amount")
+            self.streak_thresholds, self.streak_rules = _tiers("consecutive_bonus", config.get("consecutive_tiers", []), "min_days")
+
+            first_time = config.get("first_time")
+            self.first_time_rule: Optional[Rule] = (
+                _rule("first_time_bonus", first_time, message=first_time.get("message", "")) if first_time else None
+            )
+
+            # 天気コード -> ルール（先に定義したルールを優先）
+            self.weather_rules: Dict[int, Rule] = {}
+            for weather in config.get("weather", []):
+                rule = _rule("weather_bonus", weather)
+                codes = list(weather.get("codes", []))
+                for low, high in weather.get("code_ranges", []):
+                    codes.extend(range(low, high + 1))
+                for code in codes:
+                    self.weather_rules.setdefault(int(code), rule)
+
+            # 時 -> ルール（先に定義した時間帯を優先）
+            self.hour_rules: List[Optional[Rule]] = [None] * 24
+            for window in config.get("time_windows", []):
+                rule = _rule("time_bonus", window)
+                for hour in range(int(window["start_hour"]), int(window["end_hour"])):
+                    if self.hour_rules[hour] is None:
+                        self.hour_rules[hour] = rule
+
+            weekend = config.get("weekend")
+            self.weekend_days = frozenset(weekend["weekdays"]) if weekend else frozenset()
+            self.weekend_rule: Optional[Rule] = _rule("time_bonus", weekend) if weekend else None
+
+            store = config.get("store", {})
+            self.member_store_rule: Optional[Rule] = (
+                _rule("store_bonus", {"points": store["member_points"], "name": store["member_name"]})
+                if "member_points" in store else None
+            )
+            self.keyword_store_rule: Optional[Rule] = (
+                _rule("store_bonus", {"points": store["keyword_points"], "name": store["keyword_name"]})
+                if "keyword_points" in store else None
+            )
+            self.store_keywords = tuple(store.get("keywords", []))
+        except (KeyError, TypeError, ValueError) as e:
+            raise ValueError(f"ポイントルールの定義が不正です: {e!r}") from e
+
+    def evaluate(
+        self,
+        receipt_data: Dict[str, Any],
+        receipt_count: int = 0,
+        current_streak: int = 0,
+        member_store_name: Optional[str] = None,
+        upload_context: Optional[Dict[str, Any]] = None
+    ) -> schemas.PointCalculationResult:
+        """
+        レシート1件のポイントを計算する（DBは参照しない）
+
+        Args:
+            receipt_count: このレシートを含む投稿数（1なら初回ボーナス）
+            current_streak: 連続投稿日数
+            member_store_name: 加盟店として登録済みの店舗名（未登録ならNone）
+        """
+        supplier_name = receipt_data.get("supplier_name") or ""
+        total_amount = receipt_data.get("total_amount") or 0
+        base_points = self.base_points if supplier_name and total_amount else self.incomplete_points
+        details = []
+
+        index = bisect_right(self.amount_thresholds, total_amount) - 1
+        if index >= 0:
+            details.append({**self.amount_rules[index], "amount": total_amount})
+
+        index = bisect_right(self.streak_thresholds, current_streak) - 1
+        if index >= 0:
+            details.append({**self.streak_rules[index], "consecutive_days": current_streak})
+
+        if receipt_count == 1 and self.first_time_rule:
+            details.append(dict(self.first_time_rule))
+
+        if upload_context:
+            weather_code = upload_context.get("weather_code")
+            if weather_code:
+                rule = self.weather_rules.get(weather_code)
+                if rule:
+                    details.append({**rule, "weather_code": weather_code})
+
+            upload_time = upload_context.get("upload_time")
+            if upload_time:
+                rule = self.hour_rules[upload_time.hour]
+                if rule:
+                    details.append({**rule, "hour": upload_time.hour})
+                elif self.weekend_rule and upload_time.weekday() in self.weekend_days:
+                    details.append({**self.weekend_rule, "weekday": upload_time.weekday()})
+
+        if member_store_name is not None and self.member_store_rule:
+            details.append({**self.member_store_rule, "store_name": member_store_name})
+        elif self.keyword_store_rule and any(keyword in supplier_name for keyword in self.store_keywords):
+            details.append({**self.keyword_store_rule, "store_name": supplier_name})
+
+        bonus_points = sum(detail["points"] for detail in details)
+        return schemas.PointCalculationResult(
+            base_points=base_points,
+            bonus_points=bonus_points,
+            total_points=base_points + bonus_points,
+            bonus_details=details
+        )
+
+class PointRuleSet:
+    """
+    ルール定義ファイルの読み込みと再読み込み
+    POINT_RULES_RELOAD_SECONDSごとに更新日時を確認し、変わっていれば読み直す
+    再読み込みに失敗した場合は直前のルールを使い続ける
+    """
+
+    def __init__(self, path: str = POINT_RULES_PATH, reload_seconds: float = POINT_RULES_RELOAD_SECONDS):
+        self.path = path
+        self.reload_seconds = reload_seconds
+        self._rules: Optional[CompiledPointRules] = None
+        self._mtime: Optional[float] = None
+        self._checked_at = 0.0
+        self._lock = threading.Lock()
+
+    def rules(self) -> CompiledPointRules:
+        if self._rules is None or time.monotonic() - self._checked_at > self.reload_seconds:
+            with self._lock:
+                if self._rules is None or time.monotonic() - self._checked_at > self.reload_seconds:
+                    self._reload_if_modified()
+        return self._rules
+
+    def reload(self) -> CompiledPointRules:
+        """更新日時に関係なくルール定義を読み直す"""
+        with self._lock:
+            self._mtime = None
+            self._reload_if_modified()
+        return self._rules
+
+    def _reload_if_modified(self) -> None:
+        self._checked_at = time.monotonic()
+        try:
+            mtime = os.stat(self.path).st_mtime
+            if mtime == self._mtime and self._rules is not None:
+                return
+            with open(self.path, encoding="utf-8") as f:
+                rules = CompiledPointRules(json.load(f))
+        except (OSError, ValueError) as e:
+            if self._rules is None:
+                raise
+            logger.error(f"ポイントルールの再読み込みエラー（直前のルールを継続）: {e}")
+            return
+
+        self._rules = rules
+        self._mtime = mtime
+        logger.info(f"ポイントルールを読み込み: {self.path}")
+
+# グローバルインスタンス
+point_rules = PointRuleSet()
@@ -0,0 +1,95 @@
+"""
+数量限定特典の在庫ゲート
+交換リクエストごとに Redis の DECR で在庫を仮押さえし、在庫切れのリクエストはDBに到達する前に断る
+在庫の正はDB（rewards.available_stock の条件付きUPDATE）で、ゲートは混雑時の負荷を減らすためのもの
+
+ゲートの残数はDBの available_stock から作成し、REWARD_STOCK_GATE_TTL_SECONDS ごとに作り直す
+（プロセス停止などで仮押さえが戻らなかった場合も、次の作り直しで正しい残数に戻る）
+DBで在庫を補充した場合も、ゲートに反映されるのは次の作り直し（最大 REWARD_STOCK_GATE_TTL_SECONDS 後）から
+"""
+
+import os
+import logging
+
+from sqlalchemy.orm import Session
+
+from .. import models
+from ..cache import redis_client
+
+logger = logging.getLogger(__name__)
+
+# ゲートの残数をDBから作り直す間隔（秒）
+REWARD_STOCK_GATE_TTL_SECONDS = int(os.getenv("REWARD_STOCK_GATE_TTL_SECONDS", "300"))
+
+# 残数があれば1つ減らして残数を返す（在庫切れは-1、ゲート未作成はnil）
+_RESERVE_SCRIPT = """
+local remaining = redis.call('GET', KEYS[1])
+if not remaining then
+    return nil
+end
+if tonumber(remaining) <= 0 then
+    return -1
+end
+return redis.call('DECR', KEYS[1])
+"""
+
+# ゲートがある場合のみ残数を戻す（期限切れ後にTTLのないキーを作らないように）
+_RELEASE_SCRIPT = """
+if redis.call('EXISTS', KEYS[1]) == 1 then
+    return redis.call('INCR', KEYS[1])
+end
+return nil
+"""
+
+class RewardStockGate:
+    """
+    数量限定特典の在庫の仮押さえ
+    Redisが利用できない場合は常に通し、DBの条件付きUPDATEのみで在庫を判定する
+    """
+
+    KEY_PREFIX = "reward_stock:"
+
+    def __init__(self, ttl_seconds: int = REWARD_STOCK_GATE_TTL_SECONDS):
+        self.ttl_seconds = ttl_seconds
+        self._reserve = redis_client.register_script(_RESERVE_SCRIPT) if redis_client is not None else None
+        self._release = redis_client.register_script(_RELEASE_SCRIPT) if redis_client is not None else None
+
+    def reserve(self, db: Session, reward_id: int) -> bool:
+        """在庫を1つ仮押さえする。在庫切れの場合はFalse"""
+        if self._reserve is None:
+            return True
+        key = self.KEY_PREFIX + str(reward_id)
+        try:
+            remaining = self._reserve(keys=[key])
+            if remaining is None:
+                # ゲート未作成（または期限切れ）の場合はDBの残数から作成する
+                available_stock = db.query(models.Reward.available_stock).filter(
+                    models.Reward.id == reward_id
+                ).scalar()
+                redis_client.set(key, available_stock or 0, nx=True, ex=self.ttl_seconds)
+                remaining = self._reserve(keys=[key])
+            return remaining is None or remaining >= 0
+        except Exception as e:
+            logger.error(f"在庫ゲートエラー(Redis): {e}")
+            return True
+
+    def release(self, reward_id: int) -> None:
+        """交換が成立しなかった仮押さえを戻す"""
+        if self._release is None:
+            return
+        try:
+            self._release(keys=[self.KEY_PREFIX + str(reward_id)])
+        except Exception as e:
+            logger.error(f"在庫ゲートエラー(Redis): {e}")
+
+    def mark_sold_out(self, reward_id: int) -> None:
+        """DBで在庫切れを確認した場合、以降のリクエストをゲートで断る"""
+        if redis_client is None:
+            return
+        try:
+            redis_client.set(self.KEY_PREFIX + str(reward_id), 0, ex=self.ttl_seconds)
+        except Exception as e:
+            logger.error(f"在庫ゲートエラー(Redis): {e}")
+
+# グローバルインスタンス
+reward_stock_gate = RewardStockGate()
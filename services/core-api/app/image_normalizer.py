@@ -0,0 +1,105 @@
+"""
+レシート画像の正規化
+OCR前にEXIF回転の適用・長辺の縮小・グレースケール化・再圧縮・メタデータ除去を行い、
+GCSへの転送量とDocument AIへのペイロードを削減する
+"""
+
+import io
+import os
+import logging
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Optional, Tuple
+
+from PIL import Image, ImageOps, UnidentifiedImageError
+
+logger = logging.getLogger(__name__)
+
+# 正規化を有効にするか
+RECEIPT_IMAGE_NORMALIZE = os.getenv("RECEIPT_IMAGE_NORMALIZE", "true").lower() == "true"
+# 長辺の最大ピクセル数
+RECEIPT_IMAGE_MAX_EDGE = int(os.getenv("RECEIPT_IMAGE_MAX_EDGE", "2000"))
+# 出力形式（"JPEG" または "WEBP"）
+RECEIPT_IMAGE_FORMAT = os.getenv("RECEIPT_IMAGE_FORMAT", "JPEG").upper()
+# 出力品質（1-100）
+RECEIPT_IMAGE_QUALITY = int(os.getenv("RECEIPT_IMAGE_QUALITY", "80"))
+# グレースケール化するか
+RECEIPT_IMAGE_GRAYSCALE = os.getenv("RECEIPT_IMAGE_GRAYSCALE", "true").lower() == "true"
+# 正規化用プロセスプールのワーカー数
+RECEIPT_IMAGE_WORKERS = int(os.getenv("RECEIPT_IMAGE_WORKERS", "2"))
+# 正規化する画像の最大サイズ（これを超える画像はメモリに読み込まず元のまま扱う）
+RECEIPT_IMAGE_NORMALIZE_MAX_BYTES = int(os.getenv("RECEIPT_IMAGE_NORMALIZE_MAX_BYTES", str(10 * 1024 * 1024)))
+
+MIME_TYPES = {
+    "JPEG": "image/jpeg",
+    "WEBP": "image/webp",
+}
+# 出力形式の拡張子（MIMEタイプ → 拡張子）
+EXTENSIONS = {
+    "image/jpeg": ".jpg",
+    "image/webp": ".webp",
+}
+
+def normalized_filename(filename: Optional[str], content_type: str) -> str:
+    """正規化後の画像のファイル名（拡張子を出力形式に合わせる）"""
+    stem = os.path.splitext(os.path.basename(filename or ""))[0] or "receipt"
+    return stem + EXTENSIONS[content_type]
+
+def normalize_image(
+    contents: bytes,
+    max_edge: int = RECEIPT_IMAGE_MAX_EDGE,
+    image_format: str = RECEIPT_IMAGE_FORMAT,
+    quality: int = RECEIPT_IMAGE_QUALITY,
+    grayscale: bool = RECEIPT_IMAGE_GRAYSCALE
+) -> Optional[Tuple[bytes, str]]:
+    """
+    画像を正規化する（プロセスプールから呼ばれるため、モジュールレベルの純粋関数にしている）
+
+    Returns:
+        Optional[Tuple[bytes, str]]: (正規化後のバイト列, MIMEタイプ)
+            画像としてデコードできない場合（PDFなど）や、ピクセル数が大きすぎる画像はNone
+    """
+    try:
+        with Image.open(io.BytesIO(contents)) as img:
+            # JPEGは縮小デコードで読み込みを高速化
+            img.draft("L" if grayscale else "RGB", (max_edge, max_edge))
+            img = ImageOps.exif_transpose(img)
+            img = img.convert("L" if grayscale else "RGB")
+            img.thumbnail((max_edge, max_edge), Image.LANCZOS)
+
+            # exifを渡さずに保存することでメタデータを除去する
+            output = io.BytesIO()
+            img.save(output, format=image_format, quality=quality, optimize=True)
+            return output.getvalue(), MIME_TYPES.get(image_format, "application/octet-stream")
+
+    except (UnidentifiedImageError, OSError, Image.DecompressionBombError) as e:
+        logger.warning(f"画像の正規化をスキップ: {e}")
+        return None
+
+_executor: Optional[ProcessPoolExecutor] = None
+
+def _get_executor() -> ProcessPoolExecutor:
+    global _executor
+    if _executor is None:
+        _executor = ProcessPoolExecutor(max_workers=RECEIPT_IMAGE_WORKERS)
+    return _executor
+
+def normalize_image_in_pool(contents: bytes) -> Optional[Tuple[bytes, str]]:
+    """
+    プロセスプールで画像を正規化する
+    CPU負荷の高いデコード・リサイズをイベントループやAPIプロセスのGILから切り離す
+    ワーカーが異常終了した場合はプールを作り直し、正規化せずにNoneを返す
+    """
+    global _executor
+    try:
+        return _get_executor().submit(normalize_image, contents).result()
+    except BrokenProcessPool as e:
+        logger.error(f"画像正規化プロセスが異常終了しました: {e}")
+        _executor = None
+        return None
+
+def shutdown_image_pool() -> None:
+    global _executor
+    if _executor is not None:
+        _executor.shutdown(wait=False)
+        _executor = None
@@ -1,18 +1,44 @@
 import os
+import logging
+from contextlib import asynccontextmanager
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 from .routers import users, auth, receipts, weather, historical_weather, debug, analysis, gamification, stores, line_integration, products, ai_advice, promotions
 from .security.rate_limit import setup_rate_limiting
 from .logging_config import setup_logging
+from .receipt_pipeline import receipt_job_queue, reward_outbox_consumer
+from .image_normalizer import shutdown_image_pool
+from .gamification.badge_catalog import badge_catalog
+from .database import SessionLocal
 
 # ログの初期化
 setup_logging()
+logger = logging.getLogger(__name__)
 
 # 環境変数を取得
 ENVIRONMENT = os.getenv("ENVIRONMENT", "development")
 DEBUG_MODE = os.getenv("DEBUG_MODE", "false").lower() == "true"
 
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # レシート非同期処理ワーカーとポイント・バッジ付与コンシューマーを起動
+    await receipt_job_queue.start()
+    await reward_outbox_consumer.start()
+    # バッジカタログを読み込んでおく（失敗時は最初のバッジ判定時に読み込む）
+    db = SessionLocal()
+    try:
+        badge_catalog.load(db)
+    except Exception as e:
+        logger.error(f"バッジカタログの読み込みエラー: {e}")
+    finally:
+        db.close()
+    yield
+    await reward_outbox_consumer.stop()
+    await receipt_job_queue.stop()
+    shutdown_image_pool()
+
 app = FastAPI(
+    lifespan=lifespan,
     title="E-Zuka Connect API",
     description="Local commerce gamification platform",
     version="1.0.0",
@@ -1,7 +1,8 @@
-from sqlalchemy import Boolean, Column, Integer, String, Float, DateTime, ForeignKey, Text, JSON
-from sqlalchemy.orm import relationship
+from sqlalchemy import Boolean, Column, Integer, String, Float, Date, DateTime, ForeignKey, Text, JSON, UniqueConstraint, Index, text
+from sqlalchemy.orm import relationship, validates
 from sqlalchemy.sql import func
 from .database import Base, engine
+from .normalization import normalize_phone_number
 
 class User(Base):
     __tablename__ = "users"
@@ -26,6 +27,13 @@ class User(Base):
 
 class Receipt(Base):
     __tablename__ = "receipts"
+    # 重複判定のフィンガープリント（同じ時間枠の重複登録をINSERT時に防ぐ）
+    __table_args__ = (
+        Index(
+            "uq_receipts_dedup_fingerprint", "dedup_fingerprint", unique=True,
+            postgresql_where=text("dedup_fingerprint IS NOT NULL")
+        ),
+    )
 
     id = Column(Integer, primary_key=True, index=True)
     user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
@@ -35,6 +43,7 @@ class Receipt(Base):
     receipt_date = Column(DateTime(timezone=True), server_default=func.now())
     image_gcs_path = Column(String)  # GCS画像パス
     ocr_raw_data = Column(JSON)  # Document AI生データ
+    dedup_fingerprint = Column(String(40))  # ユーザー・正規化店名・金額・30分枠のハッシュ
     created_at = Column(DateTime(timezone=True), server_default=func.now())
     updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
 
@@ -130,6 +139,8 @@ class Badge(Base):
 
 class UserBadge(Base):
     __tablename__ = "user_badges"
+    # 同じバッジの重複授与を防ぐ（一括再判定の ON CONFLICT DO NOTHING で使用）
+    __table_args__ = (UniqueConstraint("profile_id", "badge_id", name="uq_user_badges_profile_badge"),)
 
     id = Column(Integer, primary_key=True, index=True)
     profile_id = Column(Integer, ForeignKey("gamification_profiles.id"), nullable=False)
@@ -144,16 +155,69 @@ class PointTransaction(Base):
     __tablename__ = "point_transactions"
 
     id = Column(Integer, primary_key=True, index=True)
-    profile_id = Column(Integer, ForeignKey("gamification_profiles.id"), nullable=False)
+    profile_id = Column(Integer, ForeignKey("gamification_profiles.id"), nullable=False, index=True)
     transaction_type = Column(String, nullable=False)  # "earn", "redeem", "exchange"
     points = Column(Integer, nullable=False)  # 正の値=獲得、負の値=消費
     description = Column(String)
     transaction_metadata = Column(JSON)  # 追加情報（レシートID、イベントIDなど）
-    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    created_at = Column(DateTime(timezone=True), server_default=func.now(), index=True)
     
     # リレーションシップ
     profile = relationship("GamificationProfile", back_populates="point_transactions")
 
+class PointTransactionArchive(Base):
+    """保持期間を過ぎた point_transactions の退避先（コールドテーブル、IDは元のまま）"""
+    __tablename__ = "point_transactions_archive"
+
+    id = Column(Integer, primary_key=True)
+    profile_id = Column(Integer, nullable=False, index=True)
+    transaction_type = Column(String, nullable=False)
+    points = Column(Integer, nullable=False)
+    description = Column(String)
+    transaction_metadata = Column(JSON)
+    created_at = Column(DateTime(timezone=True))
+    archived_at = Column(DateTime(timezone=True), server_default=func.now())
+
+class PointTransactionMonthlySummary(Base):
+    """退避したポイント履歴の月次集計（プロフィール・月・種類ごと）"""
+    __tablename__ = "point_transaction_monthly_summaries"
+    __table_args__ = (UniqueConstraint("profile_id", "month", "transaction_type", name="uq_point_monthly_summary"),)
+
+    id = Column(Integer, primary_key=True, index=True)
+    profile_id = Column(Integer, ForeignKey("gamification_profiles.id"), nullable=False)
+    month = Column(Date, nullable=False)  # 月初日
+    transaction_type = Column(String, nullable=False)
+    points = Column(Integer, nullable=False)  # 合計ポイント
+    transaction_count = Column(Integer, nullable=False)
+
+class PointBalanceSnapshot(Base):
+    """
+    ポイント残高のスナップショット
+    last_transaction_id までの履歴（退避済み）の合計。最新のスナップショット + point_transactions の合計 = contribution_points
+    """
+    __tablename__ = "point_balance_snapshots"
+
+    id = Column(Integer, primary_key=True, index=True)
+    profile_id = Column(Integer, ForeignKey("gamification_profiles.id"), nullable=False, index=True)
+    balance = Column(Integer, nullable=False)
+    last_transaction_id = Column(Integer, nullable=False)
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+
+class UserActivitySummary(Base):
+    """
+    ユーザーのレシート投稿実績の集計（ポイント計算・バッジ判定用）
+    レシート登録と同じトランザクションで差分更新する
+    """
+    __tablename__ = "user_activity_summary"
+
+    user_id = Column(Integer, ForeignKey("users.id"), primary_key=True)
+    receipt_count = Column(Integer, nullable=False, default=0)  # レシート総数
+    lifetime_amount = Column(Integer, nullable=False, default=0)  # 累計購入金額
+    max_single_amount = Column(Integer, nullable=False, default=0)  # 1回の最高購入金額
+    current_streak = Column(Integer, nullable=False, default=0)  # last_upload_dateまでの連続投稿日数
+    last_upload_date = Column(Date)  # 最後に投稿した日
+    updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
+
 # ========== LINE連携テーブル ==========
 
 class LineIntegration(Base):
@@ -180,6 +244,7 @@ class Store(Base):
     business_type = Column(String, index=True)  # 業種
     address = Column(String)
     phone = Column(String)
+    phone_normalized = Column(String, index=True)  # 数字のみの電話番号（店舗マッチング用）
     email = Column(String)
     description = Column(Text)
     is_active = Column(Boolean, default=True)
@@ -196,6 +261,12 @@ class Store(Base):
     products = relationship("Product", back_populates="store")
     promotions = relationship("Promotion", back_populates="store")
 
+    @validates("phone")
+    def _sync_phone_normalized(self, key, phone):
+        # 電話番号の更新時に正規化済みカラムも更新する
+        self.phone_normalized = normalize_phone_number(phone) or None
+        return phone
+
 class StoreOwner(Base):
     __tablename__ = "store_owners"
 
@@ -399,6 +470,28 @@ class Promotion(Base):
     store = relationship("Store", back_populates="promotions")
     product = relationship("Product", back_populates="promotions")
 
+# ========== イベント配信（Outbox） ==========
+
+class OutboxEvent(Base):
+    """
+    トランザクショナルアウトボックス
+    業務データと同じトランザクションで記録し、バックグラウンドのコンシューマーが処理する
+    """
+    __tablename__ = "outbox_events"
+
+    id = Column(Integer, primary_key=True, index=True)
+    event_type = Column(String, nullable=False, index=True)  # e.g., "receipt_uploaded"
+    aggregate_id = Column(Integer, nullable=False, index=True)  # イベント対象のID（receipt_uploadedならレシートID）
+    user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
+    payload = Column(JSON)
+    status = Column(String, default="pending", nullable=False, index=True)  # pending, processing, completed, failed
+    attempts = Column(Integer, default=0, nullable=False)
+    result = Column(JSON)  # 処理結果（付与ポイント・バッジなど）
+    error = Column(Text)
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    claimed_at = Column(DateTime(timezone=True))  # コンシューマーが処理を開始した日時
+    processed_at = Column(DateTime(timezone=True))
+
 # ========== 初期バッジデータ定義 ==========
 
 class InitialBadgeData(Base):
@@ -0,0 +1,36 @@
+"""
+店舗マッチング用の文字列正規化
+DBの正規化済みカラムとOCR結果の照合で同じ規則を使うため、モデルとCRUDの両方から参照する
+"""
+
+import re
+import unicodedata
+
+# 数字以外（ハイフン・括弧・空白・"TEL:"などの接頭辞）
+_NON_DIGIT_PATTERN = re.compile(r"\D")
+
+def normalize_phone_number(phone: str) -> str:
+    """
+    電話番号を正規化（全角を半角にしたうえで数字以外を削除）
+    例: 092-123-4567 -> 0921234567, ＴＥＬ（０９２）１２３－４５６７ -> 0921234567
+    """
+    if not phone:
+        return ""
+    return _NON_DIGIT_PATTERN.sub("", unicodedata.normalize("NFKC", phone))
+
+# 店名から除去する法人格の表記（NFKC後。㈱は(株)になる）
+_CORPORATE_MARKS = ("株式会社", "有限会社", "合同会社", "(株)", "(有)", "(同)")
+# 店名から除去する空白・区切り記号
+_STORE_NAME_NOISE_PATTERN = re.compile(r"[\s・･.,、。'\"`]")
+
+def normalize_store_name(name: str) -> str:
+    """
+    店名を正規化（全角英数・半角カナをNFKCで統一し、法人格・空白・区切り記号を除去して小文字化）
+    例: ㈱ あさひ パン店 -> あさひパン店, ＡＳＡＨＩ Bakery -> asahibakery
+    """
+    if not name:
+        return ""
+    normalized = unicodedata.normalize("NFKC", name)
+    for mark in _CORPORATE_MARKS:
+        normalized = normalized.replace(mark, "")
+    return _STORE_NAME_NOISE_PATTERN.sub("", normalized).lower()
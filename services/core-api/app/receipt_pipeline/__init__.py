@@ -0,0 +1,43 @@
+# Receipt pipeline module initialization
+from .processing import (
+    store_receipt_image,
+    scan_receipt_image,
+    request_ocr,
+    request_ocr_bytes,
+    extract_receipt,
+    save_receipt_with_rewards,
+)
+from .batch import extract_receipt_batch, save_receipt_batch_with_rewards, RECEIPT_BATCH_MAX_FILES
+from .jobs import receipt_job_queue, JobStatus
+from .ocr_cache import ocr_result_cache
+from .rewards import reward_outbox_consumer, RECEIPT_UPLOADED
+from .idempotency import run_idempotent, idempotency_store
+from .timing import (
+    stage_metrics,
+    start_request_timing,
+    server_timing_header,
+    RECEIPT_SERVER_TIMING,
+)
+
+__all__ = [
+    "store_receipt_image",
+    "scan_receipt_image",
+    "request_ocr",
+    "request_ocr_bytes",
+    "extract_receipt",
+    "save_receipt_with_rewards",
+    "extract_receipt_batch",
+    "save_receipt_batch_with_rewards",
+    "RECEIPT_BATCH_MAX_FILES",
+    "receipt_job_queue",
+    "JobStatus",
+    "ocr_result_cache",
+    "reward_outbox_consumer",
+    "RECEIPT_UPLOADED",
+    "run_idempotent",
+    "idempotency_store",
+    "stage_metrics",
+    "start_request_timing",
+    "server_timing_header",
+    "RECEIPT_SERVER_TIMING"
+]
@@ -0,0 +1,197 @@
+"""
+レシート一括アップロード
+複数画像のGCS保存・OCRを並列実行し、DB保存とゲーミフィケーション評価はバッチ全体で1回にまとめる
+"""
+
+import os
+import asyncio
+import logging
+from datetime import datetime
+from typing import Dict, Any, List
+from fastapi import HTTPException, UploadFile
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+
+from .. import crud, schemas
+from ..weather_context import weather_context
+from ..gamification import PointCalculationEngine, BadgeEvaluationEngine
+from .processing import extract_receipt
+from .timing import stage_timer
+from .dedup import receipt_fingerprints, receipt_deduplicator, is_duplicate_violation
+from .rewards import upload_context_metadata
+
+logger = logging.getLogger(__name__)
+
+# 1リクエストで受け付ける最大ファイル数
+RECEIPT_BATCH_MAX_FILES = int(os.getenv("RECEIPT_BATCH_MAX_FILES", "20"))
+# OCRサービスへの同時リクエスト数の上限
+RECEIPT_BATCH_OCR_CONCURRENCY = int(os.getenv("RECEIPT_BATCH_OCR_CONCURRENCY", "4"))
+
+async def extract_receipt_batch(
+    files: List[UploadFile],
+    user_id: int,
+    ocr_concurrency: int = RECEIPT_BATCH_OCR_CONCURRENCY
+) -> List[Dict[str, Any]]:
+    """
+    全ファイルを並列に処理し、OCRは同時実行数を制限して実行する（GCS保存はOCRと並行）
+
+    Returns:
+        List[Dict]: ファイルごとの {filename, gcs_uri, ocr_result, error}（入力順）
+    """
+    semaphore = asyncio.Semaphore(max(1, ocr_concurrency))
+
+    async def process_file(file: UploadFile) -> Dict[str, Any]:
+        entry = {"filename": file.filename, "gcs_uri": None, "ocr_result": None, "error": None}
+        try:
+            entry["gcs_uri"], _, entry["ocr_result"] = await extract_receipt(file, user_id, semaphore)
+        except HTTPException as e:
+            entry["error"] = e.detail
+        except Exception as e:
+            entry["error"] = str(e)
+        return entry
+
+    return await asyncio.gather(*(process_file(file) for file in files))
+
+def save_receipt_batch_with_rewards(
+    db: Session,
+    user_id: int,
+    entries: List[Dict[str, Any]]
+) -> Dict[str, Any]:
+    """
+    OCR済みのレシート群を1トランザクションで保存し、
+    ポイント付与・バッジ判定をバッチ全体で1回だけ実行する
+
+    Returns:
+        Dict: ReceiptBatchUploadResponse形式のレスポンス
+    """
+    point_engine = PointCalculationEngine(db)
+    results = []
+    saved = []
+
+    for entry in entries:
+        if entry["error"]:
+            results.append({"filename": entry["filename"], "status": "failed", "error": entry["error"]})
+            continue
+
+        ocr_result = entry["ocr_result"]
+        with stage_timer("find_or_create_store", table="stores"):
+            store = crud.find_or_create_store(
+                db,
+                supplier_name=ocr_result.get("supplier_name"),
+                supplier_phone=ocr_result.get("supplier_phone")
+            )
+
+        receipt_info = {
+            "supplier_name": ocr_result.get("supplier_name"),
+            "total_amount": ocr_result.get("total_amount"),
+            "receipt_date": datetime.now()
+        }
+
+        fingerprints = receipt_fingerprints(
+            user_id, receipt_info["supplier_name"], receipt_info["total_amount"], receipt_info["receipt_date"]
+        )
+        duplicate_result = {
+            "filename": entry["filename"],
+            "status": "duplicate",
+            "error": "このレシートは既にアップロード済みです"
+        }
+
+        # 登録済み（未コミット）の同一バッチ内レシートも重複判定の対象になる
+        with stage_timer("is_duplicate_receipt", table="receipts"):
+            is_duplicate = receipt_deduplicator.is_duplicate(db, fingerprints)
+        if is_duplicate:
+            results.append(duplicate_result)
+            continue
+
+        receipt_data = schemas.ReceiptCreate(
+            supplier_name=ocr_result.get("supplier_name"),
+            total_amount=ocr_result.get("total_amount"),
+            store_id=store.id,
+            image_gcs_path=entry["gcs_uri"],
+            ocr_raw_data=ocr_result,
+            items=[schemas.ReceiptItemCreate(**item) for item in ocr_result.get("line_items", [])],
+            dedup_fingerprint=fingerprints[0] if fingerprints else None
+        )
+        with stage_timer("create_receipt", table="receipts"):
+            # 他のリクエストと同時に登録された重複はユニーク制約違反になるため、1件ごとにセーブポイントを置く
+            try:
+                with db.begin_nested():
+                    db_receipt = crud.create_receipt(db=db, receipt=receipt_data, user_id=user_id, commit=False)
+            except IntegrityError as e:
+                if not is_duplicate_violation(e):
+                    raise
+                results.append(duplicate_result)
+                continue
+
+        # 保存順にポイントを計算（初回・連続ボーナスがバッチ内の順序を反映するように）
+        upload_context = {"upload_time": datetime.now(), "weather_code": weather_context.current_weather_code(db)}
+        with stage_timer("calculate_points", table="receipts"):
+            point_result = point_engine.calculate_points(receipt_info, user_id, upload_context)
+        result = {
+            "filename": entry["filename"],
+            "status": "created",
+            "receipt": db_receipt,
+            "points_earned": point_result.total_points,
+            "point_details": {
+                "base_points": point_result.base_points,
+                "bonus_points": point_result.bonus_points,
+                "bonus_details": point_result.bonus_details
+            },
+            # 付与履歴に記録する（レスポンスには含めない）
+            "upload_context": upload_context
+        }
+        results.append(result)
+        saved.append(result)
+
+    # レシートをまとめてコミット
+    with stage_timer("commit_receipts", table="receipts"):
+        crud.commit_receipts(db, [result["receipt"] for result in saved])
+    for result in saved:
+        receipt_deduplicator.remember(result["receipt"].dedup_fingerprint)
+
+    total_points = sum(result["points_earned"] for result in saved)
+    awarded_badges = []
+
+    try:
+        # ポイント付与（バッチ全体で1トランザクション）
+        if total_points > 0:
+            with stage_timer("update_user_points", table="point_transactions"):
+                crud.update_user_points(
+                    db,
+                    user_id,
+                    total_points,
+                    "earn",
+                    f"レシート一括アップロード: {len(saved)}件",
+                    {
+                        "receipt_ids": [result["receipt"].id for result in saved],
+                        "receipts": [{
+                            "receipt_id": result["receipt"].id,
+                            **result["point_details"],
+                            "upload_context": upload_context_metadata(result["upload_context"])
+                        } for result in saved]
+                    }
+                )
+
+        # バッジ判定（バッチ全体で1回）
+        if saved:
+            badge_engine = BadgeEvaluationEngine(db)
+            with stage_timer("evaluate_and_award_badges", table="user_badges"):
+                awarded_badges = badge_engine.evaluate_and_award_badges(user_id)
+
+    except Exception as e:
+        # ポイント・バッジ処理でエラーが発生してもレシート保存は成功とする
+        logger.error(f"一括アップロードのポイント/バッジ処理エラー: {e}")
+        total_points = 0
+        for result in saved:
+            result["points_earned"] = 0
+
+    return {
+        "results": results,
+        "created_count": len(saved),
+        "total_points_earned": total_points,
+        "badges_awarded": [{
+            "badge_id": badge.badge_id,
+            "badge_name": badge.badge_name,
+            "is_new": badge.is_new
+        } for badge in awarded_badges]
+    }
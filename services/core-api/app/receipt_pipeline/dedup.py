@@ -0,0 +1,116 @@
+"""
+レシートの重複判定
+ユーザー・正規化店名・金額・30分単位の時間枠からフィンガープリントを作り、
+receipts.dedup_fingerprint（部分ユニークインデックス）で同じ時間枠の重複登録をINSERT時に防ぐ
+
+判定は前後の時間枠も含めた3つのフィンガープリントで行い、直近の登録はRedisで確認してからDBのインデックスを引く
+
+実際の判定範囲は時間枠の幅（RECEIPT_DEDUP_BUCKET_MINUTES）そのものではなく、時間枠の番号の差が1以内のレシート:
+- 時間差が1枠（既定30分）未満のレシートは必ず重複とみなす
+- 時間差が1枠以上2枠（既定60分）未満のレシートは、時間枠の境界との位置関係によって重複とみなす
+- 時間差が2枠以上のレシートは重複とみなさない
+つまり実効的な重複判定の範囲は最大 ±2枠未満（既定では ±60分未満）で、従来の ±30分 の範囲判定より広い
+
+ユニークインデックスが防ぐのは同じ時間枠の登録のみのため、PostgreSQLでは3つのフィンガープリントの
+アドバイザリロック（トランザクション終了まで保持）を取ってからDBを確認し、境界をまたいだ同時登録も直列化する
+"""
+
+import os
+import hashlib
+import logging
+from datetime import datetime
+from typing import List, Optional
+
+from sqlalchemy import func, select
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+
+from .. import models
+from ..cache import redis_client
+from ..normalization import normalize_store_name
+
+logger = logging.getLogger(__name__)
+
+# 重複判定の時間枠（分）。前後の時間枠も照合するため、実効的な判定範囲は最大でこの2倍未満
+RECEIPT_DEDUP_BUCKET_MINUTES = int(os.getenv("RECEIPT_DEDUP_BUCKET_MINUTES", "30"))
+# Redisにフィンガープリントを保持する秒数（前後の時間枠を判定できる長さ）
+RECEIPT_DEDUP_HOT_TTL_SECONDS = int(os.getenv("RECEIPT_DEDUP_HOT_TTL_SECONDS", str(RECEIPT_DEDUP_BUCKET_MINUTES * 60 * 3)))
+
+def _fingerprint(user_id: int, supplier: str, total_amount: int, bucket: int) -> str:
+    return hashlib.sha1(f"{user_id}:{supplier}:{total_amount}:{bucket}".encode("utf-8")).hexdigest()
+
+def receipt_fingerprints(user_id: int, supplier_name: Optional[str], total_amount: Optional[int], receipt_date: datetime) -> Optional[List[str]]:
+    """
+    重複判定用のフィンガープリントを返す（店名・金額がない場合はNone）
+
+    Returns:
+        List[str]: [receipt_dateの時間枠, 前の時間枠, 次の時間枠]。先頭をレシートに保存する
+    """
+    supplier = normalize_store_name(supplier_name or "")
+    if not supplier or not total_amount:
+        return None
+
+    bucket = int(receipt_date.timestamp()) // (RECEIPT_DEDUP_BUCKET_MINUTES * 60)
+    return [_fingerprint(user_id, supplier, total_amount, bucket + offset) for offset in (0, -1, 1)]
+
+def _advisory_lock_id(fingerprint: str) -> int:
+    """フィンガープリントをアドバイザリロックのキー（符号付き64bit整数）に変換する"""
+    return int.from_bytes(bytes.fromhex(fingerprint[:16]), "big", signed=True)
+
+def is_duplicate_violation(error: IntegrityError) -> bool:
+    """INSERT時のエラーがフィンガープリントのユニーク制約違反か"""
+    return "dedup_fingerprint" in str(error.orig)
+
+class ReceiptDeduplicator:
+    """
+    フィンガープリントによる重複判定
+    Redisが利用できない場合はDBのインデックスのみで判定する
+    """
+
+    KEY_PREFIX = "receipt_dedup:"
+
+    def __init__(self, hot_ttl_seconds: int = RECEIPT_DEDUP_HOT_TTL_SECONDS):
+        self.hot_ttl_seconds = hot_ttl_seconds
+
+    def is_duplicate(self, db: Session, fingerprints: Optional[List[str]]) -> bool:
+        """
+        重複判定。重複でない場合、PostgreSQLでは判定に使ったロックを呼び出し側のコミットまで保持するため、
+        判定からレシートのINSERT・コミットまでを同じトランザクションで行うこと
+        """
+        if not fingerprints:
+            return False
+
+        if redis_client is not None:
+            try:
+                if redis_client.exists(*(self.KEY_PREFIX + fingerprint for fingerprint in fingerprints)):
+                    return True
+            except Exception as e:
+                logger.error(f"重複判定エラー(Redis): {e}")
+
+        self._lock(db, fingerprints)
+        return db.query(models.Receipt.id).filter(
+            models.Receipt.dedup_fingerprint.in_(fingerprints)
+        ).first() is not None
+
+    def _lock(self, db: Session, fingerprints: List[str]) -> None:
+        """
+        隣接する時間枠の同時登録を直列化する
+        前後の時間枠のレシートとはフィンガープリントが1つ以上共通するため、同じロックを待つことになる
+        （デッドロックを避けるため常に同じ順序で取得する）
+        """
+        if db.get_bind().dialect.name != "postgresql":
+            return
+        for fingerprint in sorted(fingerprints):
+            db.execute(select(func.pg_advisory_xact_lock(_advisory_lock_id(fingerprint))))
+
+    def remember(self, fingerprint: Optional[str]) -> None:
+        """コミット済みのレシートのフィンガープリントを直近の登録として保持する"""
+        if not fingerprint or redis_client is None:
+            return
+        try:
+            redis_client.setex(self.KEY_PREFIX + fingerprint, self.hot_ttl_seconds, 1)
+        except Exception as e:
+            logger.error(f"重複判定キーの保存エラー(Redis): {e}")
+
+# グローバルインスタンス
+receipt_deduplicator = ReceiptDeduplicator()
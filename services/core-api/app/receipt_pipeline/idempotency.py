@@ -0,0 +1,239 @@
+"""
+アップロードAPIの冪等性キー
+Idempotency-Key ヘッダー付きのリクエストは最終レスポンスを保存し、
+同じキーでの再送には保存済みのレスポンスを返す（処理中の再送は完了を待つ）
+キーにはアップロード画像のハッシュ（フィンガープリント）も記録し、同じキーで別の画像が送られた場合は422を返す
+"""
+
+import os
+import json
+import time
+import uuid
+import hashlib
+import asyncio
+import logging
+import threading
+from typing import Any, Awaitable, Callable, Dict, Optional, Sequence, Type
+
+from fastapi import HTTPException, UploadFile
+from fastapi.concurrency import run_in_threadpool
+from fastapi.encoders import jsonable_encoder
+from pydantic import BaseModel
+
+from ..cache import redis_client
+from .processing import RECEIPT_UPLOAD_CHUNK_SIZE
+
+logger = logging.getLogger(__name__)
+
+# 完了したレスポンスの保持期間（秒）
+IDEMPOTENCY_TTL_SECONDS = int(os.getenv("IDEMPOTENCY_TTL_SECONDS", "86400"))
+# 処理中ロックの有効期間（秒）。プロセスが落ちてもこの時間でロックが解放される
+# 処理中に期限が切れると同じキーの再送が二重に処理されるため、最も遅い処理
+# （RECEIPT_BATCH_MAX_FILES 枚の一括アップロードでOCRが混雑した場合）より長くする
+IDEMPOTENCY_LOCK_TTL_SECONDS = int(os.getenv("IDEMPOTENCY_LOCK_TTL_SECONDS", "600"))
+# 処理中の同一キーを待つ最大秒数
+IDEMPOTENCY_WAIT_SECONDS = float(os.getenv("IDEMPOTENCY_WAIT_SECONDS", "60"))
+# 処理中のキーの完了を確認する間隔（秒）
+IDEMPOTENCY_POLL_INTERVAL_SECONDS = 0.2
+# キーの最大長
+IDEMPOTENCY_KEY_MAX_LENGTH = 255
+
+IN_PROGRESS = "in_progress"
+COMPLETED = "completed"
+
+# 自分が登録した処理中ロックの場合のみ削除する（期限切れ後に他のリクエストのロックを消さないように）
+_RELEASE_SCRIPT = """
+local value = redis.call('GET', KEYS[1])
+if value and cjson.decode(value)['token'] == ARGV[1] then
+    return redis.call('DEL', KEYS[1])
+end
+return 0
+"""
+
+# 自分が登録した処理中ロックの場合のみ最終レスポンスで置き換える
+# （期限切れ後に同じキーを処理したリクエストのレスポンスを上書きしないように）
+_COMPLETE_SCRIPT = """
+local value = redis.call('GET', KEYS[1])
+if value and cjson.decode(value)['token'] == ARGV[1] then
+    redis.call('SET', KEYS[1], ARGV[2], 'EX', ARGV[3])
+    return 1
+end
+return 0
+"""
+
+class IdempotencyStore:
+    """
+    冪等性キーの保存先
+    Redisが利用可能ならRedis（複数Pod間で共有）、そうでなければプロセス内メモリ
+    """
+
+    KEY_PREFIX = "idempotency:"
+
+    def __init__(self, ttl_seconds: int = IDEMPOTENCY_TTL_SECONDS, lock_ttl_seconds: int = IDEMPOTENCY_LOCK_TTL_SECONDS):
+        self.ttl_seconds = ttl_seconds
+        self.lock_ttl_seconds = lock_ttl_seconds
+        self._memory: Dict[str, tuple] = {}
+        self._lock = threading.Lock()
+        self._release = redis_client.register_script(_RELEASE_SCRIPT) if redis_client is not None else None
+        self._complete = redis_client.register_script(_COMPLETE_SCRIPT) if redis_client is not None else None
+
+    def acquire(self, key: str, fingerprint: Optional[str] = None) -> Optional[str]:
+        """
+        キーを処理中として登録する
+
+        Returns:
+            Optional[str]: ロックの所有者トークン（complete・release に渡す）。既に登録済みならNone
+        """
+        token = uuid.uuid4().hex
+        value = json.dumps({"status": IN_PROGRESS, "token": token, "fingerprint": fingerprint})
+        if redis_client is not None:
+            try:
+                acquired = redis_client.set(self.KEY_PREFIX + key, value, nx=True, ex=self.lock_ttl_seconds)
+                return token if acquired else None
+            except Exception as e:
+                logger.error(f"冪等性キーの登録エラー(Redis): {e}")
+
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None and entry[0] > time.monotonic():
+                return None
+            self._memory[key] = (time.monotonic() + self.lock_ttl_seconds, value)
+            return token
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        if redis_client is not None:
+            try:
+                value = redis_client.get(self.KEY_PREFIX + key)
+                return json.loads(value) if value else None
+            except Exception as e:
+                logger.error(f"冪等性キーの取得エラー(Redis): {e}")
+
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is None or entry[0] <= time.monotonic():
+                return None
+            return json.loads(entry[1])
+
+    def complete(self, key: str, token: str, status_code: int, body: Any, fingerprint: Optional[str] = None) -> bool:
+        """
+        最終レスポンスを保存する。tokenが一致しない（ロックが期限切れで他のリクエストに移った）場合は保存しない
+
+        Returns:
+            bool: 保存した場合True
+        """
+        value = json.dumps(
+            {"status": COMPLETED, "status_code": status_code, "body": body, "fingerprint": fingerprint},
+            ensure_ascii=False
+        )
+        if self._complete is not None:
+            try:
+                return bool(self._complete(keys=[self.KEY_PREFIX + key], args=[token, value, self.ttl_seconds]))
+            except Exception as e:
+                logger.error(f"冪等性キーの保存エラー(Redis): {e}")
+
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is None or entry[0] <= time.monotonic() or json.loads(entry[1]).get("token") != token:
+                return False
+            self._memory[key] = (time.monotonic() + self.ttl_seconds, value)
+            return True
+
+    def release(self, key: str, token: str) -> None:
+        """処理中ロックを解除する（再試行可能な失敗時）。tokenが一致しないロックは残す"""
+        if self._release is not None:
+            try:
+                self._release(keys=[self.KEY_PREFIX + key], args=[token])
+                return
+            except Exception as e:
+                logger.error(f"冪等性キーの削除エラー(Redis): {e}")
+
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None and json.loads(entry[1]).get("token") == token:
+                del self._memory[key]
+
+# グローバルインスタンス
+idempotency_store = IdempotencyStore()
+
+def request_fingerprint(files: Sequence[UploadFile]) -> str:
+    """アップロードファイルの内容のハッシュ（同じキーで別の画像が送られたことの検出用）"""
+    hasher = hashlib.sha256()
+    for file in files:
+        file_hasher = hashlib.sha256()
+        file.file.seek(0)
+        while True:
+            chunk = file.file.read(RECEIPT_UPLOAD_CHUNK_SIZE)
+            if not chunk:
+                break
+            file_hasher.update(chunk)
+        file.file.seek(0)
+        hasher.update(file_hasher.digest())
+    return hasher.hexdigest()
+
+def _is_final_error(status_code: int) -> bool:
+    """再送しても結果が変わらないエラーか（4xxは保存、429・5xxは再試行を許可）"""
+    return 400 <= status_code < 500 and status_code not in (408, 409, 429)
+
+def _replay(entry: Dict[str, Any]) -> Any:
+    if entry["status_code"] >= 400:
+        raise HTTPException(status_code=entry["status_code"], detail=entry["body"])
+    return entry["body"]
+
+async def run_idempotent(
+    idempotency_key: Optional[str],
+    scope: str,
+    user_id: int,
+    handler: Callable[[], Awaitable[Any]],
+    response_model: Type[BaseModel],
+    status_code: int = 200,
+    files: Sequence[UploadFile] = ()
+) -> Any:
+    """
+    冪等性キー付きでハンドラーを実行する
+
+    - キーなし: そのまま実行
+    - 完了済みのキー: 保存済みのレスポンスを返す（エラーの場合は同じHTTPExceptionを送出）
+    - 処理中のキー: 完了を待って保存済みのレスポンスを返す（待機タイムアウト時は409）
+    - filesの内容が最初のリクエストと異なる場合: 422
+
+    Returns:
+        Any: JSON化済みのレスポンス
+    """
+    if not idempotency_key:
+        return await handler()
+
+    if len(idempotency_key) > IDEMPOTENCY_KEY_MAX_LENGTH:
+        raise HTTPException(status_code=400, detail="Idempotency-Keyが長すぎます")
+
+    # ユーザー・エンドポイントごとに名前空間を分ける
+    key = f"{user_id}:{scope}:{idempotency_key}"
+    fingerprint = await run_in_threadpool(request_fingerprint, files)
+
+    deadline = time.monotonic() + IDEMPOTENCY_WAIT_SECONDS
+    token = await run_in_threadpool(idempotency_store.acquire, key, fingerprint)
+    while token is None:
+        entry = await run_in_threadpool(idempotency_store.get, key)
+        if entry and entry.get("fingerprint") and entry["fingerprint"] != fingerprint:
+            raise HTTPException(status_code=422, detail="同じIdempotency-Keyで異なる内容のリクエストが送信されました")
+        if entry and entry.get("status") == COMPLETED:
+            return _replay(entry)
+        if time.monotonic() >= deadline:
+            raise HTTPException(status_code=409, detail="同じIdempotency-Keyのリクエストを処理中です")
+        await asyncio.sleep(IDEMPOTENCY_POLL_INTERVAL_SECONDS)
+        token = await run_in_threadpool(idempotency_store.acquire, key, fingerprint)
+
+    try:
+        result = await handler()
+    except HTTPException as e:
+        if _is_final_error(e.status_code):
+            await run_in_threadpool(idempotency_store.complete, key, token, e.status_code, e.detail, fingerprint)
+        else:
+            await run_in_threadpool(idempotency_store.release, key, token)
+        raise
+    except BaseException:
+        await run_in_threadpool(idempotency_store.release, key, token)
+        raise
+
+    body = jsonable_encoder(response_model.model_validate(result, from_attributes=True))
+    await run_in_threadpool(idempotency_store.complete, key, token, status_code, body, fingerprint)
+    return body
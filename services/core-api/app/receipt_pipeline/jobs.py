@@ -0,0 +1,229 @@
+"""
+レシート非同期取り込みジョブ
+アップロードAPIは画像保存とジョブ登録のみを行い、OCR以降の処理はワーカープールで実行する
+
+キューはプロセス内（asyncio.Queue）で、ジョブ状態のみをRedisに保存する（RECEIPT_JOB_TTL_SECONDSで期限切れ）
+- プロセスの停止・再起動時にキューに残っていたジョブは失敗として記録する（クライアントは再アップロードする）
+- 異常終了したプロセスのジョブは、次に起動したプロセスが一定時間（RECEIPT_JOB_STALE_SECONDS）
+  更新のない queued / processing のジョブを失敗として記録する
+- Redisが利用できない場合はジョブ状態もプロセス内のため、uvicornのワーカーは1つで動かすこと
+  （複数ワーカーでは登録したプロセス以外からジョブ状態を参照できない）
+"""
+
+import os
+import json
+import uuid
+import asyncio
+import logging
+from datetime import datetime, timedelta
+from typing import Dict, Any, Optional, List
+from fastapi import HTTPException
+from fastapi.concurrency import run_in_threadpool
+from fastapi.encoders import jsonable_encoder
+
+from .. import schemas
+from ..cache import redis_client
+from ..database import SessionLocal
+from .processing import request_ocr, save_receipt_with_rewards
+
+logger = logging.getLogger(__name__)
+
+# ワーカー数（同時に処理するジョブ数）
+RECEIPT_WORKER_CONCURRENCY = int(os.getenv("RECEIPT_WORKER_CONCURRENCY", "4"))
+# ジョブ状態の保持期間（秒）
+RECEIPT_JOB_TTL_SECONDS = int(os.getenv("RECEIPT_JOB_TTL_SECONDS", "86400"))
+# この秒数更新のない queued / processing のジョブは、処理していたプロセスが停止したものとみなす
+RECEIPT_JOB_STALE_SECONDS = int(os.getenv("RECEIPT_JOB_STALE_SECONDS", "900"))
+
+# 処理が中断されたジョブのエラー
+_INTERRUPTED_ERROR = {"status_code": 503, "detail": "サーバーの再起動により処理が中断されました。再度アップロードしてください"}
+
+class JobStatus:
+    """ジョブの状態"""
+    QUEUED = "queued"
+    PROCESSING = "processing"
+    COMPLETED = "completed"
+    FAILED = "failed"
+
+class ReceiptJobStore:
+    """
+    ジョブ状態の保存先
+    Redisが利用可能ならRedis（複数Pod間で共有）、そうでなければプロセス内メモリ
+    """
+
+    KEY_PREFIX = "receipt_job:"
+
+    def __init__(self, ttl_seconds: int = RECEIPT_JOB_TTL_SECONDS):
+        self.ttl_seconds = ttl_seconds
+        self._memory: Dict[str, Dict[str, Any]] = {}
+
+    def save(self, job: Dict[str, Any]) -> None:
+        job["updated_at"] = datetime.now().isoformat()
+        if redis_client is not None:
+            try:
+                redis_client.setex(
+                    self.KEY_PREFIX + job["job_id"],
+                    self.ttl_seconds,
+                    json.dumps(jsonable_encoder(job), ensure_ascii=False)
+                )
+                return
+            except Exception as e:
+                logger.error(f"ジョブ状態の保存エラー(Redis): {e}")
+        self._memory[job["job_id"]] = job
+
+    def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        if redis_client is not None:
+            try:
+                value = redis_client.get(self.KEY_PREFIX + job_id)
+                if value:
+                    return json.loads(value)
+            except Exception as e:
+                logger.error(f"ジョブ状態の取得エラー(Redis): {e}")
+        return self._memory.get(job_id)
+
+    def update(self, job_id: str, **fields) -> Optional[Dict[str, Any]]:
+        job = self.get(job_id)
+        if job is None:
+            return None
+        job.update(fields)
+        self.save(job)
+        return job
+
+    def fail_stale(self, stale_seconds: int) -> int:
+        """
+        stale_seconds以上更新のない未完了のジョブを失敗にする（Redisのみ。プロセス内の状態は再起動で消える）
+
+        Returns:
+            int: 失敗にしたジョブ数
+        """
+        if redis_client is None:
+            return 0
+        cutoff = datetime.now() - timedelta(seconds=stale_seconds)
+        failed = 0
+        try:
+            for key in redis_client.scan_iter(match=self.KEY_PREFIX + "*"):
+                value = redis_client.get(key)
+                job = json.loads(value) if value else None
+                if job is None or job["status"] not in (JobStatus.QUEUED, JobStatus.PROCESSING):
+                    continue
+                if datetime.fromisoformat(job["updated_at"]) < cutoff:
+                    job.update(status=JobStatus.FAILED, stage=None, error=_INTERRUPTED_ERROR)
+                    self.save(job)
+                    failed += 1
+        except Exception as e:
+            logger.error(f"中断されたジョブの確認エラー(Redis): {e}")
+        return failed
+
+class ReceiptJobQueue:
+    """
+    レシート処理ジョブのキューとワーカープール
+    アプリ起動時にstart()、終了時にstop()を呼び出す
+    """
+
+    def __init__(self, concurrency: int = RECEIPT_WORKER_CONCURRENCY, store: ReceiptJobStore = None):
+        self.concurrency = max(1, concurrency)
+        self.store = store or ReceiptJobStore()
+        self._queue: Optional[asyncio.Queue] = None
+        self._workers: List[asyncio.Task] = []
+
+    async def start(self) -> None:
+        if self._workers:
+            return
+        self._queue = asyncio.Queue()
+        self._workers = [
+            asyncio.create_task(self._worker(i)) for i in range(self.concurrency)
+        ]
+        logger.info(f"レシート処理ワーカーを起動: {self.concurrency}")
+
+        # 異常終了したプロセスに残っていたジョブを失敗にする
+        failed = await run_in_threadpool(self.store.fail_stale, RECEIPT_JOB_STALE_SECONDS)
+        if failed:
+            logger.warning(f"中断されたレシートジョブを失敗にしました: {failed}件")
+
+    async def stop(self) -> None:
+        for worker in self._workers:
+            worker.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+
+        # キューに残ったジョブはこのプロセスでしか処理できないため、失敗として記録する
+        while self._queue is not None and not self._queue.empty():
+            job_id = self._queue.get_nowait()
+            await run_in_threadpool(
+                self.store.update, job_id, status=JobStatus.FAILED, stage=None, error=_INTERRUPTED_ERROR
+            )
+
+    async def enqueue(self, user_id: int, gcs_uri: str, content_hash: str = None) -> Dict[str, Any]:
+        """ジョブを登録し、ジョブ情報を返す"""
+        if self._queue is None:
+            await self.start()
+
+        job = {
+            "job_id": str(uuid.uuid4()),
+            "user_id": user_id,
+            "gcs_uri": gcs_uri,
+            "content_hash": content_hash,
+            "status": JobStatus.QUEUED,
+            "stage": None,
+            "result": None,
+            "error": None,
+            "created_at": datetime.now().isoformat(),
+        }
+        self.store.save(job)
+        await self._queue.put(job["job_id"])
+        return job
+
+    def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        return self.store.get(job_id)
+
+    async def _worker(self, worker_id: int) -> None:
+        while True:
+            job_id = await self._queue.get()
+            try:
+                await run_in_threadpool(self._process, job_id)
+            except Exception as e:
+                logger.error(f"レシートジョブ処理エラー(worker={worker_id}, job={job_id}): {e}")
+            finally:
+                self._queue.task_done()
+
+    def _process(self, job_id: str) -> None:
+        """ジョブ1件を処理する（スレッドプールで実行）"""
+        job = self.store.get(job_id)
+        if job is None or job["status"] != JobStatus.QUEUED:
+            # 期限切れ、または中断として失敗にされたジョブは処理しない
+            return
+        job = self.store.update(job_id, status=JobStatus.PROCESSING, stage="ocr")
+
+        db = SessionLocal()
+        try:
+            ocr_result = request_ocr(job["gcs_uri"], job["user_id"], job.get("content_hash"))
+
+            self.store.update(job_id, stage="saving")
+            result = save_receipt_with_rewards(db, job["user_id"], job["gcs_uri"], ocr_result)
+
+            response = schemas.ReceiptUploadResponse.model_validate(result, from_attributes=True)
+            self.store.update(
+                job_id,
+                status=JobStatus.COMPLETED,
+                stage=None,
+                result=jsonable_encoder(response)
+            )
+
+        except HTTPException as e:
+            self.store.update(
+                job_id,
+                status=JobStatus.FAILED,
+                error={"status_code": e.status_code, "detail": e.detail}
+            )
+        except Exception as e:
+            db.rollback()
+            self.store.update(
+                job_id,
+                status=JobStatus.FAILED,
+                error={"status_code": 500, "detail": str(e)}
+            )
+        finally:
+            db.close()
+
+# グローバルインスタンス
+receipt_job_queue = ReceiptJobQueue()
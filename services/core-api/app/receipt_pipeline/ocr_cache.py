@@ -0,0 +1,93 @@
+"""
+OCR結果キャッシュ
+ユーザーIDと画像バイト列のSHA-256をキーに、GCS URIとOCR抽出結果を保持する
+（プロセス内LRU → Redis の2段構成、いずれもTTL付き）
+同じ画像でも別のユーザーのアップロードとは共有しない（他のユーザーのblobを参照させないため）
+"""
+
+import os
+import json
+import time
+import logging
+import threading
+from collections import OrderedDict
+from typing import Dict, Any, Optional
+
+from ..cache import redis_client
+
+logger = logging.getLogger(__name__)
+
+# キャッシュ保持期間（秒）
+OCR_CACHE_TTL_SECONDS = int(os.getenv("OCR_CACHE_TTL_SECONDS", "86400"))
+# プロセス内LRUの最大件数
+OCR_CACHE_MAX_ENTRIES = int(os.getenv("OCR_CACHE_MAX_ENTRIES", "1024"))
+
+class OcrResultCache:
+    """
+    (ユーザーID, コンテンツハッシュ) → {gcs_uri, ocr_result} のキャッシュ
+    リトライや二重タップで同一画像が送られた場合にGCS保存とOCRを省略する
+    """
+
+    KEY_PREFIX = "ocr_cache:"
+
+    def __init__(self, max_entries: int = OCR_CACHE_MAX_ENTRIES, ttl_seconds: int = OCR_CACHE_TTL_SECONDS):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, user_id: Optional[int], content_hash: str) -> Optional[Dict[str, Any]]:
+        if user_id is None or not content_hash:
+            return None
+        key = f"{user_id}:{content_hash}"
+
+        # 1. プロセス内LRU
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                expires_at, value = entry
+                if expires_at > time.monotonic():
+                    self._entries.move_to_end(key)
+                    return value
+                del self._entries[key]
+
+        # 2. Redis
+        if redis_client is not None:
+            try:
+                raw = redis_client.get(self.KEY_PREFIX + key)
+                if raw:
+                    value = json.loads(raw)
+                    self._remember(key, value)
+                    return value
+            except Exception as e:
+                logger.error(f"OCRキャッシュ取得エラー(Redis): {e}")
+
+        return None
+
+    def set(self, user_id: Optional[int], content_hash: str, gcs_uri: str, ocr_result: Dict[str, Any]) -> None:
+        if user_id is None or not content_hash:
+            return
+        key = f"{user_id}:{content_hash}"
+
+        value = {"gcs_uri": gcs_uri, "ocr_result": ocr_result}
+        self._remember(key, value)
+
+        if redis_client is not None:
+            try:
+                redis_client.setex(
+                    self.KEY_PREFIX + key,
+                    self.ttl_seconds,
+                    json.dumps(value, ensure_ascii=False)
+                )
+            except Exception as e:
+                logger.error(f"OCRキャッシュ保存エラー(Redis): {e}")
+
+    def _remember(self, key: str, value: Dict[str, Any]) -> None:
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl_seconds, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+# グローバルインスタンス
+ocr_result_cache = OcrResultCache()
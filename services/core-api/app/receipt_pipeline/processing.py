@@ -0,0 +1,359 @@
+"""
+レシート処理パイプライン
+GCS保存 / OCR → 店舗マッチング → 重複チェック → DB保存 → ポイント・バッジ付与
+の各ステージを提供する（同期API・一括アップロード・非同期ジョブから利用）
+"""
+
+import io
+import os
+import uuid
+import asyncio
+import hashlib
+import requests
+import logging
+from datetime import datetime
+from typing import Dict, Any, BinaryIO, Optional, Tuple
+from fastapi import HTTPException, UploadFile
+from fastapi.concurrency import run_in_threadpool
+from google.cloud import storage
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+
+from .. import crud, schemas
+from ..weather_context import weather_context
+from ..image_normalizer import (
+    RECEIPT_IMAGE_NORMALIZE,
+    RECEIPT_IMAGE_NORMALIZE_MAX_BYTES,
+    normalize_image_in_pool,
+    normalized_filename
+)
+from .ocr_cache import ocr_result_cache
+from .timing import stage_timer
+from .dedup import receipt_fingerprints, receipt_deduplicator, is_duplicate_violation
+from .rewards import (
+    RECEIPT_REWARDS_ASYNC,
+    RECEIPT_UPLOADED,
+    award_receipt_rewards,
+    empty_rewards,
+    reward_outbox_consumer,
+)
+
+logger = logging.getLogger(__name__)
+
+# GCS設定
+BUCKET_NAME = "your-gcp-project-id-receipts"
+storage_client = storage.Client()
+
+# アップロード時のチャンクサイズ（GCSのresumable uploadの制約により256KBの倍数）
+RECEIPT_UPLOAD_CHUNK_SIZE = int(os.getenv("RECEIPT_UPLOAD_CHUNK_SIZE", str(1024 * 1024)))
+# レシート画像の最大サイズ
+RECEIPT_MAX_UPLOAD_BYTES = int(os.getenv("RECEIPT_MAX_UPLOAD_BYTES", str(15 * 1024 * 1024)))
+
+# OCR Processorサービスのエンドポイント
+OCR_PROCESSOR_URL = "http://ocr-processor/process-gcs/"
+OCR_PROCESSOR_BYTES_URL = "http://ocr-processor/process-bytes/"
+
+def scan_receipt_image(fileobj: BinaryIO) -> Tuple[str, int]:
+    """
+    アップロードファイルをチャンク単位で読み、SHA-256とサイズを計算する
+    最大サイズを超えた時点で413を返す（GCSへの書き込み前に打ち切る）
+    """
+    hasher = hashlib.sha256()
+    size = 0
+    fileobj.seek(0)
+    while True:
+        chunk = fileobj.read(RECEIPT_UPLOAD_CHUNK_SIZE)
+        if not chunk:
+            break
+        size += len(chunk)
+        if size > RECEIPT_MAX_UPLOAD_BYTES:
+            raise HTTPException(
+                status_code=413,
+                detail=f"画像サイズが上限（{RECEIPT_MAX_UPLOAD_BYTES // (1024 * 1024)}MB）を超えています"
+            )
+        hasher.update(chunk)
+    fileobj.seek(0)
+    return hasher.hexdigest(), size
+
+def prepare_receipt_image(fileobj: BinaryIO, filename: str, content_type: str, size: int) -> Tuple[BinaryIO, str, str]:
+    """
+    正規化が有効な場合は縮小・再圧縮した画像を返す（デコードできない形式は元のまま）
+    RECEIPT_IMAGE_NORMALIZE_MAX_BYTES を超える画像はメモリに読み込まず、元のままストリーミングする
+    再圧縮した場合はファイル名の拡張子も出力形式に合わせる（.png のまま image/jpeg で保存しないように）
+
+    Args:
+        size: scan_receipt_image で計測した画像サイズ
+
+    Returns:
+        Tuple[BinaryIO, str, str]: (画像のファイルオブジェクト, ファイル名, MIMEタイプ)
+    """
+    if RECEIPT_IMAGE_NORMALIZE and size <= RECEIPT_IMAGE_NORMALIZE_MAX_BYTES:
+        with stage_timer("normalize"):
+            normalized = normalize_image_in_pool(fileobj.read(RECEIPT_IMAGE_NORMALIZE_MAX_BYTES))
+        fileobj.seek(0)
+        if normalized:
+            normalized_bytes, content_type = normalized
+            return io.BytesIO(normalized_bytes), normalized_filename(filename, content_type), content_type
+    return fileobj, filename, content_type
+
+def archive_receipt_image(fileobj: BinaryIO, filename: str, content_type: str) -> str:
+    """
+    レシート画像をGCSにストリーミングアップロードする
+    resumable uploadでチャンクごとに送信するため、メモリ使用量はチャンクサイズで上限が決まる
+
+    Returns:
+        str: アップロード先のGCS URI
+    """
+    with stage_timer("gcs", service="gcs", endpoint=BUCKET_NAME):
+        try:
+            bucket = storage_client.bucket(BUCKET_NAME)
+            blob_name = f"receipts/{uuid.uuid4()}-{filename}"
+            blob = bucket.blob(blob_name)
+
+            with blob.open("wb", chunk_size=RECEIPT_UPLOAD_CHUNK_SIZE, content_type=content_type) as writer:
+                while True:
+                    chunk = fileobj.read(RECEIPT_UPLOAD_CHUNK_SIZE)
+                    if not chunk:
+                        break
+                    writer.write(chunk)
+
+            return f"gs://{BUCKET_NAME}/{blob_name}"
+
+        except Exception as e:
+            raise HTTPException(status_code=500, detail=f"GCS upload failed: {str(e)}")
+
+def delete_receipt_image(gcs_uri: str) -> None:
+    """どのレシートからも参照されなくなった画像をGCSから削除する（失敗してもログのみ）"""
+    try:
+        blob_name = gcs_uri.removeprefix(f"gs://{BUCKET_NAME}/")
+        storage_client.bucket(BUCKET_NAME).blob(blob_name).delete()
+    except Exception as e:
+        logger.warning(f"GCSの画像削除に失敗しました: {gcs_uri}: {e}")
+
+def store_receipt_image(fileobj: BinaryIO, filename: str, content_type: str, user_id: int) -> Tuple[str, str]:
+    """
+    レシート画像を（正規化の上）GCSに保存する
+    同じユーザーの同一画像がOCRキャッシュにあれば既存のblobを再利用する（ハッシュは元画像のもの）
+
+    Returns:
+        Tuple[str, str]: (GCS URI, コンテンツハッシュ)
+    """
+    content_hash, size = scan_receipt_image(fileobj)
+
+    cached = ocr_result_cache.get(user_id, content_hash)
+    if cached:
+        return cached["gcs_uri"], content_hash
+
+    image, filename, content_type = prepare_receipt_image(fileobj, filename, content_type, size)
+    return archive_receipt_image(image, filename, content_type), content_hash
+
+def _ocr_service_error(e: requests.exceptions.RequestException) -> HTTPException:
+    """
+    OCRサービス呼び出しの例外をHTTPExceptionに変換する
+    OCRサービスが混雑（429/503）している場合はRetry-Afterを引き継いで503を返す
+    """
+    response = getattr(e, "response", None)
+    if response is not None and response.status_code in (429, 503):
+        return HTTPException(
+            status_code=503,
+            detail="OCR service is busy. Please retry later.",
+            headers={"Retry-After": response.headers.get("Retry-After", "5")}
+        )
+    return HTTPException(status_code=502, detail=f"Failed to call OCR service: {str(e)}")
+
+def request_ocr(gcs_uri: str, user_id: int = None, content_hash: str = None) -> Dict[str, Any]:
+    """
+    OCRサービスを呼び出し、抽出結果を返す（GCS上の画像を処理）
+    user_id・content_hashが指定されていればキャッシュを参照し、結果をキャッシュに保存する
+    """
+    cached = ocr_result_cache.get(user_id, content_hash)
+    if cached:
+        return cached["ocr_result"]
+
+    with stage_timer("ocr", service="ocr-processor", endpoint=OCR_PROCESSOR_URL):
+        try:
+            response = requests.post(OCR_PROCESSOR_URL, json={"gcs_uri": gcs_uri})
+            response.raise_for_status()
+            ocr_result = response.json()
+        except requests.exceptions.RequestException as e:
+            raise _ocr_service_error(e)
+
+    ocr_result_cache.set(user_id, content_hash, gcs_uri, ocr_result)
+    return ocr_result
+
+def request_ocr_bytes(image: bytes, filename: str, content_type: str) -> Dict[str, Any]:
+    """画像をOCRサービスに直接送信し、抽出結果を返す（GCSからの再ダウンロードを省略）"""
+    with stage_timer("ocr", service="ocr-processor", endpoint=OCR_PROCESSOR_BYTES_URL):
+        try:
+            response = requests.post(
+                OCR_PROCESSOR_BYTES_URL,
+                files={"file": (filename, image, content_type)}
+            )
+            response.raise_for_status()
+            return response.json()
+        except requests.exceptions.RequestException as e:
+            raise _ocr_service_error(e)
+
+async def extract_receipt(
+    file: UploadFile,
+    user_id: int,
+    ocr_semaphore: Optional[asyncio.Semaphore] = None
+) -> Tuple[str, str, Dict[str, Any]]:
+    """
+    アップロードファイルからOCR結果を得る
+    画像をOCRサービスへ直接送り、GCSへのアーカイブ保存はOCRと並行して実行する
+    同じユーザーの同一画像が直近に処理済みであれば、そのblobとOCR結果を再利用する
+    ocr_semaphoreを指定するとOCR呼び出しの同時実行数を制限できる
+
+    Returns:
+        Tuple[str, str, Dict]: (GCS URI, コンテンツハッシュ, OCR結果)
+    """
+    content_hash, size = await run_in_threadpool(scan_receipt_image, file.file)
+
+    cached = await run_in_threadpool(ocr_result_cache.get, user_id, content_hash)
+    if cached:
+        return cached["gcs_uri"], content_hash, cached["ocr_result"]
+
+    image, filename, content_type = await run_in_threadpool(
+        prepare_receipt_image, file.file, file.filename, file.content_type, size
+    )
+    image_bytes = image.read()
+
+    async def run_ocr() -> Dict[str, Any]:
+        if ocr_semaphore is None:
+            return await run_in_threadpool(request_ocr_bytes, image_bytes, filename, content_type)
+        async with ocr_semaphore:
+            return await run_in_threadpool(request_ocr_bytes, image_bytes, filename, content_type)
+
+    gcs_uri, ocr_result = await asyncio.gather(
+        run_in_threadpool(archive_receipt_image, io.BytesIO(image_bytes), filename, content_type),
+        run_ocr(),
+        return_exceptions=True
+    )
+    if isinstance(ocr_result, BaseException):
+        # OCRに失敗したレシートは保存されないため、並行して保存した画像を削除する
+        if not isinstance(gcs_uri, BaseException):
+            await run_in_threadpool(delete_receipt_image, gcs_uri)
+        raise ocr_result
+    if isinstance(gcs_uri, BaseException):
+        raise gcs_uri
+
+    await run_in_threadpool(ocr_result_cache.set, user_id, content_hash, gcs_uri, ocr_result)
+    return gcs_uri, content_hash, ocr_result
+
+def _duplicate_receipt_error() -> HTTPException:
+    return HTTPException(
+        status_code=400,
+        detail="このレシートは既にアップロード済みです"
+    )
+
+def save_receipt_with_rewards(
+    db: Session,
+    user_id: int,
+    gcs_uri: str,
+    ocr_result: Dict[str, Any]
+) -> Dict[str, Any]:
+    """
+    OCR結果を保存し、ポイント・バッジを付与する
+    RECEIPT_REWARDS_ASYNCが有効な場合はレシート保存までを行い、付与はアウトボックス経由でバックグラウンド実行する
+
+    Returns:
+        Dict: ReceiptUploadResponse形式のレスポンス
+    """
+    # 1. 店舗をマッチングまたは作成
+    with stage_timer("find_or_create_store", table="stores"):
+        store = crud.find_or_create_store(
+            db,
+            supplier_name=ocr_result.get("supplier_name"),
+            supplier_phone=ocr_result.get("supplier_phone")
+        )
+
+    # 2. 重複チェック（フィンガープリントで判定し、同時登録はユニークインデックスで防ぐ）
+    receipt_info = {
+        "supplier_name": ocr_result.get("supplier_name"),
+        "total_amount": ocr_result.get("total_amount"),
+        "receipt_date": datetime.now()
+    }
+    fingerprints = receipt_fingerprints(
+        user_id, receipt_info["supplier_name"], receipt_info["total_amount"], receipt_info["receipt_date"]
+    )
+
+    with stage_timer("is_duplicate_receipt", table="receipts"):
+        is_duplicate = receipt_deduplicator.is_duplicate(db, fingerprints)
+    if is_duplicate:
+        raise _duplicate_receipt_error()
+
+    # 3. 結果をDBに保存（店舗IDを含める）
+    receipt_data = schemas.ReceiptCreate(
+        supplier_name=ocr_result.get("supplier_name"),
+        total_amount=ocr_result.get("total_amount"),
+        store_id=store.id,
+        image_gcs_path=gcs_uri,
+        ocr_raw_data=ocr_result,
+        items=[schemas.ReceiptItemCreate(**item) for item in ocr_result.get("line_items", [])],
+        dedup_fingerprint=fingerprints[0] if fingerprints else None
+    )
+
+    upload_context = {
+        "upload_time": datetime.now(),
+        "weather_code": weather_context.current_weather_code(db)
+    }
+
+    if RECEIPT_REWARDS_ASYNC:
+        # レシートと receipt_uploaded イベントを同じトランザクションで保存し、
+        # ポイント・バッジ付与はバックグラウンドのコンシューマーに任せる
+        with stage_timer("create_receipt", table="receipts"):
+            try:
+                db_receipt = crud.create_receipt(db=db, receipt=receipt_data, user_id=user_id, commit=False)
+            except IntegrityError as e:
+                db.rollback()
+                if is_duplicate_violation(e):
+                    raise _duplicate_receipt_error()
+                raise
+            # 初回・連続ボーナスはコンシューマーの処理時点ではなく、このレシートを登録した時点の投稿実績で判定する
+            summary = crud.get_user_activity_summary(db, user_id)
+            crud.create_outbox_event(
+                db,
+                RECEIPT_UPLOADED,
+                db_receipt.id,
+                user_id,
+                {
+                    "supplier_name": receipt_info["supplier_name"],
+                    "total_amount": receipt_info["total_amount"],
+                    "upload_time": upload_context["upload_time"].isoformat(),
+                    "weather_code": upload_context["weather_code"],
+                    "receipt_count": summary.receipt_count if summary else None,
+                    "current_streak": summary.current_streak if summary else None
+                },
+                commit=False
+            )
+            crud.commit_receipts(db, [db_receipt])
+        receipt_deduplicator.remember(receipt_data.dedup_fingerprint)
+
+        reward_outbox_consumer.notify()
+        return {
+            "receipt": db_receipt,
+            **empty_rewards(),
+            "rewards_status": "pending",
+            "rewards_url": f"/api/receipts/{db_receipt.id}/rewards"
+        }
+
+    with stage_timer("create_receipt", table="receipts"):
+        try:
+            db_receipt = crud.create_receipt(db=db, receipt=receipt_data, user_id=user_id)
+        except IntegrityError as e:
+            db.rollback()
+            if is_duplicate_violation(e):
+                raise _duplicate_receipt_error()
+            raise
+    receipt_deduplicator.remember(receipt_data.dedup_fingerprint)
+
+    # 4. ポイント計算・付与とバッジ判定
+    try:
+        rewards = award_receipt_rewards(db, user_id, db_receipt.id, receipt_info, upload_context)
+        return {"receipt": db_receipt, **rewards}
+
+    except Exception as e:
+        # ポイント・バッジ処理でエラーが発生してもレシート保存は成功とする
+        print(f"ポイント/バッジ処理エラー: {e}")
+        return {"receipt": db_receipt, **empty_rewards()}
@@ -0,0 +1,255 @@
+"""
+レシート投稿のポイント・バッジ付与
+通常はアップロードAPI内で付与し、レスポンスに獲得ポイント・バッジを含める
+
+RECEIPT_REWARDS_ASYNC=true の場合、アップロードAPIはレシートと receipt_uploaded イベント（アウトボックス）を
+同じトランザクションで保存し、ポイント計算・付与とバッジ判定はバックグラウンドのコンシューマーが実行する
+このときレスポンスは rewards_status="pending"・points_earned=0・badges_awarded=[] となり、
+付与結果は rewards_url（GET /receipts/{receipt_id}/rewards）で確認する
+一括アップロード（/receipts/upload-batch）は設定によらず同期で付与する
+"""
+
+import os
+import asyncio
+import logging
+from datetime import datetime
+from typing import Dict, Any, List, Optional
+from fastapi.concurrency import run_in_threadpool
+from sqlalchemy.orm import Session
+
+from .. import crud, models
+from ..database import SessionLocal
+from ..gamification import PointCalculationEngine, BadgeEvaluationEngine
+from .timing import stage_timer
+
+logger = logging.getLogger(__name__)
+
+# ポイント・バッジ付与をバックグラウンドで行うか（既定のfalseではアップロードAPI内で同期実行）
+# trueにする場合は、クライアントが rewards_url で付与結果を確認できること
+RECEIPT_REWARDS_ASYNC = os.getenv("RECEIPT_REWARDS_ASYNC", "false").lower() == "true"
+# 未処理イベントを確認する間隔（秒）
+RECEIPT_OUTBOX_POLL_SECONDS = float(os.getenv("RECEIPT_OUTBOX_POLL_SECONDS", "1.0"))
+# 1回に取得するイベント数
+RECEIPT_OUTBOX_BATCH_SIZE = int(os.getenv("RECEIPT_OUTBOX_BATCH_SIZE", "20"))
+# 最大試行回数（超えたらfailed）
+RECEIPT_OUTBOX_MAX_ATTEMPTS = int(os.getenv("RECEIPT_OUTBOX_MAX_ATTEMPTS", "5"))
+# 処理中のまま放置されたイベントを再取得するまでの秒数
+RECEIPT_OUTBOX_LEASE_SECONDS = int(os.getenv("RECEIPT_OUTBOX_LEASE_SECONDS", "300"))
+
+RECEIPT_UPLOADED = "receipt_uploaded"
+
+def empty_rewards() -> Dict[str, Any]:
+    return {
+        "points_earned": 0,
+        "point_details": {
+            "base_points": 0,
+            "bonus_points": 0,
+            "bonus_details": []
+        },
+        "badges_awarded": []
+    }
+
+def upload_context_metadata(upload_context: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+    """
+    ポイント計算に使ったアップロード状況を付与履歴のメタデータ用に変換する
+    （ポイントの一括再計算で、付与時と同じ投稿時刻・天気コードを使うため）
+    """
+    upload_context = upload_context or {}
+    upload_time = upload_context.get("upload_time")
+    return {
+        "upload_time": upload_time.isoformat() if upload_time else None,
+        "weather_code": upload_context.get("weather_code")
+    }
+
+def award_receipt_rewards(
+    db: Session,
+    user_id: int,
+    receipt_id: int,
+    receipt_info: Dict[str, Any],
+    upload_context: Dict[str, Any],
+    event: Optional[models.OutboxEvent] = None
+) -> Dict[str, Any]:
+    """
+    レシート1件分のポイントを計算・付与し、バッジを判定する
+
+    eventを指定した場合は、ポイント付与と同じコミットでイベントを完了にする
+    （コンシューマーが途中で停止してもポイントが二重付与されないようにする）
+    完了後のバッジ判定が失敗してもイベントは完了のままとし、バッジは次回の判定・再評価ジョブで授与する
+
+    Returns:
+        Dict: points_earned, point_details, badges_awarded
+    """
+    point_engine = PointCalculationEngine(db)
+    with stage_timer("calculate_points", table="receipts"):
+        point_result = point_engine.calculate_points(
+            receipt_info,
+            user_id,
+            upload_context
+        )
+
+    rewards = {
+        "points_earned": point_result.total_points,
+        "point_details": {
+            "base_points": point_result.base_points,
+            "bonus_points": point_result.bonus_points,
+            "bonus_details": point_result.bonus_details
+        },
+        "badges_awarded": []
+    }
+
+    if event is not None:
+        event.status = "completed"
+        event.result = rewards
+        event.processed_at = datetime.now()
+
+    # ポイント付与
+    if point_result.total_points > 0:
+        with stage_timer("update_user_points", table="point_transactions"):
+            crud.update_user_points(
+                db,
+                user_id,
+                point_result.total_points,
+                "earn",
+                f"レシートアップロード: {receipt_info.get('supplier_name', '不明')}",
+                {
+                    "receipt_id": receipt_id,
+                    "base_points": point_result.base_points,
+                    "bonus_points": point_result.bonus_points,
+                    "bonus_details": point_result.bonus_details,
+                    "upload_context": upload_context_metadata(upload_context)
+                }
+            )
+    elif event is not None:
+        db.commit()
+
+    if event is None:
+        _award_badges(db, user_id, rewards)
+        return rewards
+
+    # ここまででイベントの完了はコミット済みのため、以降の失敗でイベントを未処理に戻さない
+    try:
+        if _award_badges(db, user_id, rewards):
+            event.result = dict(rewards)
+            db.commit()
+    except Exception as e:
+        db.rollback()
+        logger.error(f"バッジ判定エラー(event={event.id}): {e}")
+
+    return rewards
+
+def _award_badges(db: Session, user_id: int, rewards: Dict[str, Any]) -> bool:
+    """バッジを判定・授与して rewards に反映する。授与があればTrue"""
+    badge_engine = BadgeEvaluationEngine(db)
+    with stage_timer("evaluate_and_award_badges", table="user_badges"):
+        awarded_badges = badge_engine.evaluate_and_award_badges(user_id)
+
+    rewards["badges_awarded"] = [{
+        "badge_id": badge.badge_id,
+        "badge_name": badge.badge_name,
+        "is_new": badge.is_new
+    } for badge in awarded_badges]
+    return bool(awarded_badges)
+
+def process_receipt_uploaded_event(db: Session, event: models.OutboxEvent) -> None:
+    """receipt_uploaded イベント1件を処理する"""
+    payload = event.payload or {}
+    upload_time = payload.get("upload_time")
+    upload_context = {
+        "upload_time": datetime.fromisoformat(upload_time) if upload_time else datetime.now(),
+        "weather_code": payload.get("weather_code")
+    }
+    if payload.get("receipt_count") is not None:
+        # 登録時点の投稿実績（処理までに同じユーザーの次のレシートが登録されていても初回・連続の判定を変えない）
+        upload_context["receipt_count"] = payload["receipt_count"]
+        upload_context["current_streak"] = payload["current_streak"]
+    receipt_info = {
+        "supplier_name": payload.get("supplier_name"),
+        "total_amount": payload.get("total_amount")
+    }
+    award_receipt_rewards(db, event.user_id, event.aggregate_id, receipt_info, upload_context, event)
+
+class RewardOutboxConsumer:
+    """
+    receipt_uploaded イベントのコンシューマー
+    アプリ起動時にstart()、終了時にstop()を呼び出す
+    """
+
+    def __init__(
+        self,
+        poll_seconds: float = RECEIPT_OUTBOX_POLL_SECONDS,
+        batch_size: int = RECEIPT_OUTBOX_BATCH_SIZE,
+        max_attempts: int = RECEIPT_OUTBOX_MAX_ATTEMPTS,
+        lease_seconds: int = RECEIPT_OUTBOX_LEASE_SECONDS
+    ):
+        self.poll_seconds = poll_seconds
+        self.batch_size = batch_size
+        self.max_attempts = max_attempts
+        self.lease_seconds = lease_seconds
+        self._task: Optional[asyncio.Task] = None
+        self._wakeup: Optional[asyncio.Event] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+
+    async def start(self) -> None:
+        if self._task is not None:
+            return
+        self._loop = asyncio.get_running_loop()
+        self._wakeup = asyncio.Event()
+        self._task = asyncio.create_task(self._run())
+        logger.info("ポイント・バッジ付与コンシューマーを起動")
+
+    async def stop(self) -> None:
+        if self._task is None:
+            return
+        self._task.cancel()
+        await asyncio.gather(self._task, return_exceptions=True)
+        self._task = None
+
+    def notify(self) -> None:
+        """新しいイベントの記録を通知する（スレッドプールからも呼び出せる）"""
+        if self._loop is not None and self._wakeup is not None:
+            self._loop.call_soon_threadsafe(self._wakeup.set)
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                processed = await run_in_threadpool(self.process_pending)
+            except Exception as e:
+                logger.error(f"アウトボックス処理エラー: {e}")
+                processed = 0
+
+            # 取得上限まで処理した場合は続けて処理する
+            if processed >= self.batch_size:
+                continue
+
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.poll_seconds)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+
+    def process_pending(self) -> int:
+        """未処理のイベントを処理し、処理件数を返す（スレッドプールで実行）"""
+        db = SessionLocal()
+        try:
+            events: List[models.OutboxEvent] = crud.claim_outbox_events(
+                db, RECEIPT_UPLOADED, self.batch_size, self.lease_seconds
+            )
+            for event in events:
+                try:
+                    process_receipt_uploaded_event(db, event)
+                except Exception as e:
+                    db.rollback()
+                    logger.error(f"receipt_uploadedイベント処理エラー(event={event.id}): {e}")
+                    # ポイント付与と同時に完了がコミット済みなら、再取得させない（二重付与の防止）
+                    db.refresh(event)
+                    if event.status == "completed":
+                        continue
+                    event.status = "failed" if event.attempts >= self.max_attempts else "pending"
+                    event.error = str(e)
+                    db.commit()
+            return len(events)
+        finally:
+            db.close()
+
+# グローバルインスタンス
+reward_outbox_consumer = RewardOutboxConsumer()
@@ -0,0 +1,130 @@
+"""
+レシート取り込みパイプラインのステージ別計測
+各ステージの処理時間を構造化ログ（SystemLogger）に出力し、プロセス内のヒストグラムに集計する
+リクエスト単位の計測結果は Server-Timing ヘッダーとして返すこともできる
+"""
+
+import os
+import time
+import threading
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Dict, Any, List, Optional, Tuple
+
+from fastapi import HTTPException
+
+from ..logging_config import system_logger
+
+# レスポンスに Server-Timing ヘッダーを付与するか
+RECEIPT_SERVER_TIMING = os.getenv("RECEIPT_SERVER_TIMING", "false").lower() == "true"
+
+# ヒストグラムのバケット上限（ミリ秒）
+STAGE_BUCKETS_MS = (5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000)
+
+class StageHistogram:
+    """1ステージ分のレイテンシ分布"""
+
+    def __init__(self, buckets: Tuple[int, ...] = STAGE_BUCKETS_MS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # 最後は上限超過分
+        self.count = 0
+        self.sum_ms = 0.0
+        self.max_ms = 0.0
+
+    def observe(self, duration_ms: float) -> None:
+        index = len(self.buckets)
+        for i, upper in enumerate(self.buckets):
+            if duration_ms <= upper:
+                index = i
+                break
+        self.counts[index] += 1
+        self.count += 1
+        self.sum_ms += duration_ms
+        self.max_ms = max(self.max_ms, duration_ms)
+
+    def snapshot(self) -> Dict[str, Any]:
+        # 累積バケット（Prometheusのhistogramと同じ形式）
+        cumulative = 0
+        buckets = {}
+        for upper, count in zip(list(self.buckets) + ["+Inf"], self.counts):
+            cumulative += count
+            buckets[str(upper)] = cumulative
+        return {
+            "count": self.count,
+            "sum_ms": round(self.sum_ms, 1),
+            "avg_ms": round(self.sum_ms / self.count, 1) if self.count else 0,
+            "max_ms": round(self.max_ms, 1),
+            "buckets": buckets,
+        }
+
+class StageMetrics:
+    """ステージ名 → ヒストグラムの集計（スレッドセーフ）"""
+
+    def __init__(self):
+        self._histograms: Dict[str, StageHistogram] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, stage: str, duration_ms: float) -> None:
+        with self._lock:
+            histogram = self._histograms.get(stage)
+            if histogram is None:
+                histogram = self._histograms[stage] = StageHistogram()
+            histogram.observe(duration_ms)
+
+    def snapshot(self) -> Dict[str, Dict[str, Any]]:
+        with self._lock:
+            return {stage: histogram.snapshot() for stage, histogram in sorted(self._histograms.items())}
+
+# グローバルインスタンス
+stage_metrics = StageMetrics()
+
+# リクエスト単位の計測結果（run_in_threadpoolやasyncio.gatherにも引き継がれる）
+_request_spans: ContextVar[Optional[List[Tuple[str, float]]]] = ContextVar("receipt_request_spans", default=None)
+
+def start_request_timing() -> List[Tuple[str, float]]:
+    """現在のリクエストの計測を開始し、計測結果を格納するリストを返す"""
+    spans: List[Tuple[str, float]] = []
+    _request_spans.set(spans)
+    return spans
+
+def server_timing_header(spans: List[Tuple[str, float]]) -> str:
+    """計測結果を Server-Timing ヘッダーの値に変換する（同名ステージは合算）"""
+    totals: Dict[str, float] = {}
+    for stage, duration_ms in spans:
+        totals[stage] = totals.get(stage, 0.0) + duration_ms
+    return ", ".join(f"{stage};dur={duration_ms:.1f}" for stage, duration_ms in totals.items())
+
+@contextmanager
+def stage_timer(stage: str, table: str = None, service: str = None, endpoint: str = None):
+    """
+    ステージの処理時間を計測する
+
+    serviceを指定した場合は外部API呼び出し（external_api_call）、
+    tableを指定した場合はデータベース操作（database_operation）としてログに出力する
+    （いずれもなければヒストグラムへの集計のみ）
+    """
+    start = time.perf_counter()
+    response_code = 200
+    success = True
+    try:
+        yield
+    except HTTPException as e:
+        response_code = e.status_code
+        success = False
+        raise
+    except Exception:
+        response_code = 500
+        success = False
+        raise
+    finally:
+        duration_ms = (time.perf_counter() - start) * 1000
+        stage_metrics.observe(stage, duration_ms)
+
+        spans = _request_spans.get()
+        if spans is not None:
+            spans.append((stage, duration_ms))
+
+        if service:
+            system_logger.external_api_call(service, endpoint or stage, response_code, int(duration_ms))
+        elif table:
+            system_logger.database_operation(stage, table, int(duration_ms), success)
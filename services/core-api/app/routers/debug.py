@@ -67,6 +67,7 @@ def generate_sample_data(
                 weather_factor = random.uniform(0.6, 0.8)
 
         num_receipts = int(random.randint(20, 40) * weather_factor)
+        receipts = []
 
         for _ in range(num_receipts):
             num_items = random.randint(1, 4)
@@ -81,14 +82,16 @@ def generate_sample_data(
                 ))
                 total_amount += product["price"]
 
-            receipt_data = schemas.ReceiptCreate(
+            receipts.append(schemas.ReceiptCreate(
                 supplier_name="あさひパン店",
                 total_amount=total_amount,
                 receipt_date=current_date,
                 items=receipt_items
-            )
-            crud.create_receipt(db=db, receipt=receipt_data, user_id=owner.id)
-            total_receipts_created += 1
+            ))
+
+        # その日のレシートをまとめて登録
+        crud.create_receipts_bulk(db=db, receipts=receipts, user_id=owner.id)
+        total_receipts_created += len(receipts)
 
     return {"message": f"Successfully created {total_receipts_created} sample receipts for {OWNER_EMAIL}."}
 
@@ -115,6 +118,7 @@ def generate_customer_receipts(
     for customer in customers:
         if not customer: continue
         # 各顧客に5枚ずつレシートを生成
+        receipts = []
         for i in range(5):
             current_date = today - timedelta(days=random.randint(0, 6))
             num_items = random.randint(1, 3)
@@ -129,15 +133,16 @@ def generate_customer_receipts(
                 ))
                 total_amount += product["price"]
 
-            receipt_data = schemas.ReceiptCreate(
+            receipts.append(schemas.ReceiptCreate(
                 supplier_name="あさひパン店",
                 total_amount=total_amount,
                 receipt_date=current_date,
                 items=receipt_items
-            )
-            # このレシートはオーナーではなく、顧客に紐づける
-            crud.create_receipt(db=db, receipt=receipt_data, user_id=customer.id)
-            total_receipts_created += 1
+            ))
+
+        # このレシートはオーナーではなく、顧客に紐づける
+        crud.create_receipts_bulk(db=db, receipts=receipts, user_id=customer.id)
+        total_receipts_created += len(receipts)
             
     return {"message": f"Successfully created {total_receipts_created} sample receipts for virtual customers."}
 
@@ -4,6 +4,7 @@ from typing import List
 from .. import crud, models, schemas
 from ..database import get_db
 from .. import security
+from ..gamification.leaderboard import leaderboard, period_bounds, LEADERBOARD_WINDOWS, LEADERBOARD_SCOPES
 
 router = APIRouter(prefix="/api/gamification", tags=["gamification"])
 
@@ -63,22 +64,23 @@ def redeem_points(
     """
     ポイントを使用する（クーポン交換等で使用）
     """
-    profile = crud.get_gamification_profile(db, current_user.id)
-    if not profile or profile.contribution_points < points:
+    # 残高の確認と減算はDB上で1回のUPDATEで行う
+    try:
+        profile = crud.update_user_points(
+            db, 
+            current_user.id, 
+            points, 
+            "redeem", 
+            description,
+            {"action": "manual_redeem"}
+        )
+    except ValueError as e:
+        db.rollback()
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
-            detail="ポイントが不足しています"
+            detail=str(e)
         )
     
-    profile = crud.update_user_points(
-        db, 
-        current_user.id, 
-        points, 
-        "redeem", 
-        description,
-        {"action": "manual_redeem"}
-    )
-    
     return {"message": f"{points}ポイント使用しました", "current_points": profile.contribution_points}
 
 # ========== 特典交換機能 ==========
@@ -137,6 +139,49 @@ def get_my_rewards(
     """
     return crud.get_user_rewards(db, current_user.id, skip=skip, limit=limit)
 
+# ========== ランキング ==========
+
+@router.get("/leaderboard", response_model=schemas.Leaderboard)
+def get_leaderboard(
+    window: str = "weekly",
+    scope: str = "global",
+    limit: int = 10,
+    current_user: models.User = Depends(security.get_current_user),
+    db: Session = Depends(get_db)
+):
+    """
+    週間・月間の獲得ポイントランキングと自分の順位を取得
+    scope=area / age_group の場合は自分と同じ居住エリア・年代のランキング
+    他のユーザーは順位とポイントのみを返す（氏名・ユーザーIDは公開しない）
+    """
+    if window not in LEADERBOARD_WINDOWS or scope not in LEADERBOARD_SCOPES:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"windowは{'/'.join(LEADERBOARD_WINDOWS)}、scopeは{'/'.join(LEADERBOARD_SCOPES)}を指定してください"
+        )
+    scope_value = {"global": None, "area": current_user.area, "age_group": current_user.age_group}[scope]
+    if scope != "global" and not scope_value:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="プロフィールに居住エリア・年代が登録されていません"
+        )
+
+    top = leaderboard.top(db, window, scope, scope_value, limit=min(max(limit, 1), 100))
+    mine = leaderboard.rank(db, window, current_user.id, scope, scope_value)
+
+    return {
+        "window": window,
+        "period": period_bounds(window)[0],
+        "scope": scope,
+        "scope_value": scope_value,
+        "entries": [
+            {"rank": rank, "points": points, "is_me": user_id == current_user.id}
+            for rank, (user_id, points) in enumerate(top, start=1)
+        ],
+        "my_rank": mine[0] if mine else None,
+        "my_points": mine[1] if mine else 0
+    }
+
 # 管理者用エンドポイント
 @router.post("/admin/badges", response_model=schemas.Badge)
 def create_badge(
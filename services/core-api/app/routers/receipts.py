@@ -1,153 +1,202 @@
-from fastapi import APIRouter, Depends, HTTPException, UploadFile, File, Request
+from typing import List, Optional
+from fastapi import APIRouter, Depends, HTTPException, UploadFile, File, Request, Response, Header
+from fastapi.concurrency import run_in_threadpool
 from sqlalchemy.orm import Session
-from google.cloud import storage
-import uuid
-import requests
 
 from .. import crud, schemas, security
 from ..database import get_db
-from ..gamification import PointCalculationEngine, BadgeEvaluationEngine
+from ..receipt_pipeline import (
+    store_receipt_image,
+    extract_receipt,
+    save_receipt_with_rewards,
+    extract_receipt_batch,
+    save_receipt_batch_with_rewards,
+    RECEIPT_BATCH_MAX_FILES,
+    receipt_job_queue,
+    RECEIPT_UPLOADED,
+    run_idempotent,
+    stage_metrics,
+    start_request_timing,
+    server_timing_header,
+    RECEIPT_SERVER_TIMING,
+)
 from ..security.rate_limit import limiter, RateLimits
-from datetime import datetime
 
 router = APIRouter(
     prefix="/receipts",
     tags=["receipts"],
 )
 
-# GCS設定
-BUCKET_NAME = "your-gcp-project-id-receipts"
-storage_client = storage.Client()
-
-# OCR Processorサービスのエンドポイント
-OCR_PROCESSOR_URL = "http://ocr-processor/process-gcs/"
-
 @router.post("/upload", response_model=schemas.ReceiptUploadResponse)
 @limiter.limit(RateLimits.UPLOAD)
 async def upload_receipt(
     request: Request,
-    db: Session = Depends(get_db), 
+    response: Response,
+    db: Session = Depends(get_db),
     file: UploadFile = File(...),
+    idempotency_key: Optional[str] = Header(None),
     token_data: schemas.TokenData = Depends(security.get_current_user)
 ):
+    """
+    レシート画像をアップロード
+    Idempotency-Key ヘッダーを指定すると、同じキーでの再送には保存済みのレスポンスを返す
+    RECEIPT_REWARDS_ASYNC=true の場合、ポイント・バッジは rewards_status="pending" で返し、
+    付与結果は rewards_url（GET /receipts/{receipt_id}/rewards）で確認する
+    """
     current_user = crud.get_user_by_email(db, email=token_data.email)
     if not current_user:
         raise HTTPException(status_code=404, detail="User not found")
 
-    # 1. GCSにファイルをアップロード
-    try:
-        bucket = storage_client.bucket(BUCKET_NAME)
-        blob_name = f"receipts/{uuid.uuid4()}-{file.filename}"
-        blob = bucket.blob(blob_name)
-        
-        contents = await file.read()
-        blob.upload_from_string(contents, content_type=file.content_type)
-        
-        gcs_uri = f"gs://{BUCKET_NAME}/{blob_name}"
-        
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"GCS upload failed: {str(e)}")
-
-    # 2. OCRサービスを呼び出す
-    try:
-        response = requests.post(OCR_PROCESSOR_URL, json={"gcs_uri": gcs_uri})
-        response.raise_for_status()
-        ocr_result = response.json()
-    except requests.exceptions.RequestException as e:
-        raise HTTPException(status_code=502, detail=f"Failed to call OCR service: {str(e)}")
-
-    # 2.5. 店舗をマッチングまたは作成
-    store = crud.find_or_create_store(
-        db,
-        supplier_name=ocr_result.get("supplier_name"),
-        supplier_phone=ocr_result.get("supplier_phone")
+    spans = start_request_timing()
+
+    async def process():
+        # 1. 画像をOCRサービスへ直接送信し、GCSへのアーカイブ保存は並行して実行
+        # 同じユーザーの同一画像が直近に処理済みであれば既存のblobとOCR結果を再利用する
+        gcs_uri, _, ocr_result = await extract_receipt(file, current_user.id)
+
+        # 2. 店舗マッチング・重複チェック・保存・ポイント/バッジ付与
+        return await run_in_threadpool(
+            save_receipt_with_rewards, db, current_user.id, gcs_uri, ocr_result
+        )
+
+    result = await run_idempotent(
+        idempotency_key, "upload", current_user.id, process, schemas.ReceiptUploadResponse, files=[file]
     )
 
-    # 3. 重複チェック
-    point_engine = PointCalculationEngine(db)
-    receipt_info = {
-        "supplier_name": ocr_result.get("supplier_name"),
-        "total_amount": ocr_result.get("total_amount"),
-        "receipt_date": datetime.now()
-    }
-    
-    if point_engine.is_duplicate_receipt(receipt_info, current_user.id):
+    if RECEIPT_SERVER_TIMING:
+        response.headers["Server-Timing"] = server_timing_header(spans)
+    return result
+
+@router.post("/upload-batch", response_model=schemas.ReceiptBatchUploadResponse)
+@limiter.limit(RateLimits.UPLOAD)
+async def upload_receipt_batch(
+    request: Request,
+    response: Response,
+    db: Session = Depends(get_db),
+    files: List[UploadFile] = File(...),
+    idempotency_key: Optional[str] = Header(None),
+    token_data: schemas.TokenData = Depends(security.get_current_user)
+):
+    """
+    複数のレシート画像を一括アップロード
+    GCS保存とOCRは並列に実行し、DB保存・ポイント付与・バッジ判定はバッチ全体で1回にまとめる
+    """
+    current_user = crud.get_user_by_email(db, email=token_data.email)
+    if not current_user:
+        raise HTTPException(status_code=404, detail="User not found")
+
+    if len(files) > RECEIPT_BATCH_MAX_FILES:
         raise HTTPException(
-            status_code=400, 
-            detail="このレシートは既にアップロード済みです"
+            status_code=400,
+            detail=f"一度にアップロードできるのは{RECEIPT_BATCH_MAX_FILES}枚までです"
+        )
+
+    spans = start_request_timing()
+
+    async def process():
+        entries = await extract_receipt_batch(files, current_user.id)
+        return await run_in_threadpool(
+            save_receipt_batch_with_rewards, db, current_user.id, entries
         )
-    
-    # 4. 結果をDBに保存（店舗IDを含める）
-    receipt_data = schemas.ReceiptCreate(
-        supplier_name=ocr_result.get("supplier_name"),
-        total_amount=ocr_result.get("total_amount"),
-        store_id=store.id,
-        image_gcs_path=gcs_uri,
-        ocr_raw_data=ocr_result,
-        items=[schemas.ReceiptItemCreate(**item) for item in ocr_result.get("line_items", [])]
+
+    result = await run_idempotent(
+        idempotency_key, "upload-batch", current_user.id, process, schemas.ReceiptBatchUploadResponse, files=files
     )
 
-    db_receipt = crud.create_receipt(db=db, receipt=receipt_data, user_id=current_user.id)
-    
-    # 5. ポイント計算と付与
-    try:
-        upload_context = {
-            "upload_time": datetime.now(),
-            "weather_code": None  # TODO: 現在の天候情報を取得
-        }
-        
-        point_result = point_engine.calculate_points(
-            receipt_info, 
-            current_user.id, 
-            upload_context
+    if RECEIPT_SERVER_TIMING:
+        response.headers["Server-Timing"] = server_timing_header(spans)
+    return result
+
+@router.post("/upload-async", response_model=schemas.ReceiptJobAccepted, status_code=202)
+@limiter.limit(RateLimits.UPLOAD)
+async def upload_receipt_async(
+    request: Request,
+    db: Session = Depends(get_db),
+    file: UploadFile = File(...),
+    idempotency_key: Optional[str] = Header(None),
+    token_data: schemas.TokenData = Depends(security.get_current_user)
+):
+    """
+    レシート画像を保存してジョブを登録し、即座に202を返す
+    OCR以降の処理はワーカープールで実行され、進捗は /receipts/jobs/{job_id} で確認できる
+    """
+    current_user = crud.get_user_by_email(db, email=token_data.email)
+    if not current_user:
+        raise HTTPException(status_code=404, detail="User not found")
+
+    async def process():
+        gcs_uri, content_hash = await run_in_threadpool(
+            store_receipt_image, file.file, file.filename, file.content_type, current_user.id
         )
-        
-        # ポイント付与
-        if point_result.total_points > 0:
-            crud.update_user_points(
-                db,
-                current_user.id,
-                point_result.total_points,
-                "earn",
-                f"レシートアップロード: {receipt_info.get('supplier_name', '不明')}",
-                {
-                    "receipt_id": db_receipt.id,
-                    "base_points": point_result.base_points,
-                    "bonus_points": point_result.bonus_points,
-                    "bonus_details": point_result.bonus_details
-                }
-            )
-        
-        # 6. バッジ判定と授与
-        badge_engine = BadgeEvaluationEngine(db)
-        awarded_badges = badge_engine.evaluate_and_award_badges(current_user.id)
-        
-        # 7. レスポンスに追加情報を含める
-        return {
-            "receipt": db_receipt,
-            "points_earned": point_result.total_points,
-            "point_details": {
-                "base_points": point_result.base_points,
-                "bonus_points": point_result.bonus_points,
-                "bonus_details": point_result.bonus_details
-            },
-            "badges_awarded": [{
-                "badge_id": badge.badge_id,
-                "badge_name": badge.badge_name,
-                "is_new": badge.is_new
-            } for badge in awarded_badges]
-        }
-        
-    except Exception as e:
-        # ポイント・バッジ処理でエラーが発生してもレシート保存は成功とする
-        print(f"ポイント/バッジ処理エラー: {e}")
+
+        job = await receipt_job_queue.enqueue(current_user.id, gcs_uri, content_hash)
+
         return {
-            "receipt": db_receipt,
-            "points_earned": 0,
-            "point_details": {
-                "base_points": 0,
-                "bonus_points": 0,
-                "bonus_details": []
-            },
-            "badges_awarded": []
+            "job_id": job["job_id"],
+            "status": job["status"],
+            "status_url": f"/api/receipts/jobs/{job['job_id']}"
         }
+
+    # 同じキーでの再送には最初に登録したジョブを返す
+    return await run_idempotent(
+        idempotency_key, "upload-async", current_user.id, process, schemas.ReceiptJobAccepted, status_code=202,
+        files=[file]
+    )
+
+@router.get("/jobs/{job_id}", response_model=schemas.ReceiptJobStatus)
+def get_receipt_job(
+    job_id: str,
+    db: Session = Depends(get_db),
+    token_data: schemas.TokenData = Depends(security.get_current_user)
+):
+    """
+    非同期アップロードジョブの進捗を取得
+    """
+    current_user = crud.get_user_by_email(db, email=token_data.email)
+    if not current_user:
+        raise HTTPException(status_code=404, detail="User not found")
+
+    job = receipt_job_queue.get(job_id)
+    # 他ユーザーのジョブは存在しないものとして扱う
+    if not job or job.get("user_id") != current_user.id:
+        raise HTTPException(status_code=404, detail="Job not found")
+
+    return job
+
+@router.get("/{receipt_id}/rewards", response_model=schemas.ReceiptRewardsStatus)
+def get_receipt_rewards(
+    receipt_id: int,
+    db: Session = Depends(get_db),
+    token_data: schemas.TokenData = Depends(security.get_current_user)
+):
+    """
+    レシート投稿によるポイント・バッジ付与の結果を取得
+    付与はバックグラウンドで行われるため、statusがcompletedになるまでポーリングする
+    """
+    current_user = crud.get_user_by_email(db, email=token_data.email)
+    if not current_user:
+        raise HTTPException(status_code=404, detail="User not found")
+
+    event = crud.get_outbox_event(db, RECEIPT_UPLOADED, receipt_id)
+    if not event or event.user_id != current_user.id:
+        raise HTTPException(status_code=404, detail="Receipt rewards not found")
+
+    return {
+        "receipt_id": receipt_id,
+        "status": event.status,
+        **(event.result or {})
+    }
+
+@router.get("/metrics")
+def get_receipt_pipeline_metrics(
+    db: Session = Depends(get_db),
+    token_data: schemas.TokenData = Depends(security.get_current_user)
+):
+    """
+    レシート取り込みパイプラインのステージ別レイテンシ（このプロセスでの集計）を取得（管理者のみ）
+    """
+    current_user = crud.get_user_by_email(db, email=token_data.email)
+    if not current_user or not current_user.is_owner:
+        raise HTTPException(status_code=403, detail="メトリクスへのアクセス権限がありません")
+
+    return {"stages": stage_metrics.snapshot()}
@@ -6,6 +6,7 @@ from typing import List
 
 from .. import crud, schemas
 from ..database import get_db
+from ..weather_context import weather_context
 
 router = APIRouter(
     prefix="/weather",
@@ -249,6 +250,9 @@ def fetch_and_store_weather_data(db: Session = Depends(get_db)):
         except Exception as e:
             continue
 
+    # レシート投稿時に参照する当日の天候を更新
+    weather_context.refresh(db)
+
     # 実際の処理範囲を計算
     if processed_dates:
         actual_start_date = min(processed_dates)
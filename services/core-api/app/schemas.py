@@ -73,6 +73,7 @@ class ReceiptBase(BaseModel):
 
 class ReceiptCreate(ReceiptBase):
     items: List[ReceiptItemCreate] = []
+    dedup_fingerprint: Optional[str] = None
 
 class Receipt(ReceiptBase):
     id: int
@@ -210,6 +211,43 @@ class ReceiptUploadResponse(BaseModel):
     points_earned: int
     point_details: PointDetails
     badges_awarded: List[BadgeAwarded]
+    rewards_status: str = "completed"  # "completed" または "pending"（バックグラウンドで付与中）
+    rewards_url: Optional[str] = None  # pendingの場合の結果確認URL
+
+class ReceiptRewardsStatus(BaseModel):
+    receipt_id: int
+    status: str  # "pending", "processing", "completed", "failed"
+    points_earned: int = 0
+    point_details: Optional[PointDetails] = None
+    badges_awarded: List[BadgeAwarded] = []
+
+class ReceiptBatchItemResult(BaseModel):
+    filename: Optional[str] = None
+    status: str  # "created", "duplicate", "failed"
+    receipt: Optional[Receipt] = None
+    points_earned: int = 0
+    point_details: Optional[PointDetails] = None
+    error: Optional[str] = None
+
+class ReceiptBatchUploadResponse(BaseModel):
+    results: List[ReceiptBatchItemResult]
+    created_count: int
+    total_points_earned: int
+    badges_awarded: List[BadgeAwarded]
+
+class ReceiptJobAccepted(BaseModel):
+    job_id: str
+    status: str  # "queued", "processing", "completed", "failed"
+    status_url: str
+
+class ReceiptJobStatus(BaseModel):
+    job_id: str
+    status: str
+    stage: Optional[str] = None  # "ocr", "saving"
+    result: Optional[ReceiptUploadResponse] = None
+    error: Optional[Dict[str, Any]] = None
+    created_at: datetime
+    updated_at: datetime
 
 # ========== LINE連携スキーマ ==========
 
@@ -376,6 +414,21 @@ class BadgeAwardResult(BaseModel):
     badge_name: str
     is_new: bool  # 新規獲得かどうか
 
+class LeaderboardEntry(BaseModel):
+    # 他のユーザーの氏名・IDは返さない（本人の行のみ is_me=True）
+    rank: int
+    points: int
+    is_me: bool = False
+
+class Leaderboard(BaseModel):
+    window: str  # "weekly" or "monthly"
+    period: str  # e.g., "2026-W42", "2026-10"
+    scope: str  # "global", "area", "age_group"
+    scope_value: Optional[str] = None
+    entries: List[LeaderboardEntry] = []
+    my_rank: Optional[int] = None  # 期間内の獲得がない場合はNone
+    my_points: int = 0
+
 # ========== 商品管理スキーマ ==========
 
 class ProductCategoryBase(BaseModel):
@@ -1,21 +1,12 @@
-import os
 from slowapi import Limiter, _rate_limit_exceeded_handler
 from slowapi.util import get_remote_address
 from slowapi.errors import RateLimitExceeded
 from fastapi import FastAPI, Request, HTTPException, status
 from fastapi.responses import JSONResponse
-import redis
 from typing import Optional
 
-# Redis設定
-REDIS_URL = os.getenv("REDIS_URL", "redis://localhost:6379")
-try:
-    redis_client = redis.from_url(REDIS_URL, decode_responses=True)
-    # Redis接続テスト
-    redis_client.ping()
-except (redis.ConnectionError, redis.TimeoutError) as e:
-    print(f"Redis connection failed: {e}")
-    redis_client = None
+# Redis設定（共通クライアントを利用）
+from ..cache import REDIS_URL, redis_client
 
 # レート制限設定
 def get_identifier(request: Request) -> str:
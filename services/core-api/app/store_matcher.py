@@ -0,0 +1,294 @@
+"""
+店名マッチャー
+正規化した店名からAho-Corasickオートマトンと文字bigram索引をプロセス内に構築し、
+OCRで読み取った店名に最も近い店舗を店名の長さに比例する時間で探す
+
+店舗の追加・変更はSQLAlchemyのイベントで検知し、追加は即時に、変更・削除は次回照合時の再構築で反映する
+（他Podでの変更は STORE_MATCHER_REFRESH_SECONDS ごとの再構築で反映する。他Podで追加された店舗は、
+索引にない場合に索引構築後のIDの範囲を STORE_MATCHER_UNINDEXED_LIMIT 件まで読み込んで照合する）
+"""
+
+import os
+import time
+import logging
+import threading
+from typing import Dict, List, Optional, Tuple
+
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+from . import models
+from .normalization import normalize_store_name
+
+logger = logging.getLogger(__name__)
+
+# 索引を再構築する間隔（秒）
+STORE_MATCHER_REFRESH_SECONDS = int(os.getenv("STORE_MATCHER_REFRESH_SECONDS", "300"))
+# あいまい一致とみなすbigramのDice係数の下限
+STORE_MATCHER_MIN_SIMILARITY = float(os.getenv("STORE_MATCHER_MIN_SIMILARITY", "0.6"))
+# 部分一致の対象にする店名の最小文字数（1文字の店名が何にでも一致するのを防ぐ）
+STORE_MATCHER_MIN_NAME_LENGTH = 2
+# 索引の構築後に追加された店舗をDBから照合する最大件数
+STORE_MATCHER_UNINDEXED_LIMIT = int(os.getenv("STORE_MATCHER_UNINDEXED_LIMIT", "1000"))
+
+def _bigrams(text: str) -> set:
+    return {text[i:i + 2] for i in range(len(text) - 1)}
+
+def _dice(grams: set, other: set) -> float:
+    return 2 * len(grams & other) / (len(grams) + len(other)) if grams and other else 0.0
+
+class StoreNameIndex:
+    """正規化店名の索引（構築後は読み取り専用。追加分は recent で保持する）"""
+
+    def __init__(self, stores: List[Tuple[int, str]]):
+        # 索引に含まれる最大の店舗ID（以降に追加された店舗は索引にない）
+        self.max_store_id = max((store_id for store_id, _ in stores), default=0)
+        # 正規化店名 → 店舗ID（同名は最も古い店舗）
+        self.exact: Dict[str, int] = {}
+        for store_id, name in sorted(stores):
+            normalized = normalize_store_name(name)
+            if normalized and normalized not in self.exact:
+                self.exact[normalized] = store_id
+
+        self.names: List[str] = list(self.exact)
+        self.store_ids: List[int] = [self.exact[name] for name in self.names]
+        self.bigrams: List[set] = [_bigrams(name) for name in self.names]
+
+        # bigram → 店名のインデックス
+        self.postings: Dict[str, List[int]] = {}
+        for index, grams in enumerate(self.bigrams):
+            for gram in grams:
+                self.postings.setdefault(gram, []).append(index)
+
+        self._build_automaton()
+
+    def _build_automaton(self) -> None:
+        """店名を辞書とするAho-Corasickオートマトンを構築する"""
+        self.goto: List[Dict[str, int]] = [{}]
+        self.fail: List[int] = [0]
+        self.terminal: List[int] = [-1]   # そのノードで終わる店名のインデックス
+        self.output: List[int] = [-1]     # そのノードで終わる最長の店名（接尾辞を含む）
+
+        for index, name in enumerate(self.names):
+            if len(name) < STORE_MATCHER_MIN_NAME_LENGTH:
+                continue
+            node = 0
+            for char in name:
+                next_node = self.goto[node].get(char)
+                if next_node is None:
+                    next_node = len(self.goto)
+                    self.goto[node][char] = next_node
+                    self.goto.append({})
+                    self.fail.append(0)
+                    self.terminal.append(-1)
+                    self.output.append(-1)
+                node = next_node
+            self.terminal[node] = index
+
+        # 幅優先で失敗遷移を設定（浅いノードから確定させる）
+        queue = list(self.goto[0].values())
+        for node in queue:
+            self.output[node] = self.terminal[node]
+        head = 0
+        while head < len(queue):
+            node = queue[head]
+            head += 1
+            for char, child in self.goto[node].items():
+                fallback = self.fail[node]
+                while fallback and char not in self.goto[fallback]:
+                    fallback = self.fail[fallback]
+                self.fail[child] = self.goto[fallback].get(char, 0)
+                # 自ノードで終わる店名がなければ、失敗遷移先の最長一致を引き継ぐ
+                self.output[child] = self.terminal[child] if self.terminal[child] >= 0 else self.output[self.fail[child]]
+                queue.append(child)
+
+    def longest_contained(self, text: str) -> Optional[int]:
+        """textに含まれる店名のうち最長のもののインデックスを返す"""
+        best, best_length = None, 0
+        node = 0
+        for char in text:
+            while node and char not in self.goto[node]:
+                node = self.fail[node]
+            node = self.goto[node].get(char, 0)
+            index = self.output[node]
+            if index >= 0 and len(self.names[index]) > best_length:
+                best, best_length = index, len(self.names[index])
+        return best
+
+    def shortest_containing(self, text: str) -> Optional[int]:
+        """textを含む店名（旧実装の ilike '%name%' 相当）のうち最短のもののインデックスを返す"""
+        grams = _bigrams(text)
+        if not grams:
+            return None
+
+        # 出現の少ないbigramから積集合を取り、候補を絞り込む
+        postings = sorted((self.postings.get(gram, ()) for gram in grams), key=len)
+        candidates = set(postings[0])
+        for posting in postings[1:]:
+            if not candidates:
+                return None
+            candidates.intersection_update(posting)
+
+        best, best_length = None, 0
+        for index in candidates:
+            name = self.names[index]
+            if text in name and (best is None or len(name) < best_length):
+                best, best_length = index, len(name)
+        return best
+
+    def best_similar(self, text: str) -> Tuple[Optional[int], float]:
+        """bigramのDice係数が最も高い店名のインデックスとスコアを返す"""
+        grams = _bigrams(text)
+        if not grams:
+            return None, 0.0
+
+        shared: Dict[int, int] = {}
+        for gram in grams:
+            for index in self.postings.get(gram, ()):
+                shared[index] = shared.get(index, 0) + 1
+
+        best, best_score = None, 0.0
+        for index, count in shared.items():
+            score = 2 * count / (len(grams) + len(self.bigrams[index]))
+            if score > best_score:
+                best, best_score = index, score
+        return best, best_score
+
+class StoreNameMatcher:
+    """
+    プロセス全体で共有する店名マッチャー
+    初回照合時・変更検知後・一定時間経過後にDBから索引を再構築する
+    """
+
+    def __init__(self, refresh_seconds: int = STORE_MATCHER_REFRESH_SECONDS, min_similarity: float = STORE_MATCHER_MIN_SIMILARITY):
+        self.refresh_seconds = refresh_seconds
+        self.min_similarity = min_similarity
+        self._index: Optional[StoreNameIndex] = None
+        self._built_at = 0.0
+        self._dirty = True
+        # 前回の構築以降に追加された店舗（正規化店名, 店舗ID）
+        self._recent: List[Tuple[str, int]] = []
+        self._lock = threading.Lock()
+
+    def invalidate(self) -> None:
+        """次回照合時に索引を再構築する"""
+        self._dirty = True
+
+    def add(self, store_id: int, name: str) -> None:
+        """追加された店舗を再構築を待たずに照合対象にする"""
+        normalized = normalize_store_name(name)
+        if normalized:
+            with self._lock:
+                self._recent.append((normalized, store_id))
+
+    def build(self, db: Session) -> StoreNameIndex:
+        started_at = time.perf_counter()
+        stores = db.query(models.Store.id, models.Store.name).all()
+        index = StoreNameIndex([(store_id, name) for store_id, name in stores])
+        with self._lock:
+            self._index = index
+            self._built_at = time.monotonic()
+            self._dirty = False
+            self._recent = []
+        logger.info(f"店名索引を構築: {len(index.names)}件, {(time.perf_counter() - started_at) * 1000:.0f}ms")
+        return index
+
+    def _get_index(self, db: Session) -> StoreNameIndex:
+        index = self._index
+        if index is None or self._dirty or time.monotonic() - self._built_at > self.refresh_seconds:
+            index = self.build(db)
+        return index
+
+    def match(self, db: Session, supplier_name: str) -> Optional[int]:
+        """
+        OCRの店名に最も近い店舗のIDを返す（見つからなければNone）
+
+        1. 正規化店名の完全一致
+        2. OCR店名を含む店名（短い店名を優先）
+        3. OCR店名に含まれる店名（Aho-Corasick、長い店名を優先）
+        4. bigramのDice係数があいまい一致の下限以上の店名
+        """
+        text = normalize_store_name(supplier_name)
+        if not text:
+            return None
+
+        index = self._get_index(db)
+
+        store_id = index.exact.get(text)
+        if store_id is not None:
+            return store_id
+
+        # 再構築前に追加された店舗（件数は少ないため線形に照合）
+        recent_id = self._match_linear(text, list(self._recent))
+        if recent_id is not None:
+            return recent_id
+
+        containing = index.shortest_containing(text)
+        if containing is not None:
+            return index.store_ids[containing]
+
+        contained = index.longest_contained(text)
+        if contained is not None:
+            return index.store_ids[contained]
+
+        similar, score = index.best_similar(text)
+        if similar is not None and score >= self.min_similarity:
+            return index.store_ids[similar]
+
+        return None
+
+    def match_unindexed(self, db: Session, supplier_name: str) -> Optional[int]:
+        """
+        索引の構築後に追加された店舗（他Podで作成された店舗など）から、match と同じ基準で照合する
+        主キーの範囲で最大 STORE_MATCHER_UNINDEXED_LIMIT 件のみを読み込む
+        """
+        text = normalize_store_name(supplier_name)
+        if not text:
+            return None
+
+        index = self._get_index(db)
+        stores = db.query(models.Store.id, models.Store.name).filter(
+            models.Store.id > index.max_store_id
+        ).order_by(models.Store.id).limit(STORE_MATCHER_UNINDEXED_LIMIT).all()
+        return self._match_linear(text, [(normalize_store_name(name), store_id) for store_id, name in stores])
+
+    def _match_linear(self, text: str, candidates: List[Tuple[str, int]]) -> Optional[int]:
+        """（正規化店名, 店舗ID）の一覧から match と同じ優先順位で照合する（少数の候補用）"""
+        candidates = [(name, store_id) for name, store_id in candidates if name]
+        for name, store_id in candidates:
+            if name == text:
+                return store_id
+
+        containing = [(len(name), store_id) for name, store_id in candidates if text in name]
+        if containing:
+            return min(containing)[1]
+
+        contained = [
+            (len(name), store_id) for name, store_id in candidates
+            if len(name) >= STORE_MATCHER_MIN_NAME_LENGTH and name in text
+        ]
+        if contained:
+            return max(contained, key=lambda entry: (entry[0], -entry[1]))[1]
+
+        grams = _bigrams(text)
+        scored = [(_dice(grams, _bigrams(name)), -store_id) for name, store_id in candidates]
+        if scored:
+            score, negative_id = max(scored)
+            if score >= self.min_similarity:
+                return -negative_id
+        return None
+
+# グローバルインスタンス
+store_name_matcher = StoreNameMatcher()
+
+@event.listens_for(models.Store, "after_insert")
+def _store_inserted(mapper, connection, target):
+    store_name_matcher.add(target.id, target.name)
+
+@event.listens_for(models.Store, "after_update")
+def _store_updated(mapper, connection, target):
+    store_name_matcher.invalidate()
+
+@event.listens_for(models.Store, "after_delete")
+def _store_deleted(mapper, connection, target):
+    store_name_matcher.invalidate()
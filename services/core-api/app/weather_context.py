@@ -0,0 +1,73 @@
+"""
+現在の天候コンテキスト
+当日の WeatherData（気象庁の予報から取り込んだ天気コード）をプロセス内に保持し、
+レシート投稿ごとのポイント計算（天候ボーナス）でDB・外部APIを参照しないようにする
+
+/weather/fetch-and-store の実行時に再読み込みし、他Podでの更新は WEATHER_CONTEXT_TTL_SECONDS ごとに反映する
+"""
+
+import os
+import time
+import logging
+import threading
+from datetime import datetime, date, timedelta, timezone
+from typing import Optional
+
+from sqlalchemy.orm import Session
+
+from . import models
+
+logger = logging.getLogger(__name__)
+
+# 当日の天候を再読み込みする間隔（秒）
+WEATHER_CONTEXT_TTL_SECONDS = int(os.getenv("WEATHER_CONTEXT_TTL_SECONDS", "1800"))
+
+# 気象庁の予報日付は日本時間
+JST = timezone(timedelta(hours=9))
+
+class WeatherContextProvider:
+    """
+    当日の天気コード（WMO）をキャッシュする
+    日付が変わった場合・TTL経過後・refresh()の呼び出し時にDBから読み直す
+    """
+
+    def __init__(self, ttl_seconds: int = WEATHER_CONTEXT_TTL_SECONDS):
+        self.ttl_seconds = ttl_seconds
+        self._date: Optional[date] = None
+        self._weather_code: Optional[int] = None
+        self._loaded_at = 0.0
+        self._lock = threading.Lock()
+
+    def refresh(self, db: Session) -> Optional[int]:
+        """当日の天候をDBから読み込む"""
+        today = datetime.now(JST).date()
+        weather = db.query(models.WeatherData.weather_code).filter(
+            models.WeatherData.date == datetime.combine(today, datetime.min.time())
+        ).first()
+
+        with self._lock:
+            self._date = today
+            self._weather_code = weather[0] if weather else None
+            self._loaded_at = time.monotonic()
+        logger.info(f"天候コンテキストを更新: {today} weather_code={self._weather_code}")
+        return self._weather_code
+
+    def current_weather_code(self, db: Session) -> Optional[int]:
+        """
+        当日の天気コードを返す（当日のデータがなければNone）
+        キャッシュが有効な間はDBを参照しない
+        """
+        if (
+            self._date != datetime.now(JST).date()
+            or time.monotonic() - self._loaded_at > self.ttl_seconds
+        ):
+            try:
+                return self.refresh(db)
+            except Exception as e:
+                # 天候が取れなくてもレシート投稿は続ける（天候ボーナスなし）
+                logger.error(f"天候コンテキストの読み込みエラー: {e}")
+                return None
+        return self._weather_code
+
+# グローバルインスタンス
+weather_context = WeatherContextProvider()
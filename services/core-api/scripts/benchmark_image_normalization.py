@@ -0,0 +1,148 @@
+#!/usr/bin/env python3
+"""
+レシート画像正規化ベンチマーク
+
+サイズ帯（長辺ピクセル数）ごとに、正規化前後のバイト数・正規化処理時間を計測します。
+--ocr-url を指定した場合は、元画像と正規化画像をそれぞれOCRサービスへ送信し、
+OCRレイテンシも比較します。
+
+使い方:
+    python scripts/benchmark_image_normalization.py
+    python scripts/benchmark_image_normalization.py --images ./samples
+    python scripts/benchmark_image_normalization.py --images ./samples \\
+        --ocr-url http://localhost:8001/process-bytes/
+"""
+
+import argparse
+import io
+import os
+import random
+import statistics
+import sys
+import time
+from typing import Dict, List, Tuple
+
+# プロジェクトルートをPythonパスに追加
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from PIL import Image, ImageDraw
+
+from app.image_normalizer import normalize_image
+
+# 合成画像のサイズ帯（長辺ピクセル数）
+SIZE_TIERS = [1024, 2048, 3024, 4032]
+
+def generate_receipt_photo(long_edge: int) -> bytes:
+    """スマートフォン撮影を模したレシート画像（カラーJPEG、縦長）を生成する"""
+    width, height = int(long_edge * 0.75), long_edge
+    img = Image.new("RGB", (width, height), (214, 205, 190))
+    draw = ImageDraw.Draw(img)
+
+    # 用紙部分
+    margin = width // 8
+    draw.rectangle([margin, 0, width - margin, height], fill=(248, 246, 240))
+
+    # 明細行
+    line_height = max(12, height // 60)
+    for y in range(line_height * 3, height - line_height, line_height):
+        line_width = random.randint((width - margin * 2) // 3, width - margin * 3)
+        draw.rectangle(
+            [margin * 1.5, y, margin * 1.5 + line_width, y + line_height // 3],
+            fill=(40, 40, 40)
+        )
+
+    # 撮影ノイズ
+    noise = Image.effect_noise((width, height), 24).convert("RGB")
+    img = Image.blend(img, noise, 0.08)
+
+    output = io.BytesIO()
+    img.save(output, format="JPEG", quality=92)
+    return output.getvalue()
+
+def load_images(directory: str) -> List[Tuple[str, bytes]]:
+    images = []
+    for name in sorted(os.listdir(directory)):
+        path = os.path.join(directory, name)
+        if os.path.isfile(path):
+            with open(path, "rb") as f:
+                images.append((name, f.read()))
+    return images
+
+def size_tier(contents: bytes) -> int:
+    """画像の長辺を最も近いサイズ帯に丸める"""
+    with Image.open(io.BytesIO(contents)) as img:
+        long_edge = max(img.size)
+    return min(SIZE_TIERS, key=lambda tier: abs(tier - long_edge))
+
+def measure_ocr(ocr_url: str, contents: bytes, content_type: str) -> float:
+    """OCRサービスに画像を送信し、OCRのレイテンシ（ミリ秒）を返す"""
+    import requests
+
+    start = time.perf_counter()
+    response = requests.post(ocr_url, files={"file": ("receipt", contents, content_type)})
+    elapsed_ms = (time.perf_counter() - start) * 1000
+    response.raise_for_status()
+    return elapsed_ms
+
+def run_benchmark(images: List[Tuple[str, bytes]], ocr_url: str = None) -> Dict[int, Dict[str, List[float]]]:
+    results: Dict[int, Dict[str, List[float]]] = {}
+
+    for name, contents in images:
+        tier = size_tier(contents)
+        stats = results.setdefault(tier, {
+            "original_bytes": [], "normalized_bytes": [], "normalize_ms": [],
+            "ocr_original_ms": [], "ocr_normalized_ms": []
+        })
+
+        start = time.perf_counter()
+        normalized = normalize_image(contents)
+        stats["normalize_ms"].append((time.perf_counter() - start) * 1000)
+
+        if normalized is None:
+            print(f"  ✗ デコードできない画像をスキップ: {name}")
+            continue
+
+        normalized_bytes, mime_type = normalized
+        stats["original_bytes"].append(len(contents))
+        stats["normalized_bytes"].append(len(normalized_bytes))
+
+        if ocr_url:
+            stats["ocr_original_ms"].append(measure_ocr(ocr_url, contents, "image/jpeg"))
+            stats["ocr_normalized_ms"].append(measure_ocr(ocr_url, normalized_bytes, mime_type))
+
+    return results
+
+def print_report(results: Dict[int, Dict[str, List[float]]]) -> None:
+    print(f"\n{'サイズ帯':>8} {'件数':>4} {'元(KB)':>9} {'正規化(KB)':>11} {'削減率':>7} {'正規化(ms)':>11} {'OCR元(ms)':>10} {'OCR正規化(ms)':>14}")
+    for tier in sorted(results):
+        stats = results[tier]
+        if not stats["original_bytes"]:
+            continue
+        original_kb = statistics.mean(stats["original_bytes"]) / 1024
+        normalized_kb = statistics.mean(stats["normalized_bytes"]) / 1024
+        saved = 1 - normalized_kb / original_kb
+        ocr_original = f"{statistics.median(stats['ocr_original_ms']):.0f}" if stats["ocr_original_ms"] else "-"
+        ocr_normalized = f"{statistics.median(stats['ocr_normalized_ms']):.0f}" if stats["ocr_normalized_ms"] else "-"
+        print(
+            f"{tier:>8} {len(stats['original_bytes']):>4} {original_kb:>9.0f} {normalized_kb:>11.0f} "
+            f"{saved:>7.0%} {statistics.median(stats['normalize_ms']):>11.1f} {ocr_original:>10} {ocr_normalized:>14}"
+        )
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="レシート画像正規化ベンチマーク")
+    parser.add_argument("--images", help="計測に使う画像ディレクトリ（省略時は合成画像）")
+    parser.add_argument("--samples", type=int, default=3, help="合成画像のサイズ帯ごとの枚数")
+    parser.add_argument("--ocr-url", help="OCRサービスのprocess-bytesエンドポイント")
+    args = parser.parse_args()
+
+    if args.images:
+        images = load_images(args.images)
+    else:
+        random.seed(0)
+        images = [
+            (f"synthetic-{tier}-{i}.jpg", generate_receipt_photo(tier))
+            for tier in SIZE_TIERS for i in range(args.samples)
+        ]
+
+    print(f"画像数: {len(images)}件")
+    print_report(run_benchmark(images, args.ocr_url))
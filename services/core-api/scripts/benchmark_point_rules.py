@@ -0,0 +1,183 @@
+#!/usr/bin/env python3
+"""
+ポイント計算 ベンチマーク
+
+合成したレシートで、ルール定義（point_rules.json）を変換したテーブルによる評価と
+if/elif で判定していた旧実装のスループット（件/秒）を比較します。
+続いてインメモリのSQLiteに投稿実績・店舗を作成し、PointCalculationEngine の
+1件ずつの計算（calculate_points）とまとめた計算（calculate_points_batch）を比較します。
+
+使い方:
+    python scripts/benchmark_point_rules.py
+    python scripts/benchmark_point_rules.py --receipts 200000 --batch-size 500
+"""
+
+import argparse
+import os
+import random
+import sys
+import time
+from datetime import datetime, timedelta
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+# プロジェクトルートをPythonパスに追加
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from app import models, schemas
+from app.gamification import PointCalculationEngine
+from app.gamification.point_rules import point_rules
+
+SUPPLIERS = ["飯塚商店", "新飯塚ベーカリー", "穂波青果", "家族食堂", "スーパー嘉穂", "ドラッグ立岩", "個人書店", "柏の森珈琲"]
+WEATHER_CODES = [0, 1, 2, 3, 45, 61, 63, 65, 71, 75, 80, 95]
+
+# (レシート情報, 投稿数, 連続日数, 加盟店名, アップロード状況)
+Sample = Tuple[Dict[str, Any], int, int, Optional[str], Dict[str, Any]]
+
+def generate_samples(count: int, rng: random.Random) -> List[Sample]:
+    started = datetime(2026, 10, 1)
+    samples = []
+    for _ in range(count):
+        supplier_name = rng.choice(SUPPLIERS)
+        samples.append((
+            {"supplier_name": supplier_name, "total_amount": rng.choice([80, 300, 700, 1500, 4200])},
+            rng.randint(1, 50),
+            rng.randint(0, 40),
+            supplier_name if rng.random() < 0.5 else None,
+            {
+                "upload_time": started + timedelta(minutes=rng.randint(0, 60 * 24 * 14)),
+                "weather_code": rng.choice(WEATHER_CODES)
+            }
+        ))
+    return samples
+
+def legacy_calculate(receipt_data, receipt_count, current_streak, member_store_name, upload_context) -> int:
+    """旧実装（if/elif と毎回生成するリスト・range、明細の辞書と計算結果の生成を含む）相当"""
+    total_amount = receipt_data.get("total_amount", 0)
+    supplier_name = receipt_data.get("supplier_name", "")
+    base_points = 10 if supplier_name and total_amount else 5
+    details = []
+
+    if total_amount >= 3000:
+        details.append({"type": "amount_bonus", "name": "高額購入ボーナス", "points": 50, "condition": "3000円以上", "amount": total_amount})
+    elif total_amount >= 1000:
+        details.append({"type": "amount_bonus", "name": "まとめ買いボーナス", "points": 20, "condition": "1000円以上", "amount": total_amount})
+    elif total_amount >= 500:
+        details.append({"type": "amount_bonus", "name": "お買い物ボーナス", "points": 10, "condition": "500円以上", "amount": total_amount})
+    elif total_amount >= 100:
+        details.append({"type": "amount_bonus", "name": "ちょこっと買いボーナス", "points": 5, "condition": "100円以上", "amount": total_amount})
+
+    if current_streak >= 30:
+        details.append({"type": "consecutive_bonus", "name": "継続は力なり（30日連続）", "points": 100, "consecutive_days": current_streak})
+    elif current_streak >= 7:
+        details.append({"type": "consecutive_bonus", "name": "一週間チャレンジャー", "points": 50, "consecutive_days": current_streak})
+    elif current_streak >= 3:
+        details.append({"type": "consecutive_bonus", "name": "3日坊主卒業", "points": 20, "consecutive_days": current_streak})
+
+    if receipt_count == 1:
+        details.append({"type": "first_time_bonus", "name": "初回アップロードボーナス", "points": 50, "message": "初めてのレシートアップロードありがとうございます！"})
+
+    weather_code = upload_context.get("weather_code")
+    if weather_code:
+        if weather_code in [71, 73, 75, 77, 85, 86]:
+            details.append({"type": "weather_bonus", "name": "雪の日お疲れさまボーナス", "points": 25, "weather_code": weather_code})
+        elif weather_code in range(51, 68) or weather_code in [80, 81, 82]:
+            details.append({"type": "weather_bonus", "name": "雨の日お疲れさまボーナス", "points": 15, "weather_code": weather_code})
+
+    upload_time = upload_context["upload_time"]
+    if 6 <= upload_time.hour < 9:
+        details.append({"type": "time_bonus", "name": "早起きボーナス", "points": 10, "hour": upload_time.hour})
+    elif 18 <= upload_time.hour < 21:
+        details.append({"type": "time_bonus", "name": "お疲れさまボーナス", "points": 5, "hour": upload_time.hour})
+    elif upload_time.weekday() >= 5:
+        details.append({"type": "time_bonus", "name": "週末ボーナス", "points": 5, "weekday": upload_time.weekday()})
+
+    if member_store_name is not None:
+        details.append({"type": "store_bonus", "name": "商店街加盟店ボーナス", "points": 10, "store_name": member_store_name})
+    else:
+        for keyword in ["商店", "個人", "家族", "〜屋", "〜店"]:
+            if keyword in supplier_name:
+                details.append({"type": "store_bonus", "name": "個人商店応援ボーナス", "points": 15, "store_name": supplier_name})
+                break
+
+    bonus_points = sum(detail["points"] for detail in details)
+    return schemas.PointCalculationResult(
+        base_points=base_points,
+        bonus_points=bonus_points,
+        total_points=base_points + bonus_points,
+        bonus_details=details
+    ).total_points
+
+def rules_calculate(receipt_data, receipt_count, current_streak, member_store_name, upload_context) -> int:
+    return point_rules.rules().evaluate(
+        receipt_data, receipt_count, current_streak, member_store_name, upload_context
+    ).total_points
+
+def throughput(calculate: Callable[..., int], samples: List[Sample]) -> Tuple[float, int]:
+    started_at = time.perf_counter()
+    total = sum(calculate(*sample) for sample in samples)
+    return len(samples) / (time.perf_counter() - started_at), total
+
+def seed_database(samples: List[Sample], users: int, rng: random.Random):
+    """インメモリのSQLiteに投稿実績と店舗を作成し、エンジンに渡す入力を返す"""
+    engine = create_engine("sqlite://")
+    models.Base.metadata.create_all(engine, tables=[
+        models.User.__table__, models.Store.__table__, models.UserActivitySummary.__table__
+    ])
+    db = sessionmaker(bind=engine)()
+    db.add_all(models.User(id=user_id, email=f"user{user_id}@example.com", hashed_password="x") for user_id in range(1, users + 1))
+    db.add_all(models.Store(id=store_id, name=name) for store_id, name in enumerate(SUPPLIERS, start=1))
+    db.flush()
+    db.add_all(
+        models.UserActivitySummary(user_id=user_id, receipt_count=rng.randint(1, 50), current_streak=rng.randint(0, 40))
+        for user_id in range(1, users + 1)
+    )
+    db.commit()
+
+    items = [
+        ({**receipt_data, "store_id": SUPPLIERS.index(receipt_data["supplier_name"]) + 1 if member_store_name else None},
+         rng.randint(1, users), upload_context)
+        for receipt_data, _, _, member_store_name, upload_context in samples
+    ]
+    return db, items
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="ポイント計算ベンチマーク")
+    parser.add_argument("--receipts", type=int, default=100000, help="ルール評価のレシート数")
+    parser.add_argument("--engine-receipts", type=int, default=5000, help="エンジン（DB参照あり）のレシート数")
+    parser.add_argument("--users", type=int, default=1000, help="エンジンのユーザー数")
+    parser.add_argument("--batch-size", type=int, default=200, help="calculate_points_batch に渡す件数")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    samples = generate_samples(args.receipts, rng)
+    point_rules.rules()
+
+    print(f"{'method':>16} {'receipts/s':>12} {'total points':>14}")
+    for method, calculate in (("legacy if/elif", legacy_calculate), ("compiled rules", rules_calculate)):
+        rate, total = throughput(calculate, samples)
+        print(f"{method:>16} {rate:>12,.0f} {total:>14,}")
+
+    db, items = seed_database(samples[:args.engine_receipts], args.users, rng)
+    point_engine = PointCalculationEngine(db)
+
+    started_at = time.perf_counter()
+    single_total = sum(point_engine.calculate_points(*item).total_points for item in items)
+    single_rate = len(items) / (time.perf_counter() - started_at)
+
+    started_at = time.perf_counter()
+    batch_total = 0
+    for offset in range(0, len(items), args.batch_size):
+        batch_total += sum(
+            result.total_points for result in point_engine.calculate_points_batch(items[offset:offset + args.batch_size])
+        )
+    batch_rate = len(items) / (time.perf_counter() - started_at)
+
+    print(f"\nエンジン（SQLite, ユーザー{args.users}人, {len(items)}件）")
+    print(f"{'method':>16} {'receipts/s':>12} {'total points':>14}")
+    print(f"{'single':>16} {single_rate:>12,.0f} {single_total:>14,}")
+    print(f"{f'batch({args.batch_size})':>16} {batch_rate:>12,.0f} {batch_total:>14,}")
+    db.close()
@@ -0,0 +1,100 @@
+#!/usr/bin/env python3
+"""
+レシート取り込みパイプライン ベンチマーク
+
+core-apiの /api/receipts/upload に同時並行でレシート画像を送り、
+スループットとレイテンシ（p50/p95/p99）を計測します。
+ocr-processorを再生エンジン（OCR_ENGINE=replay）で起動すれば、
+Document AIなしでローカル環境でも再現性のある計測ができます。
+
+使い方:
+    # ocr-processor（再生エンジン）
+    OCR_ENGINE=replay OCR_REPLAY_LATENCY=lognormal:900:0.35 uvicorn app.main:app --port 8001
+    # ベンチマーク
+    python scripts/benchmark_receipt_pipeline.py --api http://localhost:8000 \\
+        --email user@example.com --password ... --requests 200 --concurrency 16
+"""
+
+import argparse
+import io
+import os
+import random
+import statistics
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Optional, Tuple
+
+import requests
+from PIL import Image, ImageDraw
+
+def generate_receipt_image(seed: int) -> bytes:
+    """リクエストごとに内容の異なるレシート画像を生成する（OCRキャッシュに当たらないようにする）"""
+    rng = random.Random(seed)
+    img = Image.new("RGB", (1200, 1600), (248, 246, 240))
+    draw = ImageDraw.Draw(img)
+    for y in range(60, 1540, 28):
+        draw.rectangle([100, y, 100 + rng.randint(200, 1000), y + 10], fill=(40, 40, 40))
+    output = io.BytesIO()
+    img.save(output, format="JPEG", quality=85)
+    return output.getvalue()
+
+def login(api: str, email: str, password: str) -> str:
+    response = requests.post(f"{api}/api/token/", data={"username": email, "password": password})
+    response.raise_for_status()
+    return response.json()["access_token"]
+
+def upload(api: str, token: str, image: bytes) -> Tuple[float, Optional[int]]:
+    """レシートを1件アップロードし、(レイテンシms, ステータスコード) を返す"""
+    start = time.perf_counter()
+    try:
+        response = requests.post(
+            f"{api}/api/receipts/upload",
+            headers={"Authorization": f"Bearer {token}"},
+            files={"file": ("receipt.jpg", image, "image/jpeg")}
+        )
+        status_code = response.status_code
+    except requests.exceptions.RequestException:
+        status_code = None
+    return (time.perf_counter() - start) * 1000, status_code
+
+def percentile(values: List[float], pct: float) -> float:
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+def run_benchmark(api: str, token: str, total: int, concurrency: int, seed: int) -> None:
+    images = [generate_receipt_image(seed + i) for i in range(total)]
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        results = list(executor.map(lambda image: upload(api, token, image), images))
+    elapsed = time.perf_counter() - start
+
+    latencies = [latency for latency, status_code in results if status_code == 200]
+    status_counts = {}
+    for _, status_code in results:
+        status_counts[status_code] = status_counts.get(status_code, 0) + 1
+
+    print(f"\nリクエスト数: {total}件 / 同時実行数: {concurrency}")
+    print(f"所要時間: {elapsed:.1f}秒 / スループット: {total / elapsed:.1f} req/s")
+    print(f"ステータス: {status_counts}")
+    if latencies:
+        print(
+            f"レイテンシ(ms): p50={statistics.median(latencies):.0f} "
+            f"p95={percentile(latencies, 95):.0f} p99={percentile(latencies, 99):.0f} "
+            f"max={max(latencies):.0f}"
+        )
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="レシート取り込みパイプライン ベンチマーク")
+    parser.add_argument("--api", default="http://localhost:8000", help="core-apiのベースURL")
+    parser.add_argument("--email", required=True, help="ログインユーザーのメールアドレス")
+    parser.add_argument("--password", required=True, help="ログインユーザーのパスワード")
+    parser.add_argument("--requests", type=int, default=100, help="送信するレシート数")
+    parser.add_argument("--concurrency", type=int, default=8, help="同時実行数")
+    parser.add_argument("--seed", type=int, default=0, help="画像生成の乱数シード")
+    args = parser.parse_args()
+
+    token = login(args.api, args.email, args.password)
+    run_benchmark(args.api, token, args.requests, args.concurrency, args.seed)
@@ -0,0 +1,118 @@
+#!/usr/bin/env python3
+"""
+店名マッチング ベンチマーク
+
+合成した店舗名で店名索引（Aho-Corasick + bigram索引）を構築し、
+照合パターン（完全一致・部分一致・表記ゆれ・不一致）ごとのレイテンシを
+全店舗を走査する旧実装と比較します。DBは使用しません。
+
+使い方:
+    python scripts/benchmark_store_matcher.py
+    python scripts/benchmark_store_matcher.py --stores 50000 --queries 500
+"""
+
+import argparse
+import os
+import random
+import statistics
+import sys
+import time
+from typing import Callable, Dict, List, Optional, Tuple
+
+# プロジェクトルートをPythonパスに追加
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.normalization import normalize_store_name
+from app.store_matcher import StoreNameIndex, STORE_MATCHER_MIN_SIMILARITY
+
+PREFIXES = ["飯塚", "新飯塚", "穂波", "庄内", "頴田", "筑豊", "嘉穂", "柏の森", "片島", "立岩"]
+KINDS = ["ベーカリー", "食堂", "酒店", "青果", "精肉店", "鮮魚店", "ドラッグ", "書店", "珈琲店", "うどん"]
+KANA = "アイウエオカキクケコサシスセソタチツテトナニヌネノハヒフヘホマミムメモヤユヨラリルレロワ"
+
+def generate_store_names(count: int, rng: random.Random) -> List[str]:
+    names = set()
+    while len(names) < count:
+        middle = "".join(rng.choice(KANA) for _ in range(rng.randint(2, 4)))
+        names.add(f"{rng.choice(PREFIXES)}{middle}{rng.choice(KINDS)}")
+    return sorted(names)
+
+def generate_queries(names: List[str], count: int, rng: random.Random) -> Dict[str, List[str]]:
+    """照合パターンごとのOCR店名を生成する"""
+    samples = [rng.choice(names) for _ in range(count)]
+    return {
+        "exact": [f"株式会社 {name}" for name in samples],
+        "contained": [f"{name} 飯塚本町店 TEL" for name in samples],
+        "fuzzy": [name[:-1] + "X" for name in samples],
+        "miss": ["".join(rng.choice(KANA) for _ in range(8)) for _ in range(count)],
+    }
+
+def naive_match(stores: List[Tuple[int, str]], supplier_name: str) -> Optional[int]:
+    """旧実装（ilike '%name%' → 全店舗の走査）相当"""
+    lowered = supplier_name.lower()
+    for store_id, name in stores:
+        if lowered in name.lower():
+            return store_id
+    for store_id, name in stores:
+        if name and name in supplier_name:
+            return store_id
+    return None
+
+def index_match(index: StoreNameIndex, supplier_name: str) -> Optional[int]:
+    """StoreNameMatcher.match と同じ照合順（DB・追加分を除く）"""
+    text = normalize_store_name(supplier_name)
+    store_id = index.exact.get(text)
+    if store_id is not None:
+        return store_id
+    containing = index.shortest_containing(text)
+    if containing is not None:
+        return index.store_ids[containing]
+    contained = index.longest_contained(text)
+    if contained is not None:
+        return index.store_ids[contained]
+    similar, score = index.best_similar(text)
+    if similar is not None and score >= STORE_MATCHER_MIN_SIMILARITY:
+        return index.store_ids[similar]
+    return None
+
+def measure(match: Callable[[str], Optional[int]], queries: List[str]) -> Tuple[List[float], int]:
+    durations, hits = [], 0
+    for query in queries:
+        started_at = time.perf_counter()
+        result = match(query)
+        durations.append((time.perf_counter() - started_at) * 1000)
+        hits += result is not None
+    return durations, hits
+
+def percentile(values: List[float], ratio: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * ratio))]
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="店名マッチングベンチマーク")
+    parser.add_argument("--stores", type=int, default=10000, help="店舗数")
+    parser.add_argument("--queries", type=int, default=200, help="照合パターンごとのクエリ数")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    names = generate_store_names(args.stores, rng)
+    stores = list(enumerate(names, start=1))
+    queries = generate_queries(names, args.queries, rng)
+
+    started_at = time.perf_counter()
+    index = StoreNameIndex(stores)
+    print(f"店舗数: {len(stores)}件, 索引構築: {(time.perf_counter() - started_at) * 1000:.0f}ms, "
+          f"オートマトンのノード数: {len(index.goto)}")
+
+    print(f"{'pattern':>10} {'method':>7} {'hit':>6} {'p50(ms)':>9} {'p95(ms)':>9} {'p99(ms)':>9}")
+    for pattern, pattern_queries in queries.items():
+        for method, match in (
+            ("index", lambda query: index_match(index, query)),
+            ("naive", lambda query: naive_match(stores, query)),
+        ):
+            durations, hits = measure(match, pattern_queries)
+            print(
+                f"{pattern:>10} {method:>7} {hits / len(pattern_queries):>6.0%} "
+                f"{statistics.median(durations):>9.3f} {percentile(durations, 0.95):>9.3f} "
+                f"{percentile(durations, 0.99):>9.3f}"
+            )
@@ -0,0 +1,71 @@
+#!/usr/bin/env python3
+"""
+ポイント履歴コンパクションバッチ処理
+
+保持期間（POINT_LEDGER_RETENTION_MONTHS、既定6か月）より前のポイント履歴を
+月次集計と残高スナップショットにまとめ、元の行を point_transactions_archive へ移します。
+実行後に「最新スナップショット + 残りの履歴 = contribution_points」をプロフィールごとに検証し、
+不一致があれば終了コード1で終了します。
+
+使い方:
+    python scripts/compact_point_ledger.py --dry-run
+    python scripts/compact_point_ledger.py
+    python scripts/compact_point_ledger.py --retention-months 12 --batch-size 50000
+    python scripts/compact_point_ledger.py --verify-only
+"""
+
+import argparse
+import json
+import os
+import sys
+from datetime import datetime
+
+# プロジェクトルートをPythonパスに追加
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy.orm import Session
+from app.database import SessionLocal
+from app.gamification.point_ledger import (
+    compact_point_ledger,
+    verify_point_balances,
+    ledger_cutoff,
+    POINT_LEDGER_RETENTION_MONTHS,
+    POINT_LEDGER_COMPACTION_BATCH_SIZE,
+)
+
+def print_verification(verification: dict):
+    print(f"残高検証: {verification['profiles_checked']}件中 不一致{verification['mismatches']}件")
+    for sample in verification["samples"]:
+        print(f"  {json.dumps(sample, ensure_ascii=False)}")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="ポイント履歴コンパクション")
+    parser.add_argument("--retention-months", type=int, default=POINT_LEDGER_RETENTION_MONTHS, help="point_transactionsに残す月数")
+    parser.add_argument("--batch-size", type=int, default=POINT_LEDGER_COMPACTION_BATCH_SIZE, help="1トランザクションで処理するIDの範囲")
+    parser.add_argument("--dry-run", action="store_true", help="退避せず対象件数と検証結果のみを表示")
+    parser.add_argument("--verify-only", action="store_true", help="残高の検証のみ実行")
+    args = parser.parse_args()
+
+    db: Session = SessionLocal()
+    try:
+        if args.verify_only:
+            verification = verify_point_balances(db)
+        else:
+            cutoff = ledger_cutoff(args.retention_months)
+            print(f"[{datetime.now()}] ポイント履歴コンパクション開始: {cutoff.date()}より前{'（ドライラン）' if args.dry_run else ''}")
+            report = compact_point_ledger(db, cutoff=cutoff, batch_size=args.batch_size, dry_run=args.dry_run)
+            print(
+                f"対象: {report['target']}件, 退避: {report['archived']}件, "
+                f"スナップショット: {report['snapshots_created']}件, 月次集計: {report['summaries_upserted']}件, "
+                f"バッチ: {report['batches']}回, 所要時間: {report['duration_seconds']}秒"
+            )
+            verification = report["verification"]
+        print_verification(verification)
+    except Exception as e:
+        print(f"エラーが発生しました: {e}")
+        sys.exit(1)
+    finally:
+        db.close()
+
+    if verification["mismatches"]:
+        sys.exit(1)
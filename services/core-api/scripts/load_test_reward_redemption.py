@@ -0,0 +1,169 @@
+#!/usr/bin/env python3
+"""
+数量限定特典の交換 負荷試験
+
+在庫数を限定した試験用の特典とユーザーを作成し、crud.redeem_reward を多数のスレッドから同時に呼び出します。
+交換数が在庫数を超えないこと・在庫とクーポン発行数・ポイント消費が一致することを検証し、
+スループットとレイテンシを表示します（不一致があれば終了コード1）。
+試験用のデータは終了時に削除します（--keep で残す）。
+
+使い方:
+    python scripts/load_test_reward_redemption.py
+    python scripts/load_test_reward_redemption.py --requests 1000 --stock 50 --concurrency 100
+    python scripts/load_test_reward_redemption.py --users 200 --requests 1000  # 1ユーザーが複数回交換を試みる
+"""
+
+import argparse
+import os
+import statistics
+import sys
+import threading
+import time
+import uuid
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+# プロジェクトルートをPythonパスに追加
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import create_engine, delete, func, insert, select
+from sqlalchemy.orm import sessionmaker
+
+from app import crud, models
+from app.database import SQLALCHEMY_DATABASE_URL
+
+def setup(db, run_id: str, users: int, stock: int, required_points: int, points_per_user: int):
+    """試験用の特典・ユーザー・ポイント残高を作成する"""
+    reward_id = db.execute(insert(models.Reward).values(
+        title=f"コロッケ引換券（負荷試験 {run_id}）",
+        required_points=required_points,
+        reward_type="coupon",
+        stock_quantity=stock,
+        available_stock=stock,
+        is_active=True,
+        valid_days=1
+    ).returning(models.Reward.id)).scalar()
+
+    db.execute(insert(models.User), [
+        {"email": f"loadtest-{run_id}-{index}@example.com", "hashed_password": "x", "is_active": True}
+        for index in range(users)
+    ])
+    user_ids = db.execute(select(models.User.id).where(
+        models.User.email.like(f"loadtest-{run_id}-%")
+    ).order_by(models.User.id)).scalars().all()
+    db.execute(insert(models.GamificationProfile), [
+        {"user_id": user_id, "contribution_points": points_per_user, "total_earned_points": points_per_user, "level": 1}
+        for user_id in user_ids
+    ])
+    db.commit()
+    return reward_id, user_ids
+
+def cleanup(db, reward_id: int, user_ids):
+    profile_ids = select(models.GamificationProfile.id).where(models.GamificationProfile.user_id.in_(user_ids))
+    db.execute(delete(models.PointTransaction).where(models.PointTransaction.profile_id.in_(profile_ids)))
+    db.execute(delete(models.UserReward).where(models.UserReward.reward_id == reward_id))
+    db.execute(delete(models.GamificationProfile).where(models.GamificationProfile.user_id.in_(user_ids)))
+    db.execute(delete(models.User).where(models.User.id.in_(user_ids)))
+    db.execute(delete(models.Reward).where(models.Reward.id == reward_id))
+    db.commit()
+
+def verify(db, reward_id: int, user_ids, stock: int, required_points: int, successes: int, expected: int):
+    """在庫・クーポン発行数・ポイント消費の整合性を検証し、違反の一覧を返す"""
+    available_stock = db.execute(select(models.Reward.available_stock).where(models.Reward.id == reward_id)).scalar()
+    issued = db.execute(select(func.count()).select_from(models.UserReward).where(models.UserReward.reward_id == reward_id)).scalar()
+    spent = db.execute(
+        select(func.coalesce(func.sum(-models.PointTransaction.points), 0))
+        .join(models.GamificationProfile, models.GamificationProfile.id == models.PointTransaction.profile_id)
+        .where(models.GamificationProfile.user_id.in_(user_ids), models.PointTransaction.transaction_type == "redeem")
+    ).scalar()
+    negative = db.execute(select(func.count()).select_from(models.GamificationProfile).where(
+        models.GamificationProfile.user_id.in_(user_ids), models.GamificationProfile.contribution_points < 0
+    )).scalar()
+
+    print(f"交換成立: {successes}件（期待値 {expected}件）, 発行クーポン: {issued}件, 残在庫: {available_stock}/{stock}, "
+          f"消費ポイント: {spent}pt")
+
+    violations = []
+    if successes != expected:
+        violations.append(f"交換成立数が期待値と異なります: {successes} != {expected}")
+    if issued != successes or available_stock != stock - successes:
+        violations.append(f"在庫とクーポン発行数が一致しません: 発行{issued}件, 残在庫{available_stock}")
+    if available_stock < 0:
+        violations.append(f"在庫数を超えて交換されました: 残在庫{available_stock}")
+    if spent != successes * required_points:
+        violations.append(f"消費ポイントが交換数と一致しません: {spent}pt")
+    if negative:
+        violations.append(f"残高がマイナスのユーザーがいます: {negative}人")
+    return violations
+
+def percentile(values, ratio: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * ratio))]
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="数量限定特典の交換 負荷試験")
+    parser.add_argument("--requests", type=int, default=1000, help="交換リクエスト数")
+    parser.add_argument("--users", type=int, default=1000, help="試験用ユーザー数（リクエストは順に割り当て）")
+    parser.add_argument("--stock", type=int, default=50, help="特典の在庫数")
+    parser.add_argument("--concurrency", type=int, default=100, help="同時実行数（DB接続数）")
+    parser.add_argument("--required-points", type=int, default=100, help="特典の必要ポイント")
+    parser.add_argument("--points-per-user", type=int, default=100, help="ユーザーごとのポイント残高")
+    parser.add_argument("--keep", action="store_true", help="試験用のデータを削除しない")
+    args = parser.parse_args()
+
+    engine = create_engine(SQLALCHEMY_DATABASE_URL, pool_size=args.concurrency, max_overflow=0)
+    Session = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+    run_id = uuid.uuid4().hex[:8]
+
+    db = Session()
+    reward_id, user_ids = setup(db, run_id, args.users, args.stock, args.required_points, args.points_per_user)
+    redemptions_per_user = args.points_per_user // args.required_points
+    expected = min(args.stock, args.requests, sum(
+        min(redemptions_per_user, len(range(index, args.requests, len(user_ids)))) for index in range(len(user_ids))
+    ))
+    print(f"特典ID: {reward_id}, 在庫: {args.stock}, ユーザー: {len(user_ids)}人, リクエスト: {args.requests}件, 同時実行: {args.concurrency}")
+
+    start = threading.Barrier(min(args.concurrency, args.requests))
+
+    def redeem(index: int):
+        if index < start.parties:
+            # 最初の一斉送信をそろえる
+            start.wait()
+        session = Session()
+        started_at = time.perf_counter()
+        try:
+            crud.redeem_reward(session, user_ids[index % len(user_ids)], reward_id)
+            outcome = "交換成立"
+        except ValueError as e:
+            outcome = str(e)
+        except Exception as e:
+            outcome = f"エラー: {type(e).__name__}"
+        finally:
+            session.close()
+        return outcome, (time.perf_counter() - started_at) * 1000
+
+    try:
+        started_at = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=args.concurrency) as executor:
+            results = list(executor.map(redeem, range(args.requests)))
+        elapsed = time.perf_counter() - started_at
+
+        outcomes = Counter(outcome for outcome, _ in results)
+        latencies = [latency for _, latency in results]
+        print(f"所要時間: {elapsed:.2f}秒, スループット: {args.requests / elapsed:.0f}件/秒, "
+              f"レイテンシ p50 {statistics.median(latencies):.1f}ms / p95 {percentile(latencies, 0.95):.1f}ms / "
+              f"p99 {percentile(latencies, 0.99):.1f}ms")
+        for outcome, count in outcomes.most_common():
+            print(f"  {outcome}: {count}件")
+
+        violations = verify(db, reward_id, user_ids, args.stock, args.required_points, outcomes["交換成立"], expected)
+    finally:
+        if not args.keep:
+            cleanup(db, reward_id, user_ids)
+        db.close()
+
+    for violation in violations:
+        print(f"NG: {violation}")
+    if violations:
+        sys.exit(1)
+    print("OK: 在庫数を超える交換はありませんでした")
@@ -0,0 +1,49 @@
+#!/usr/bin/env python3
+"""
+ランキング再構築バッチ処理
+
+ポイント履歴（point_transactions の earn）から週間・月間ランキング（全体・エリア別・年代別）の
+Redis Sorted Set を作り直します。Redisのデータ消失時や、ユーザーの居住エリア・年代の変更を
+反映する場合に実行してください。再構築中に獲得したポイントも反映されるため、稼働中に実行できます。
+
+使い方:
+    python scripts/rebuild_leaderboards.py --dry-run
+    python scripts/rebuild_leaderboards.py
+    python scripts/rebuild_leaderboards.py --window weekly --periods 4
+"""
+
+import argparse
+import os
+import sys
+from datetime import datetime
+
+# プロジェクトルートをPythonパスに追加
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy.orm import Session
+from app.database import SessionLocal
+from app.gamification.leaderboard import leaderboard, LEADERBOARD_WINDOWS
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="ランキング再構築")
+    parser.add_argument("--window", choices=LEADERBOARD_WINDOWS, action="append", help="対象の集計期間（省略時は全て）")
+    parser.add_argument("--periods", type=int, default=1, help="現在を含めて再構築する期間数")
+    parser.add_argument("--dry-run", action="store_true", help="Redisに書き込まず件数のみを表示")
+    args = parser.parse_args()
+
+    db: Session = SessionLocal()
+    try:
+        print(f"[{datetime.now()}] ランキング再構築開始{'（ドライラン）' if args.dry_run else ''}")
+        report = leaderboard.rebuild(
+            db,
+            windows=args.window or LEADERBOARD_WINDOWS,
+            periods=args.periods,
+            dry_run=args.dry_run
+        )
+        for period, counts in report.items():
+            print(f"  {period}: ランキング{counts['boards']}件, 登録{counts['entries']}件")
+    except Exception as e:
+        print(f"エラーが発生しました: {e}")
+        sys.exit(1)
+    finally:
+        db.close()
@@ -0,0 +1,68 @@
+#!/usr/bin/env python3
+"""
+レシートポイント一括再計算バッチ処理
+
+ポイントルール（app/gamification/point_rules.json）の変更後に、過去のレシートを現在のルールで
+計算し直し、付与済みポイントとの差分を調整履歴（adjustment）として記録します。
+まず --dry-run で差分のレポートを確認してから実行してください。
+配列演算の結果がルール評価と一致しない場合は書き込まずに終了コード1で終了します。
+ルールを変更する前に --expect-no-changes を付けて実行し、現在のルールでは差分が出ない
+（再計算の入力がアップロード時と一致している）ことを確認できます（差分があれば終了コード1）。
+
+使い方:
+    python scripts/recalculate_points.py --expect-no-changes
+    python scripts/recalculate_points.py --dry-run
+    python scripts/recalculate_points.py --since 2026-10-01
+    python scripts/recalculate_points.py --user-chunk-size 5000 --write-batch-size 2000
+"""
+
+import argparse
+import json
+import os
+import sys
+from datetime import datetime
+
+# プロジェクトルートをPythonパスに追加
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy.orm import Session
+from app.database import SessionLocal
+from app.gamification.point_recalculation import (
+    recalculate_receipt_points,
+    POINT_RECALC_USER_CHUNK_SIZE,
+    POINT_RECALC_WRITE_BATCH_SIZE,
+)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="レシートポイント一括再計算")
+    parser.add_argument("--since", type=datetime.fromisoformat, help="この日時以降に投稿されたレシートのみ調整（例: 2026-10-01）")
+    parser.add_argument("--dry-run", action="store_true", help="書き込まず差分のレポートのみを表示")
+    parser.add_argument("--expect-no-changes", action="store_true", help="書き込まず、差分が1件でもあれば終了コード1（ルール変更前の確認用）")
+    parser.add_argument("--user-chunk-size", type=int, default=POINT_RECALC_USER_CHUNK_SIZE, help="1回に読み込むユーザーIDの範囲")
+    parser.add_argument("--write-batch-size", type=int, default=POINT_RECALC_WRITE_BATCH_SIZE, help="1トランザクションで書き込むユーザー数")
+    args = parser.parse_args()
+    dry_run = args.dry_run or args.expect_no_changes
+
+    db: Session = SessionLocal()
+    try:
+        print(f"[{datetime.now()}] ポイント再計算開始{'（ドライラン）' if dry_run else ''}")
+        report = recalculate_receipt_points(
+            db,
+            since=args.since,
+            dry_run=dry_run,
+            user_chunk_size=args.user_chunk_size,
+            write_batch_size=args.write_batch_size
+        )
+        print(json.dumps(report, ensure_ascii=False, indent=2))
+    except Exception as e:
+        print(f"エラーが発生しました: {e}")
+        sys.exit(1)
+    finally:
+        db.close()
+
+    if report["sample_mismatches"]:
+        print(f"ルール評価との不一致が{report['sample_mismatches']}件あるため書き込みを中止しました")
+        sys.exit(1)
+    if args.expect_no_changes and report["receipts_changed"]:
+        print(f"現在のルールで{report['receipts_changed']}件の差分があります（付与時と再計算の入力が一致していません）")
+        sys.exit(1)
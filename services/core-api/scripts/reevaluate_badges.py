@@ -0,0 +1,52 @@
+#!/usr/bin/env python3
+"""
+バッジ一括再判定バッチ処理
+
+バッジの追加やしきい値の変更後に実行し、全ユーザーの過去の実績に対して
+獲得条件を満たす未獲得バッジを遡って授与します。
+ユーザーごとの集計はSQLで一括して行い、授与はバッジごとに1回のINSERTで行います。
+
+使い方:
+    python scripts/reevaluate_badges.py --dry-run
+    python scripts/reevaluate_badges.py
+    python scripts/reevaluate_badges.py --badge-id 12 --badge-id 13
+"""
+
+import argparse
+import os
+import sys
+from datetime import datetime
+
+# プロジェクトルートをPythonパスに追加
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy.orm import Session
+from app.database import SessionLocal
+from app.gamification.badge_reevaluation import reevaluate_all_badges
+
+def print_report(report: dict):
+    print(f"{'badge_id':>8} {'type':>16} {'threshold':>9} {'awarded':>8}  name")
+    for result in report["badges"]:
+        print(
+            f"{result['badge_id']:>8} {result['criteria_type']:>16} {result['threshold']:>9} "
+            f"{result['awarded']:>8}  {result['badge_name']}"
+        )
+    label = "授与対象" if report["dry_run"] else "授与"
+    print(f"実績のあるユーザー: {report['users']}人, プロフィール作成: {report['profiles_created']}件")
+    print(f"{label}: {report['total_awarded']}件, 所要時間: {report['duration_seconds']}秒")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="バッジ一括再判定")
+    parser.add_argument("--badge-id", type=int, action="append", help="対象のバッジID（複数指定可、省略時は全バッジ）")
+    parser.add_argument("--dry-run", action="store_true", help="授与せず対象件数のみを表示")
+    args = parser.parse_args()
+
+    db: Session = SessionLocal()
+    try:
+        print(f"[{datetime.now()}] バッジ一括再判定開始{'（ドライラン）' if args.dry_run else ''}")
+        print_report(reevaluate_all_badges(db, badge_ids=args.badge_id, dry_run=args.dry_run))
+    except Exception as e:
+        print(f"エラーが発生しました: {e}")
+        sys.exit(1)
+    finally:
+        db.close()
@@ -0,0 +1,199 @@
+"""
+OCRエンジン
+Document AIを呼び出す本番用エンジンと、記録済みのフィクスチャを再生するローカル用エンジン
+（クラウドのプロセッサなしで負荷試験・ベンチマークを行うため）を提供する
+
+エンジンはDocument AIのentitiesを以下の辞書形式に変換して返す:
+    [{"type": "total_amount", "mention_text": "1,234", "properties": [...]}, ...]
+"""
+
+import os
+import abc
+import json
+import random
+import asyncio
+import hashlib
+from typing import Any, Dict, List, Optional
+
+# 使用するエンジン（"documentai" または "replay"）
+OCR_ENGINE = os.getenv("OCR_ENGINE", "documentai").lower()
+# フィクスチャの保存先ディレクトリ
+OCR_FIXTURE_DIR = os.getenv(
+    "OCR_FIXTURE_DIR",
+    os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "fixtures")
+)
+# 指定するとDocument AIの結果をフィクスチャとして記録する
+OCR_RECORD_FIXTURES = os.getenv("OCR_RECORD_FIXTURES", "false").lower() == "true"
+# 再生エンジンのレイテンシ分布（"fixed:ms" / "uniform:min_ms:max_ms" / "normal:mean_ms:stddev_ms" / "lognormal:median_ms:sigma"）
+OCR_REPLAY_LATENCY = os.getenv("OCR_REPLAY_LATENCY", "lognormal:900:0.35")
+# 再生エンジンの乱数シード（再現性のため）
+OCR_REPLAY_SEED = int(os.getenv("OCR_REPLAY_SEED", "0"))
+
+Entity = Dict[str, Any]
+
+class OcrEngineBusyError(Exception):
+    """OCRバックエンドが混雑・一時停止している（429/503として返す）"""
+
+    def __init__(self, status_code: int, detail: str):
+        super().__init__(detail)
+        self.status_code = status_code
+        self.detail = detail
+
+class OcrEngine(abc.ABC):
+    """OCRエンジンの基底クラス"""
+
+    name = "base"
+
+    async def start(self) -> None:
+        pass
+
+    async def stop(self) -> None:
+        pass
+
+    @abc.abstractmethod
+    async def process(self, image_content: bytes, mime_type: str) -> List[Entity]:
+        """画像を解析し、entitiesを返す"""
+
+def content_hash(image_content: bytes) -> str:
+    return hashlib.sha256(image_content).hexdigest()
+
+def entity_to_dict(entity) -> Entity:
+    """Document AIのEntityを辞書に変換する"""
+    return {
+        "type": entity.type_,
+        "mention_text": entity.mention_text,
+        "properties": [entity_to_dict(prop) for prop in entity.properties],
+    }
+
+def save_fixture(fixture_dir: str, image_content: bytes, mime_type: str, entities: List[Entity], latency_ms: float = None) -> str:
+    """OCR結果をフィクスチャとして保存し、ファイルパスを返す"""
+    os.makedirs(fixture_dir, exist_ok=True)
+    digest = content_hash(image_content)
+    path = os.path.join(fixture_dir, f"{digest}.json")
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump({
+            "content_hash": digest,
+            "mime_type": mime_type,
+            "latency_ms": latency_ms,
+            "entities": entities,
+        }, f, ensure_ascii=False, indent=2)
+    return path
+
+class DocumentAiEngine(OcrEngine):
+    """Google Document AIを呼び出すエンジン"""
+
+    name = "documentai"
+
+    def __init__(self, project_id: str, location: str, processor_id: str,
+                 record_fixtures: bool = OCR_RECORD_FIXTURES, fixture_dir: str = OCR_FIXTURE_DIR):
+        self.project_id = project_id
+        self.location = location
+        self.processor_id = processor_id
+        self.record_fixtures = record_fixtures
+        self.fixture_dir = fixture_dir
+        self.client = None
+        self.resource_name = None
+
+    async def start(self) -> None:
+        from google.cloud import documentai
+        from google.api_core.client_options import ClientOptions
+
+        # イベントループをブロックしないよう非同期クライアントを使用する
+        self.client = documentai.DocumentProcessorServiceAsyncClient(
+            client_options=ClientOptions(api_endpoint=f"{self.location}-documentai.googleapis.com")
+        )
+        self.resource_name = self.client.processor_path(self.project_id, self.location, self.processor_id)
+
+    async def process(self, image_content: bytes, mime_type: str) -> List[Entity]:
+        from google.cloud import documentai
+        from google.api_core import exceptions as gcp_exceptions
+
+        raw_document = documentai.RawDocument(
+            content=image_content, mime_type=mime_type
+        )
+        request = documentai.ProcessRequest(
+            name=self.resource_name, raw_document=raw_document
+        )
+
+        loop = asyncio.get_running_loop()
+        started_at = loop.time()
+        try:
+            result = await self.client.process_document(request=request)
+        except gcp_exceptions.ResourceExhausted as e:
+            raise OcrEngineBusyError(429, f"Document AI quota exceeded: {e}")
+        except (gcp_exceptions.ServiceUnavailable, gcp_exceptions.DeadlineExceeded) as e:
+            raise OcrEngineBusyError(503, f"Document AI is unavailable: {e}")
+        latency_ms = (loop.time() - started_at) * 1000
+
+        entities = [entity_to_dict(entity) for entity in result.document.entities]
+        if self.record_fixtures:
+            # ファイル書き込みでイベントループをブロックしないようスレッドで実行する
+            await asyncio.to_thread(save_fixture, self.fixture_dir, image_content, mime_type, entities, latency_ms)
+        return entities
+
+class LatencyDistribution:
+    """再生エンジンの応答遅延（ミリ秒）を生成する"""
+
+    def __init__(self, spec: str, seed: int = OCR_REPLAY_SEED):
+        kind, *params = spec.split(":")
+        self.kind = kind.lower()
+        self.params = [float(p) for p in params]
+        self.random = random.Random(seed)
+
+        expected = {"fixed": 1, "uniform": 2, "normal": 2, "lognormal": 2}
+        if self.kind not in expected or len(self.params) != expected[self.kind]:
+            raise ValueError(f"Invalid latency distribution: {spec}")
+
+    def sample_ms(self) -> float:
+        if self.kind == "fixed":
+            return self.params[0]
+        if self.kind == "uniform":
+            return self.random.uniform(*self.params)
+        if self.kind == "normal":
+            return max(0.0, self.random.gauss(*self.params))
+        # lognormal: 中央値とシグマで指定
+        median_ms, sigma = self.params
+        return median_ms * self.random.lognormvariate(0, sigma)
+
+class ReplayEngine(OcrEngine):
+    """
+    記録済みフィクスチャを再生するエンジン
+    画像のハッシュに一致するフィクスチャがあればそれを、なければハッシュから決定的に選んだものを返す
+    """
+
+    name = "replay"
+
+    def __init__(self, fixture_dir: str = OCR_FIXTURE_DIR, latency: str = OCR_REPLAY_LATENCY, seed: int = OCR_REPLAY_SEED):
+        self.fixture_dir = fixture_dir
+        self.latency = LatencyDistribution(latency, seed)
+        self.fixtures: Dict[str, List[Entity]] = {}
+        self._ordered: List[List[Entity]] = []
+
+    async def start(self) -> None:
+        for name in sorted(os.listdir(self.fixture_dir)):
+            if not name.endswith(".json"):
+                continue
+            with open(os.path.join(self.fixture_dir, name), encoding="utf-8") as f:
+                fixture = json.load(f)
+            self.fixtures[fixture.get("content_hash") or name] = fixture["entities"]
+        self._ordered = [self.fixtures[key] for key in sorted(self.fixtures)]
+        if not self._ordered:
+            raise RuntimeError(f"No OCR fixtures found in {self.fixture_dir}")
+
+    async def process(self, image_content: bytes, mime_type: str) -> List[Entity]:
+        digest = content_hash(image_content)
+        entities = self.fixtures.get(digest)
+        if entities is None:
+            entities = self._ordered[int(digest, 16) % len(self._ordered)]
+
+        await asyncio.sleep(self.latency.sample_ms() / 1000)
+        return entities
+
+def create_engine(project_id: str, location: str, processor_id: str, engine: Optional[str] = None) -> OcrEngine:
+    """設定に応じたOCRエンジンを生成する"""
+    engine = (engine or OCR_ENGINE).lower()
+    if engine == "replay":
+        return ReplayEngine()
+    if engine == "documentai":
+        return DocumentAiEngine(project_id, location, processor_id)
+    raise ValueError(f"Unknown OCR engine: {engine}")
@@ -1,21 +1,105 @@
 import os
 import re
+import asyncio
 from typing import Optional
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, HTTPException, UploadFile, File
 from pydantic import BaseModel
-from google.cloud import documentai, storage
-from google.api_core.client_options import ClientOptions
+from google.cloud import storage
 from contextlib import asynccontextmanager
+from .engines import OcrEngine, OcrEngineBusyError, create_engine
 
 # 環境変数の設定
 PROJECT_ID = os.getenv("GCP_PROJECT_ID", "your-gcp-project-id")
 LOCATION = os.getenv("DOCAI_LOCATION", "us")
 PROCESSOR_ID = os.getenv("DOCAI_PROCESSOR_ID", "your-document-ai-processor-id")
 
+# 同時に実行するOCR呼び出しの上限
+OCR_MAX_IN_FLIGHT = int(os.getenv("OCR_MAX_IN_FLIGHT", "16"))
+# 上限到達時に待機できるリクエスト数（超えた分は429で即時拒否）
+OCR_MAX_WAITING = int(os.getenv("OCR_MAX_WAITING", "32"))
+# 待機の最大秒数（超えた場合は503）
+OCR_QUEUE_TIMEOUT_SECONDS = float(os.getenv("OCR_QUEUE_TIMEOUT_SECONDS", "10"))
+# 429/503応答のRetry-After（秒）
+OCR_RETRY_AFTER_SECONDS = int(os.getenv("OCR_RETRY_AFTER_SECONDS", "5"))
+
 # クライアントの初期化（lifespan内で）
-docai_client = None
+ocr_engine: Optional[OcrEngine] = None
 storage_client = None
-RESOURCE_NAME = None
+
+class InFlightLimiter:
+    """
+    Document AI呼び出しの同時実行数を制限する
+    上限を超えたリクエストは一定数まで待機させ、それ以上は429、待機タイムアウト時は503を返す
+    """
+
+    def __init__(self, max_in_flight: int, max_waiting: int, timeout_seconds: float, retry_after_seconds: int):
+        self.max_in_flight = max(1, max_in_flight)
+        self.max_waiting = max(0, max_waiting)
+        self.timeout_seconds = timeout_seconds
+        self.retry_after_seconds = retry_after_seconds
+        self.in_flight = 0
+        self.waiting = 0
+        self._semaphore: Optional[asyncio.Semaphore] = None
+
+    def reject(self, status_code: int, detail: str) -> HTTPException:
+        return HTTPException(
+            status_code=status_code,
+            detail=detail,
+            headers={"Retry-After": str(self.retry_after_seconds)}
+        )
+
+    async def __aenter__(self):
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_in_flight)
+
+        if self._semaphore.locked():
+            if self.waiting >= self.max_waiting:
+                raise self.reject(429, "Too many OCR requests in flight.")
+            self.waiting += 1
+            try:
+                if not await self._acquire_within(self.timeout_seconds):
+                    raise self.reject(503, "OCR service is busy.")
+            finally:
+                self.waiting -= 1
+        else:
+            await self._semaphore.acquire()
+
+        self.in_flight += 1
+        return self
+
+    async def _acquire_within(self, timeout_seconds: float) -> bool:
+        """
+        timeout_seconds以内に枠を確保できればTrue
+        asyncio.wait_for はタイムアウトと確保が競合すると枠を失う（Python 3.9）ため、
+        確保を別タスクで待ち、諦めた後に確保できた枠は返却する
+        """
+        acquire = asyncio.ensure_future(self._semaphore.acquire())
+        try:
+            done, _ = await asyncio.wait({acquire}, timeout=timeout_seconds)
+        except asyncio.CancelledError:
+            self._abandon(acquire)
+            raise
+        if not done:
+            self._abandon(acquire)
+            return False
+        return True
+
+    def _abandon(self, acquire: asyncio.Future) -> None:
+        def release_if_acquired(future: asyncio.Future) -> None:
+            if not future.cancelled() and future.exception() is None:
+                self._semaphore.release()
+
+        acquire.add_done_callback(release_if_acquired)
+        acquire.cancel()
+
+    async def __aexit__(self, exc_type, exc, tb):
+        self.in_flight -= 1
+        self._semaphore.release()
+        return False
+
+ocr_limiter = InFlightLimiter(
+    OCR_MAX_IN_FLIGHT, OCR_MAX_WAITING, OCR_QUEUE_TIMEOUT_SECONDS, OCR_RETRY_AFTER_SECONDS
+)
 
 class GcsUri(BaseModel):
     gcs_uri: str
@@ -35,14 +119,18 @@ def clean_and_convert_amount(amount_str: str) -> Optional[int]:
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
-    global docai_client, storage_client, RESOURCE_NAME
-    docai_client = documentai.DocumentProcessorServiceClient(
-        client_options=ClientOptions(api_endpoint=f"{LOCATION}-documentai.googleapis.com")
-    )
-    storage_client = storage.Client()
-    RESOURCE_NAME = docai_client.processor_path(PROJECT_ID, LOCATION, PROCESSOR_ID)
-    print("Clients initialized.")
+    global ocr_engine, storage_client
+    engine = create_engine(PROJECT_ID, LOCATION, PROCESSOR_ID)
+    await engine.start()
+    ocr_engine = engine
+    try:
+        storage_client = storage.Client()
+    except Exception as e:
+        # ローカルの再生エンジンではGCS認証情報がなくても起動できるようにする
+        print(f"Storage client is not available: {e}")
+    print(f"Clients initialized. (engine: {ocr_engine.name}, max in-flight OCR: {ocr_limiter.max_in_flight})")
     yield
+    await ocr_engine.stop()
     print("Shutting down.")
 
 app = FastAPI(lifespan=lifespan)
@@ -51,64 +139,102 @@ app = FastAPI(lifespan=lifespan)
 def read_root():
     return {"Hello": "OCR Processor"}
 
+@app.get("/health")
+def health():
+    """OCRエンジンと同時実行数の状態を返す"""
+    return {
+        "engine": ocr_engine.name if ocr_engine else None,
+        "in_flight": ocr_limiter.in_flight,
+        "waiting": ocr_limiter.waiting,
+        "max_in_flight": ocr_limiter.max_in_flight,
+    }
+
+async def process_document(image_content: bytes, mime_type: str) -> list:
+    """
+    同時実行数の制限内でOCRエンジンを呼び出す
+    OCRバックエンドのクォータ超過・一時障害は429/503（Retry-After付き）として返す
+    """
+    async with ocr_limiter:
+        try:
+            return await ocr_engine.process(image_content, mime_type)
+        except OcrEngineBusyError as e:
+            raise ocr_limiter.reject(e.status_code, e.detail)
+
+async def extract_receipt_data(image_content: bytes, mime_type: str) -> dict:
+    """OCRエンジンで画像を解析し、店名・電話番号・合計金額・明細を抽出する"""
+    entities = await process_document(image_content, mime_type)
+
+    total_amount = None
+    supplier_name = None
+    supplier_phone = None
+    line_items = []
+
+    for entity in entities:
+        entity_type = entity["type"]
+        if entity_type == "total_amount":
+            total_amount = clean_and_convert_amount(entity["mention_text"])
+        elif entity_type == "supplier_name":
+            supplier_name = entity["mention_text"]
+        elif entity_type == "supplier_phone":
+            supplier_phone = entity["mention_text"]
+        elif entity_type == "line_item":
+            item_data = {}
+            for prop in entity["properties"]:
+                if prop["type"] == "line_item/description":
+                    item_data["description"] = prop["mention_text"]
+                elif prop["type"] == "line_item/amount":
+                    item_data["amount"] = clean_and_convert_amount(prop["mention_text"])
+            if item_data:
+                line_items.append(item_data)
+
+    if not total_amount and not supplier_name and not line_items:
+        raise HTTPException(status_code=400, detail="Receipt information could not be extracted.")
+
+    return {
+        "supplier_name": supplier_name,
+        "supplier_phone": supplier_phone,
+        "total_amount": total_amount,
+        "line_items": line_items,
+    }
+
 @app.post("/process-gcs/")
 async def process_receipt_from_gcs(payload: GcsUri):
-    if not all([docai_client, storage_client, RESOURCE_NAME]):
+    if not all([ocr_engine, storage_client]):
         raise HTTPException(status_code=503, detail="Service is not initialized.")
 
     try:
         gcs_uri = payload.gcs_uri
         gcs_bucket_name, gcs_blob_name = gcs_uri.replace("gs://", "").split("/", 1)
 
-        # GCSからファイルをダウンロード
+        # GCSからファイルをダウンロード（Storageクライアントは同期APIのためスレッドで実行）
         bucket = storage_client.bucket(gcs_bucket_name)
         blob = bucket.blob(gcs_blob_name)
-        image_content = blob.download_as_bytes()
+        image_content = await asyncio.to_thread(blob.download_as_bytes)
         
         # ファイルのMIMEタイプを取得
         mime_type = blob.content_type
 
-        raw_document = documentai.RawDocument(
-            content=image_content, mime_type=mime_type
-        )
-        request = documentai.ProcessRequest(
-            name=RESOURCE_NAME, raw_document=raw_document
-        )
-        result = docai_client.process_document(request=request)
-        document = result.document
-
-        total_amount = None
-        supplier_name = None
-        supplier_phone = None
-        line_items = []
-
-        for entity in document.entities:
-            entity_type = entity.type_
-            if entity_type == "total_amount":
-                total_amount = clean_and_convert_amount(entity.mention_text)
-            elif entity_type == "supplier_name":
-                supplier_name = entity.mention_text
-            elif entity_type == "supplier_phone":
-                supplier_phone = entity.mention_text
-            elif entity_type == "line_item":
-                item_data = {}
-                for prop in entity.properties:
-                    if prop.type_ == "line_item/description":
-                        item_data["description"] = prop.mention_text
-                    elif prop.type_ == "line_item/amount":
-                        item_data["amount"] = clean_and_convert_amount(prop.mention_text)
-                if item_data:
-                    line_items.append(item_data)
-        
-        if not total_amount and not supplier_name and not line_items:
-            raise HTTPException(status_code=400, detail="Receipt information could not be extracted.")
+        return await extract_receipt_data(image_content, mime_type)
+
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
 
-        return {
-            "supplier_name": supplier_name,
-            "supplier_phone": supplier_phone,
-            "total_amount": total_amount,
-            "line_items": line_items,
-        }
+@app.post("/process-bytes/")
+async def process_receipt_from_bytes(file: UploadFile = File(...)):
+    """
+    画像をリクエストボディで直接受け取って解析する
+    （core-apiがGCSへの保存と並行して呼び出すため、GCSからの再ダウンロードが不要）
+    """
+    if ocr_engine is None:
+        raise HTTPException(status_code=503, detail="Service is not initialized.")
+
+    try:
+        image_content = await file.read()
+        return await extract_receipt_data(image_content, file.content_type)
 
+    except HTTPException:
+        raise
     except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
\ No newline at end of file
+        raise HTTPException(status_code=500, detail=str(e))
@@ -0,0 +1,62 @@
+#!/usr/bin/env python3
+"""
+OCRフィクスチャ記録ツール
+
+指定ディレクトリ内のレシート画像をDocument AIで解析し、
+再生エンジン（OCR_ENGINE=replay）用のフィクスチャとして保存します。
+フィクスチャには画像のSHA-256・entities・実測レイテンシが含まれます。
+
+使い方:
+    GCP_PROJECT_ID=... DOCAI_PROCESSOR_ID=... \\
+        python scripts/record_ocr_fixtures.py --images ./samples --output ./fixtures
+"""
+
+import argparse
+import asyncio
+import mimetypes
+import os
+import sys
+import time
+
+# プロジェクトルートをPythonパスに追加
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.engines import DocumentAiEngine, OCR_FIXTURE_DIR, save_fixture
+from app.main import PROJECT_ID, LOCATION, PROCESSOR_ID
+
+async def record(images_dir: str, output_dir: str) -> None:
+    engine = DocumentAiEngine(PROJECT_ID, LOCATION, PROCESSOR_ID, record_fixtures=False)
+    await engine.start()
+
+    recorded = 0
+    for name in sorted(os.listdir(images_dir)):
+        path = os.path.join(images_dir, name)
+        mime_type, _ = mimetypes.guess_type(path)
+        if not os.path.isfile(path) or not mime_type:
+            continue
+
+        with open(path, "rb") as f:
+            image_content = f.read()
+
+        start = time.perf_counter()
+        try:
+            entities = await engine.process(image_content, mime_type)
+        except Exception as e:
+            print(f"  ✗ {name}: {e}")
+            continue
+        latency_ms = (time.perf_counter() - start) * 1000
+
+        fixture_path = save_fixture(output_dir, image_content, mime_type, entities, latency_ms)
+        recorded += 1
+        print(f"  ✓ {name}: {len(entities)} entities, {latency_ms:.0f}ms -> {fixture_path}")
+
+    await engine.stop()
+    print(f"記録したフィクスチャ: {recorded}件")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="OCRフィクスチャ記録ツール")
+    parser.add_argument("--images", required=True, help="レシート画像のディレクトリ")
+    parser.add_argument("--output", default=OCR_FIXTURE_DIR, help="フィクスチャの保存先")
+    args = parser.parse_args()
+
+    asyncio.run(record(args.images, args.output))